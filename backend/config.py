@@ -14,10 +14,22 @@ load_dotenv(ROOT_DIR / '.env')
 MONGO_URL = os.environ['MONGO_URL']
 DB_NAME = os.environ['DB_NAME']
 
+# MongoDB connection pool, sized for handlers that issue several queries concurrently
+MONGO_MAX_POOL_SIZE = int(os.environ.get('MONGO_MAX_POOL_SIZE', 200))
+MONGO_MIN_POOL_SIZE = int(os.environ.get('MONGO_MIN_POOL_SIZE', 20))
+MONGO_MAX_IDLE_TIME_MS = 60000
+MONGO_WAIT_QUEUE_TIMEOUT_MS = 5000
+MONGO_SERVER_SELECTION_TIMEOUT_MS = 3000
+# Optional wire compression, e.g. "zstd,snappy" (needs the zstandard / python-snappy packages)
+MONGO_COMPRESSORS = os.environ.get('MONGO_COMPRESSORS', '')
+
 # Application Settings
 APP_TITLE = "Servex Holdings Logistics API"
 APP_VERSION = "2.0.0"
 
+# Worker threads reserved for CPU-bound PDF rendering
+PDF_RENDER_WORKERS = 4
+
 # CORS Settings (if needed in future)
 ALLOWED_ORIGINS = [
     "http://localhost:3000",
@@ -2,11 +2,38 @@
 Database connection module for Servex Holdings backend.
 Manages MongoDB connection using motor async driver.
 """
+import logging
+from datetime import timezone
+
 from motor.motor_asyncio import AsyncIOMotorClient
-from config import MONGO_URL, DB_NAME
+from pymongo.errors import PyMongoError
+from config import (
+    MONGO_URL,
+    DB_NAME,
+    MONGO_MAX_POOL_SIZE,
+    MONGO_MIN_POOL_SIZE,
+    MONGO_MAX_IDLE_TIME_MS,
+    MONGO_WAIT_QUEUE_TIMEOUT_MS,
+    MONGO_SERVER_SELECTION_TIMEOUT_MS,
+    MONGO_COMPRESSORS,
+)
+
+logger = logging.getLogger(__name__)
 
 # MongoDB client and database instances
-client = AsyncIOMotorClient(MONGO_URL)
+client_options = {
+    "maxPoolSize": MONGO_MAX_POOL_SIZE,
+    "minPoolSize": MONGO_MIN_POOL_SIZE,
+    "maxIdleTimeMS": MONGO_MAX_IDLE_TIME_MS,
+    "waitQueueTimeoutMS": MONGO_WAIT_QUEUE_TIMEOUT_MS,
+    "serverSelectionTimeoutMS": MONGO_SERVER_SELECTION_TIMEOUT_MS,
+    # BSON dates are UTC; decode them as aware datetimes so responses carry the +00:00 offset
+    "tz_aware": True,
+    "tzinfo": timezone.utc,
+}
+if MONGO_COMPRESSORS:
+    client_options["compressors"] = MONGO_COMPRESSORS
+client = AsyncIOMotorClient(MONGO_URL, **client_options)
 db = client[DB_NAME]
 
 # Collections (for reference and type hints)
@@ -27,3 +54,266 @@ warehouses_collection = db['warehouses']
 audit_logs_collection = db['audit_logs']
 notifications_collection = db['notifications']
 settings_collection = db['settings']
+
+# Collation comparing digit runs numerically, so "S10" sorts after "S9"
+NUMERIC_COLLATION = {"locale": "en", "numericOrdering": True}
+
+# Indexes backing the hot query shapes: (collection, keys, index options)
+INDEXES = [
+    ("clients", [("tenant_id", 1), ("id", 1)], {"unique": True}),
+    ("client_rates", [("client_id", 1), ("tenant_id", 1), ("effective_from", -1)], {}),
+    ("invoices", [("tenant_id", 1), ("client_id", 1), ("status", 1)], {}),
+    ("invoices", [("tenant_id", 1), ("status", 1), ("due_date", 1)], {}),
+    ("invoices", [("tenant_id", 1), ("invoice_number", 1)], {"unique": True}),
+    ("invoices", [("tenant_id", 1), ("trip_id", 1)], {}),
+    # Multikey: invoices linked to trips through their shipments
+    ("invoices", [("tenant_id", 1), ("shipment_ids", 1)], {}),
+    # Partial: only invoices with money still owed are indexed
+    ("invoices", [("tenant_id", 1), ("outstanding", 1)], {"partialFilterExpression": {"outstanding": {"$gt": 0}}}),
+    ("trips", [("tenant_id", 1), ("id", 1)], {"unique": True}),
+    ("trips", [("tenant_id", 1), ("created_at", -1)], {}),
+    ("trips", [("tenant_id", 1), ("departure_date", -1)], {}),
+    ("trips", [("tenant_id", 1), ("trip_number", 1)], {"unique": True}),
+    ("trips", [("tenant_id", 1), ("trip_number", -1)], {"collation": NUMERIC_COLLATION}),
+    ("payments", [("invoice_id", 1)], {}),
+    ("invoice_line_items", [("invoice_id", 1)], {}),
+    ("invoice_adjustments", [("invoice_id", 1)], {}),
+    ("shipments", [("id", 1)], {}),
+    ("shipments", [("tenant_id", 1), ("trip_id", 1), ("client_id", 1)], {}),
+    ("shipments", [("trip_id", 1), ("client_id", 1)], {}),
+    ("shipments", [("tenant_id", 1), ("status", 1)], {}),
+    ("shipment_pieces", [("shipment_id", 1)], {}),
+    ("shipment_pieces", [("id", 1)], {}),
+    ("trip_expenses", [("trip_id", 1), ("expense_date", -1)], {}),
+    ("trip_documents", [("trip_id", 1), ("uploaded_at", -1)], {}),
+    ("vehicles", [("tenant_id", 1), ("id", 1)], {"unique": True}),
+    ("vehicles", [("tenant_id", 1), ("name", 1)], {}),
+    ("vehicles", [("tenant_id", 1), ("status", 1), ("name", 1)], {}),
+    ("drivers", [("tenant_id", 1), ("id", 1)], {"unique": True}),
+    ("drivers", [("tenant_id", 1), ("name", 1)], {}),
+    ("drivers", [("tenant_id", 1), ("status", 1), ("name", 1)], {}),
+    ("vehicle_compliance", [("vehicle_id", 1), ("expiry_date", 1)], {}),
+    ("vehicle_compliance", [("tenant_id", 1), ("vehicle_id", 1), ("expiry_date", 1)], {}),
+    ("driver_compliance", [("driver_id", 1), ("expiry_date", 1)], {}),
+    ("driver_compliance", [("tenant_id", 1), ("driver_id", 1), ("expiry_date", 1)], {}),
+    ("vehicle_compliance", [("tenant_id", 1), ("reminder_date", 1), ("expiry_date", 1)], {}),
+    ("driver_compliance", [("tenant_id", 1), ("reminder_date", 1), ("expiry_date", 1)], {}),
+    ("vehicle_compliance", [("tenant_id", 1), ("expiry_date", 1)], {}),
+    ("driver_compliance", [("tenant_id", 1), ("expiry_date", 1)], {}),
+    ("notifications", [("tenant_id", 1), ("user_id", 1), ("read_at", 1), ("created_at", -1)], {}),
+    ("audit_logs", [("tenant_id", 1), ("table_name", 1), ("record_id", 1), ("created_at", -1)], {}),
+    ("whatsapp_logs", [("tenant_id", 1), ("invoice_id", 1), ("sent_at", -1)], {}),
+    ("users", [("id", 1)], {"unique": True}),
+    ("user_sessions", [("session_token", 1)], {"unique": True}),
+    # TTL: MongoDB purges sessions once expires_at (a BSON date) has passed
+    ("user_sessions", [("expires_at", 1)], {"expireAfterSeconds": 0}),
+]
+
+
+async def create_indexes():
+    """
+    Create the indexes listed in INDEXES.
+    
+    create_index is a no-op when the index already exists, so this is safe
+    to run on every startup. Failures (e.g. duplicate data blocking a unique
+    index) are logged rather than preventing the app from starting.
+    """
+    for collection, keys, options in INDEXES:
+        try:
+            await db[collection].create_index(keys, **options)
+        except PyMongoError as e:
+            logger.warning(f"Could not create index {keys} on {collection}: {e}")
+
+
+async def convert_session_expiry_dates():
+    """
+    Convert user_sessions.expires_at values stored as ISO strings to BSON dates.
+    
+    Sessions used to be written with an ISO string expiry; the API now writes
+    native datetimes. Only string values are touched, so this is cheap to run
+    on every startup.
+    """
+    try:
+        result = await db.user_sessions.update_many(
+            {"expires_at": {"$type": "string"}},
+            [{"$set": {"expires_at": {"$toDate": "$expires_at"}}}]
+        )
+        if result.modified_count:
+            logger.info(f"Converted expires_at to a date on {result.modified_count} sessions")
+    except PyMongoError as e:
+        logger.warning(f"Could not convert session expiry dates: {e}")
+
+
+async def convert_created_at_dates():
+    """
+    Convert created_at values stored as ISO strings to BSON dates on
+    collections whose documents are now written with native datetimes
+    (vehicles, drivers, their compliance items, trips and trip expenses).
+    
+    Only string values are touched, and strings that don't parse are left
+    as they are.
+    """
+    for collection in (
+        "vehicles", "drivers", "vehicle_compliance", "driver_compliance",
+        "trips", "trip_expenses",
+    ):
+        try:
+            await db[collection].update_many(
+                {"created_at": {"$type": "string"}},
+                [{"$set": {"created_at": {"$dateFromString": {
+                    "dateString": "$created_at",
+                    "onError": "$created_at"
+                }}}}]
+            )
+        except PyMongoError as e:
+            logger.warning(f"Could not convert {collection} created_at dates: {e}")
+
+
+async def backfill_client_rate_tenants():
+    """
+    Copy tenant_id from the owning client onto client_rates created before
+    rates stored it. Only rates without a tenant_id are touched.
+    """
+    try:
+        await db.client_rates.aggregate([
+            {"$match": {"tenant_id": {"$exists": False}}},
+            {"$lookup": {
+                "from": "clients",
+                "localField": "client_id",
+                "foreignField": "id",
+                "as": "client"
+            }},
+            {"$project": {"tenant_id": {"$arrayElemAt": ["$client.tenant_id", 0]}}},
+            {"$match": {"tenant_id": {"$ne": None}}},
+            {"$merge": {
+                "into": "client_rates",
+                "on": "_id",
+                "whenMatched": "merge",
+                "whenNotMatched": "discard"
+            }}
+        ]).to_list(None)
+    except PyMongoError as e:
+        logger.warning(f"Could not backfill client rate tenants: {e}")
+
+
+async def backfill_compliance_tenants():
+    """
+    Copy tenant_id from the owning vehicle/driver onto compliance items
+    created before items stored it. Only items without a tenant_id are touched.
+    """
+    for collection, owners, owner_field in (
+        ("vehicle_compliance", "vehicles", "vehicle_id"),
+        ("driver_compliance", "drivers", "driver_id"),
+    ):
+        try:
+            await db[collection].aggregate([
+                {"$match": {"tenant_id": {"$exists": False}}},
+                {"$lookup": {
+                    "from": owners,
+                    "localField": owner_field,
+                    "foreignField": "id",
+                    "as": "owner"
+                }},
+                {"$project": {"tenant_id": {"$arrayElemAt": ["$owner.tenant_id", 0]}}},
+                {"$match": {"tenant_id": {"$ne": None}}},
+                {"$merge": {
+                    "into": collection,
+                    "on": "_id",
+                    "whenMatched": "merge",
+                    "whenNotMatched": "discard"
+                }}
+            ]).to_list(None)
+        except PyMongoError as e:
+            logger.warning(f"Could not backfill {collection} tenants: {e}")
+
+
+async def backfill_compliance_reminder_dates():
+    """
+    Store reminder_date (expiry_date - reminder_days_before) on compliance
+    items created before items stored it. Only items without reminder_date
+    are touched; unparseable expiry dates are left as null.
+    """
+    reminder_date = {"$dateToString": {"format": "%Y-%m-%d", "date": {"$subtract": [
+        {"$dateFromString": {"dateString": "$expiry_date", "format": "%Y-%m-%d", "onError": None, "onNull": None}},
+        {"$multiply": [{"$ifNull": ["$reminder_days_before", 30]}, 24 * 60 * 60 * 1000]}
+    ]}}}
+    for collection in ("vehicle_compliance", "driver_compliance"):
+        try:
+            await db[collection].update_many(
+                {"reminder_date": {"$exists": False}},
+                [{"$set": {"reminder_date": reminder_date}}]
+            )
+        except PyMongoError as e:
+            logger.warning(f"Could not backfill {collection} reminder dates: {e}")
+
+
+async def backfill_invoice_display_fields():
+    """
+    Copy client name/contact details and trip number onto invoices created
+    before invoices stored them. Only invoices without client_name are touched.
+    """
+    try:
+        await db.invoices.aggregate([
+            {"$match": {"client_name": {"$exists": False}}},
+            {"$lookup": {
+                "from": "clients",
+                "localField": "client_id",
+                "foreignField": "id",
+                "as": "client"
+            }},
+            {"$lookup": {
+                "from": "trips",
+                "localField": "trip_id",
+                "foreignField": "id",
+                "as": "trip"
+            }},
+            {"$project": {
+                "client_name": {"$ifNull": [{"$arrayElemAt": ["$client.name", 0]}, None]},
+                "client_email": {"$ifNull": [{"$arrayElemAt": ["$client.email", 0]}, None]},
+                "client_phone": {"$ifNull": [{"$arrayElemAt": ["$client.phone", 0]}, None]},
+                "client_whatsapp": {"$ifNull": [{"$arrayElemAt": ["$client.whatsapp", 0]}, None]},
+                "trip_number": {"$ifNull": [{"$arrayElemAt": ["$trip.trip_number", 0]}, None]}
+            }},
+            {"$merge": {
+                "into": "invoices",
+                "on": "_id",
+                "whenMatched": "merge",
+                "whenNotMatched": "discard"
+            }}
+        ]).to_list(None)
+    except PyMongoError as e:
+        logger.warning(f"Could not backfill invoice display fields: {e}")
+
+
+async def backfill_invoice_outstanding():
+    """
+    Store paid_amount (sum of the invoice's payments) and outstanding
+    (total - paid_amount) on invoices written before payments kept them in
+    step. Only invoices without paid_amount are touched.
+    """
+    try:
+        await db.invoices.aggregate([
+            {"$match": {"paid_amount": {"$exists": False}}},
+            {"$lookup": {
+                "from": "payments",
+                "localField": "id",
+                "foreignField": "invoice_id",
+                "pipeline": [{"$project": {"_id": 0, "amount": 1}}],
+                "as": "payments"
+            }},
+            {"$project": {
+                "paid_amount": {"$sum": "$payments.amount"},
+                "outstanding": {"$subtract": [
+                    {"$ifNull": ["$total", 0]},
+                    {"$sum": "$payments.amount"}
+                ]}
+            }},
+            {"$merge": {
+                "into": "invoices",
+                "on": "_id",
+                "whenMatched": "merge",
+                "whenNotMatched": "discard"
+            }}
+        ]).to_list(None)
+    except PyMongoError as e:
+        logger.warning(f"Could not backfill invoice outstanding amounts: {e}")
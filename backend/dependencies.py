@@ -3,10 +3,35 @@ Shared dependencies for Servex Holdings backend.
 Contains dependency functions used across multiple routes.
 """
 from fastapi import HTTPException, Request, Depends
-from datetime import datetime, timezone
+from datetime import date, datetime, timezone, timedelta
+from functools import lru_cache
+from typing import NamedTuple
+import hashlib
+
+from cachetools import TTLCache
 
 from database import db
 
+# Short-lived cache of resolved sessions: hashed session token -> (user_doc, expires_at)
+_session_cache = TTLCache(maxsize=10_000, ttl=30)
+
+
+def _session_cache_key(session_token: str) -> str:
+    """Hash the session token so raw tokens are never held in the cache."""
+    return hashlib.sha256(session_token.encode()).hexdigest()[:32]
+
+
+def invalidate_session(session_token: str):
+    """Drop a session from the cache (e.g. on logout)."""
+    _session_cache.pop(_session_cache_key(session_token), None)
+
+
+def invalidate_user_sessions(user_id: str):
+    """Drop every cached session of a user (e.g. after the user is updated or deleted)."""
+    for key, (user_doc, _) in list(_session_cache.items()):
+        if user_doc.get("id") == user_id:
+            _session_cache.pop(key, None)
+
 
 async def get_current_user(request: Request) -> dict:
     """
@@ -33,6 +58,15 @@ async def get_current_user(request: Request) -> dict:
     if not session_token:
         raise HTTPException(status_code=401, detail="Not authenticated")
     
+    cache_key = _session_cache_key(session_token)
+    cached = _session_cache.get(cache_key)
+    if cached:
+        user_doc, expires_at = cached
+        if expires_at < datetime.now(timezone.utc):
+            _session_cache.pop(cache_key, None)
+            raise HTTPException(status_code=401, detail="Session expired")
+        return dict(user_doc)
+    
     # Find session
     session_doc = await db.user_sessions.find_one(
         {"session_token": session_token},
@@ -42,12 +76,14 @@ async def get_current_user(request: Request) -> dict:
     if not session_doc:
         raise HTTPException(status_code=401, detail="Invalid session")
     
-    # Check expiry
+    # Check expiry (stored as a BSON date, which the tz-aware client returns as aware UTC)
     expires_at = session_doc.get("expires_at")
     if isinstance(expires_at, str):
+        # Sessions seeded directly in the database may still use ISO strings,
+        # possibly without an offset
         expires_at = datetime.fromisoformat(expires_at.replace('Z', '+00:00'))
-    if expires_at.tzinfo is None:
-        expires_at = expires_at.replace(tzinfo=timezone.utc)
+        if expires_at.tzinfo is None:
+            expires_at = expires_at.replace(tzinfo=timezone.utc)
     if expires_at < datetime.now(timezone.utc):
         raise HTTPException(status_code=401, detail="Session expired")
     
@@ -60,6 +96,9 @@ async def get_current_user(request: Request) -> dict:
     if not user_doc:
         raise HTTPException(status_code=401, detail="User not found")
     
+    _session_cache[cache_key] = (user_doc, expires_at)
+    user_doc = dict(user_doc)
+    
     return user_doc
 
 
@@ -67,6 +106,10 @@ async def get_tenant_id(user: dict = Depends(get_current_user)) -> str:
     """
     Extract tenant_id from current user.
     
+    FastAPI caches dependency results per request (use_cache=True), so routes
+    that declare both get_tenant_id and get_current_user resolve the user once.
+    Keep the default caching when declaring these dependencies.
+    
     Args:
         user: Current user dict from get_current_user dependency
     
@@ -80,3 +123,32 @@ async def get_tenant_id(user: dict = Depends(get_current_user)) -> str:
     if not tenant_id:
         raise HTTPException(status_code=403, detail="User not associated with a tenant")
     return tenant_id
+
+
+class DateBoundaries(NamedTuple):
+    """Today and the look-ahead dates used for expiry windows, as YYYY-MM-DD strings."""
+    today: str
+    week: str
+    month: str
+    sixty_days: str
+
+
+@lru_cache(maxsize=2)
+def _date_boundaries(today: date) -> DateBoundaries:
+    """Format the boundaries for a date; they only change once a day."""
+    return DateBoundaries(
+        today=today.isoformat(),
+        week=(today + timedelta(days=7)).isoformat(),
+        month=(today + timedelta(days=30)).isoformat(),
+        sixty_days=(today + timedelta(days=60)).isoformat()
+    )
+
+
+def get_date_boundaries() -> DateBoundaries:
+    """
+    Get today's (UTC) expiry window boundaries.
+    
+    Returns:
+        DateBoundaries for the current UTC date
+    """
+    return _date_boundaries(datetime.now(timezone.utc).date())
@@ -11,7 +11,19 @@ import uuid
 from datetime import datetime, timezone
 
 from config import APP_TITLE, APP_VERSION
-from database import db
+from database import (
+    client,
+    db,
+    create_indexes,
+    convert_session_expiry_dates,
+    convert_created_at_dates,
+    backfill_client_rate_tenants,
+    backfill_compliance_tenants,
+    backfill_compliance_reminder_dates,
+    backfill_invoice_display_fields,
+    backfill_invoice_outstanding,
+)
+from services import pdf_service
 from routes import (
     auth_routes,
     client_routes,
@@ -84,10 +96,22 @@ async def lifespan(app: FastAPI):
     """Application lifespan handler"""
     # Startup
     logger.info("Starting up Servex Holdings API...")
+    # Connect the shared client before serving; minPoolSize keeps warm connections from here on
+    await client.admin.command("ping")
+    await create_indexes()
+    await convert_session_expiry_dates()
+    await convert_created_at_dates()
+    await backfill_client_rate_tenants()
+    await backfill_compliance_tenants()
+    await backfill_compliance_reminder_dates()
+    await backfill_invoice_display_fields()
+    await backfill_invoice_outstanding()
     await create_default_admin()
     yield
     # Shutdown
     logger.info("Shutting down Servex Holdings API...")
+    pdf_service.pdf_executor.shutdown(wait=True)
+    client.close()
 
 # Create FastAPI app
 app = FastAPI(title=APP_TITLE, version=APP_VERSION, lifespan=lifespan)
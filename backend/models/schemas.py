@@ -5,7 +5,6 @@ Defines all data validation models used in API requests and responses.
 from pydantic import BaseModel, Field, ConfigDict, EmailStr
 from typing import List, Optional
 from datetime import datetime, timezone, timedelta
-from fastapi import Request, HTTPException, Depends
 import uuid
 
 from models.enums import (
@@ -122,6 +121,7 @@ class ClientRate(ClientRateBase):
     model_config = ConfigDict(extra="ignore")
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     client_id: str
+    tenant_id: Optional[str] = None
     created_by: str
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
@@ -516,6 +516,8 @@ class VehicleCompliance(VehicleComplianceBase):
     model_config = ConfigDict(extra="ignore")
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     vehicle_id: str
+    tenant_id: Optional[str] = None
+    reminder_date: Optional[str] = None  # expiry_date - reminder_days_before, YYYY-MM-DD
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
 # Driver Models
@@ -564,6 +566,8 @@ class DriverCompliance(DriverComplianceBase):
     model_config = ConfigDict(extra="ignore")
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     driver_id: str
+    tenant_id: Optional[str] = None
+    reminder_date: Optional[str] = None  # expiry_date - reminder_days_before, YYYY-MM-DD
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
 # Audit Log Models
@@ -725,53 +729,3 @@ async def create_notification(
     )
     await db.notifications.insert_one(notification.model_dump())
     return notification
-
-async def get_current_user(request: Request) -> dict:
-    """Get current user from session token (cookie or header)"""
-    # Try cookie first
-    session_token = request.cookies.get("session_token")
-    
-    # Fallback to Authorization header
-    if not session_token:
-        auth_header = request.headers.get("Authorization")
-        if auth_header and auth_header.startswith("Bearer "):
-            session_token = auth_header.split(" ")[1]
-    
-    if not session_token:
-        raise HTTPException(status_code=401, detail="Not authenticated")
-    
-    # Find session
-    session_doc = await db.user_sessions.find_one(
-        {"session_token": session_token},
-        {"_id": 0}
-    )
-    
-    if not session_doc:
-        raise HTTPException(status_code=401, detail="Invalid session")
-    
-    # Check expiry
-    expires_at = session_doc.get("expires_at")
-    if isinstance(expires_at, str):
-        expires_at = datetime.fromisoformat(expires_at.replace('Z', '+00:00'))
-    if expires_at.tzinfo is None:
-        expires_at = expires_at.replace(tzinfo=timezone.utc)
-    if expires_at < datetime.now(timezone.utc):
-        raise HTTPException(status_code=401, detail="Session expired")
-    
-    # Find user
-    user_doc = await db.users.find_one(
-        {"id": session_doc["user_id"]},
-        {"_id": 0}
-    )
-    
-    if not user_doc:
-        raise HTTPException(status_code=401, detail="User not found")
-    
-    return user_doc
-
-async def get_tenant_id(user: dict = Depends(get_current_user)) -> str:
-    """Extract tenant_id from current user"""
-    tenant_id = user.get("tenant_id")
-    if not tenant_id:
-        raise HTTPException(status_code=403, detail="User not associated with a tenant")
-    return tenant_id
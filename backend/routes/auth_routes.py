@@ -12,10 +12,11 @@ import bcrypt
 import logging
 
 from database import db
-from dependencies import get_current_user, get_tenant_id
+from dependencies import get_current_user, get_tenant_id, invalidate_session, invalidate_user_sessions
 from models.schemas import (
     User, UserCreate, UserUpdate, UserBase, AuthUser, Tenant
 )
+from utils.helpers import invalidate_tenant_defaults
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
@@ -81,7 +82,7 @@ async def login(request: LoginRequest, response: Response):
     session_doc = {
         "user_id": user["id"],
         "session_token": session_token,
-        "expires_at": (datetime.now(timezone.utc) + timedelta(days=7)).isoformat(),
+        "expires_at": datetime.now(timezone.utc) + timedelta(days=7),
         "created_at": datetime.now(timezone.utc).isoformat()
     }
     await db.user_sessions.insert_one(session_doc)
@@ -176,7 +177,7 @@ async def register(request: RegisterRequest, response: Response):
     session_doc = {
         "user_id": user_id,
         "session_token": session_token,
-        "expires_at": (datetime.now(timezone.utc) + timedelta(days=7)).isoformat(),
+        "expires_at": datetime.now(timezone.utc) + timedelta(days=7),
         "created_at": datetime.now(timezone.utc).isoformat()
     }
     await db.user_sessions.insert_one(session_doc)
@@ -233,6 +234,7 @@ async def update_default_warehouse(
         {"id": current_user["id"]},
         {"$set": {"default_warehouse": warehouse_id}}
     )
+    invalidate_user_sessions(current_user["id"])
     
     return {"message": "Default warehouse updated", "default_warehouse": warehouse_id}
 
@@ -243,6 +245,7 @@ async def logout(request: Request, response: Response):
     
     if session_token:
         await db.user_sessions.delete_one({"session_token": session_token})
+        invalidate_session(session_token)
     
     response.delete_cookie(key="session_token", path="/")
     return {"message": "Logged out successfully"}
@@ -274,6 +277,7 @@ async def update_tenant(
     
     if update_dict:
         await db.tenants.update_one({"id": tenant_id}, {"$set": update_dict})
+        invalidate_tenant_defaults(tenant_id)
     
     tenant = await db.tenants.find_one({"id": tenant_id}, {"_id": 0})
     return tenant
@@ -484,6 +488,7 @@ async def update_user(
     
     if update_dict:
         await db.users.update_one({"id": user_id}, {"$set": update_dict})
+        invalidate_user_sessions(user_id)
     
     updated_user = await db.users.find_one({"id": user_id}, {"_id": 0, "password_hash": 0})
     return updated_user
@@ -507,5 +512,6 @@ async def delete_user(
     
     # Also delete user sessions
     await db.user_sessions.delete_many({"user_id": user_id})
+    invalidate_user_sessions(user_id)
     
     return {"message": "User deleted successfully"}
@@ -3,23 +3,42 @@ Client routes for Servex Holdings backend.
 Handles client CRUD operations and client rate management.
 """
 from fastapi import APIRouter, HTTPException, Depends
-from typing import List, Optional
-from datetime import datetime, timezone
+from fastapi.responses import ORJSONResponse
+import asyncio
+from typing import Optional
+from datetime import datetime, timezone, timedelta
 
 from database import db
 from dependencies import get_current_user, get_tenant_id
 from models.schemas import Client, ClientCreate, ClientUpdate, ClientRate, ClientRateCreate, ClientRateBase
 from models.enums import ClientStatus
+from utils.helpers import get_tenant_defaults, invalidate_dashboard_cache
 
 router = APIRouter()
 
-@router.get("/clients", response_model=List[Client])
+# Invoice statuses that still count towards a client's amount owed
+UNPAID_INVOICE_STATUSES = ["sent", "overdue", "draft"]
+
+# clients-with-stats sort options: stored fields sort right after $match,
+# computed fields sort on these expressions at the end of the pipeline
+STORED_SORT_FIELDS = ("created_at",)
+COMPUTED_SORT_KEYS = {
+    "amount_owed": "$amount_owed",
+    "total_spent": "$total_spent",
+    "rate": {"$ifNull": ["$current_rate", 0]},
+}
+
+# Only the fields the Client model exposes; extra fields stored on client docs are not returned
+CLIENT_PROJECTION = {"_id": 0, **{field: 1 for field in Client.model_fields}}
+CLIENT_RATE_PROJECTION = {"_id": 0, **{field: 1 for field in ClientRate.model_fields}}
+
+@router.get("/clients", response_class=ORJSONResponse)
 async def list_clients(tenant_id: str = Depends(get_tenant_id)):
     """List all clients"""
-    clients = await db.clients.find({"tenant_id": tenant_id}, {"_id": 0}).to_list(1000)
+    clients = await db.clients.find({"tenant_id": tenant_id}, CLIENT_PROJECTION).to_list(1000)
     return clients
 
-@router.get("/clients-with-stats")
+@router.get("/clients-with-stats", response_class=ORJSONResponse)
 async def list_clients_with_stats(
     trip_id: Optional[str] = None,
     sort_by: Optional[str] = "name",
@@ -31,11 +50,11 @@ async def list_clients_with_stats(
     # If filtering by trip, get client IDs that have parcels in that trip
     client_ids_filter = None
     if trip_id:
-        parcels = await db.shipments.find(
-            {"tenant_id": tenant_id, "trip_id": trip_id},
-            {"client_id": 1, "_id": 0}
-        ).to_list(10000)
-        client_ids_filter = list(set(p["client_id"] for p in parcels if p.get("client_id")))
+        client_ids = await db.shipments.distinct(
+            "client_id",
+            {"tenant_id": tenant_id, "trip_id": trip_id}
+        )
+        client_ids_filter = [cid for cid in client_ids if cid]
         if not client_ids_filter:
             return []
     
@@ -44,87 +63,108 @@ async def list_clients_with_stats(
     if client_ids_filter:
         query["id"] = {"$in": client_ids_filter}
     
-    clients = await db.clients.find(query, {"_id": 0}).to_list(1000)
+    tomorrow = (datetime.now(timezone.utc) + timedelta(days=1)).strftime("%Y-%m-%d")
+    sort_direction = -1 if sort_order == "desc" else 1
     
-    # Enrich with financial data
-    result = []
-    today = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+    pipeline = [{"$match": query}]
     
-    for client in clients:
-        client_id = client["id"]
-        
-        # Get current rate from client_rates or fall back to client's default rate
-        rates = await db.client_rates.find(
-            {"client_id": client_id},
-            {"_id": 0}
-        ).to_list(100)
-        
-        current_rate = None
-        rate_type = None
-        if rates:
-            effective_rates = []
-            for rate in rates:
-                effective_from = rate.get("effective_from", "")
-                if effective_from:
-                    effective_date = effective_from[:10] if len(effective_from) >= 10 else effective_from
-                    if effective_date <= today:
-                        effective_rates.append((effective_date, rate))
-            if effective_rates:
-                effective_rates.sort(key=lambda x: x[0], reverse=True)
-                rate_obj = effective_rates[0][1]
-                current_rate = rate_obj.get("rate_per_kg") or rate_obj.get("rate_value") or 0
-                rate_type = rate_obj.get("rate_type", "per_kg")
-        
-        # Fall back to client's default rate if no rate entries
-        if current_rate is None:
-            current_rate = client.get("default_rate_value")
-            rate_type = client.get("default_rate_type", "per_kg")
-        
-        # Get invoices for this client
-        invoices = await db.invoices.find(
-            {"tenant_id": tenant_id, "client_id": client_id},
-            {"_id": 0, "id": 1, "total": 1, "status": 1}
-        ).to_list(1000)
-        
-        # Calculate amount owed (unpaid invoices) and total spent (paid invoices)
-        amount_owed = 0
-        total_spent = 0
-        
-        for inv in invoices:
-            inv_total = inv.get("total", 0) or 0
-            inv_status = inv.get("status", "")
-            
-            if inv_status == "paid":
-                total_spent += inv_total
-            elif inv_status in ["sent", "overdue", "draft"]:
-                # Get payments for this invoice to subtract from owed
-                payments = await db.payments.find(
-                    {"invoice_id": inv["id"]},
-                    {"_id": 0, "amount": 1}
-                ).to_list(100)
-                paid_amount = sum(p.get("amount", 0) for p in payments)
-                amount_owed += (inv_total - paid_amount)
-        
-        result.append({
-            **client,
-            "current_rate": current_rate,
-            "rate_type": rate_type,
-            "amount_owed": round(amount_owed, 2),
-            "total_spent": round(total_spent, 2)
-        })
+    # Sort on stored fields straight after $match so an index can serve it
+    if sort_by in STORED_SORT_FIELDS:
+        pipeline.append({"$sort": {sort_by: sort_direction}})
+    elif sort_by == "name":
+        # Case-insensitive name order; the aggregate keeps the simple collation
+        # so the $lookup stages below can use their indexes
+        pipeline.append({"$addFields": {"name_key": {"$toLower": "$name"}}})
+        pipeline.append({"$sort": {"name_key": sort_direction}})
+    
+    pipeline += [
+        {"$project": CLIENT_PROJECTION},
+        # Latest rate entry effective on or before today (effective_from is a date or ISO timestamp)
+        {"$lookup": {
+            "from": "client_rates",
+            "let": {"client_id": "$id"},
+            "pipeline": [
+                {"$match": {
+                    "tenant_id": tenant_id,
+                    "effective_from": {"$gt": "", "$lt": tomorrow},
+                    "$expr": {"$eq": ["$client_id", "$$client_id"]}
+                }},
+                {"$sort": {"effective_from": -1}},
+                {"$limit": 1},
+                {"$project": {"_id": 0, "rate_per_kg": 1, "rate_value": 1, "rate_type": 1}}
+            ],
+            "as": "current_rate_doc"
+        }},
+        # Invoices for this client with their paid amount summed from payments
+        {"$lookup": {
+            "from": "invoices",
+            "let": {"client_id": "$id"},
+            "pipeline": [
+                {"$match": {
+                    "tenant_id": tenant_id,
+                    "status": {"$in": ["paid"] + UNPAID_INVOICE_STATUSES},
+                    "$expr": {"$eq": ["$client_id", "$$client_id"]}
+                }},
+                {"$lookup": {
+                    "from": "payments",
+                    "localField": "id",
+                    "foreignField": "invoice_id",
+                    "as": "payments"
+                }},
+                {"$project": {
+                    "_id": 0,
+                    "status": 1,
+                    "total": {"$ifNull": ["$total", 0]},
+                    "paid_amount": {"$sum": "$payments.amount"}
+                }}
+            ],
+            "as": "invoices"
+        }},
+        {"$addFields": {
+            "current_rate_doc": {"$arrayElemAt": ["$current_rate_doc", 0]},
+            "amount_owed": {"$round": [{"$sum": {"$map": {
+                "input": "$invoices",
+                "as": "inv",
+                "in": {"$cond": [
+                    {"$in": ["$$inv.status", UNPAID_INVOICE_STATUSES]},
+                    {"$subtract": ["$$inv.total", "$$inv.paid_amount"]},
+                    0
+                ]}
+            }}}, 2]},
+            "total_spent": {"$round": [{"$sum": {"$map": {
+                "input": "$invoices",
+                "as": "inv",
+                "in": {"$cond": [{"$eq": ["$$inv.status", "paid"]}, "$$inv.total", 0]}
+            }}}, 2]}
+        }},
+        # Fall back to client's default rate if no effective rate entry
+        {"$addFields": {
+            "current_rate": {"$cond": [
+                {"$ifNull": ["$current_rate_doc", False]},
+                {"$cond": [
+                    "$current_rate_doc.rate_per_kg",
+                    "$current_rate_doc.rate_per_kg",
+                    {"$cond": ["$current_rate_doc.rate_value", "$current_rate_doc.rate_value", 0]}
+                ]},
+                {"$ifNull": ["$default_rate_value", None]}
+            ]},
+            "rate_type": {"$cond": [
+                {"$ifNull": ["$current_rate_doc", False]},
+                {"$ifNull": ["$current_rate_doc.rate_type", "per_kg"]},
+                {"$ifNull": ["$default_rate_type", "per_kg"]}
+            ]}
+        }}
+    ]
     
-    # Sort results
-    reverse = sort_order == "desc"
-    if sort_by == "name":
-        result.sort(key=lambda x: x.get("name", "").lower(), reverse=reverse)
-    elif sort_by == "amount_owed":
-        result.sort(key=lambda x: x.get("amount_owed", 0), reverse=reverse)
-    elif sort_by == "total_spent":
-        result.sort(key=lambda x: x.get("total_spent", 0), reverse=reverse)
-    elif sort_by == "rate":
-        result.sort(key=lambda x: x.get("current_rate") or 0, reverse=reverse)
-    elif sort_by == "created_at":
-        result.sort(key=lambda x: x.get("created_at", ""), reverse=reverse)
+    # Sort on computed fields
+    sort_key = COMPUTED_SORT_KEYS.get(sort_by)
+    if sort_key is not None:
+        pipeline.append({"$addFields": {"sort_key": sort_key}})
+        pipeline.append({"$sort": {"sort_key": sort_direction}})
+    
+    pipeline.append({"$project": {"current_rate_doc": 0, "invoices": 0, "sort_key": 0}})
+    
+    result = await db.clients.aggregate(pipeline).to_list(1000)
     
     return result
 
@@ -144,7 +184,7 @@ async def create_client(
     """Create a new client"""
     # Get tenant default rate if not provided
     if not client_data.default_rate_value or client_data.default_rate_value == 36.0:
-        tenant = await db.tenants.find_one({"id": tenant_id}, {"_id": 0})
+        tenant = await get_tenant_defaults(tenant_id)
         if tenant:
             client_dict = client_data.model_dump()
             client_dict["default_rate_value"] = tenant.get("default_rate_value", 36.0)
@@ -155,9 +195,9 @@ async def create_client(
     else:
         client = Client(**client_data.model_dump(), tenant_id=tenant_id)
     
-    doc = client.model_dump()
-    doc['created_at'] = doc['created_at'].isoformat()
+    doc = client.model_dump(mode="json")
     await db.clients.insert_one(doc)
+    invalidate_dashboard_cache(tenant_id)
     
     return client
 
@@ -175,8 +215,21 @@ async def update_client(
             {"id": client_id, "tenant_id": tenant_id},
             {"$set": update_dict}
         )
+        invalidate_dashboard_cache(tenant_id)
         if result.matched_count == 0:
             raise HTTPException(status_code=404, detail="Client not found")
+        
+        # Keep the client display fields denormalised on invoices in sync
+        invoice_fields = {
+            f"client_{field}": update_dict[field]
+            for field in ("name", "email", "phone", "whatsapp")
+            if field in update_dict
+        }
+        if invoice_fields:
+            await db.invoices.update_many(
+                {"tenant_id": tenant_id, "client_id": client_id},
+                {"$set": invoice_fields}
+            )
     
     client = await db.clients.find_one({"id": client_id, "tenant_id": tenant_id}, {"_id": 0})
     return client
@@ -185,6 +238,7 @@ async def update_client(
 async def delete_client(client_id: str, tenant_id: str = Depends(get_tenant_id)):
     """Delete client"""
     result = await db.clients.delete_one({"id": client_id, "tenant_id": tenant_id})
+    invalidate_dashboard_cache(tenant_id)
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Client not found")
     return {"message": "Client deleted"}
@@ -197,61 +251,42 @@ async def get_client_current_rate(
     tenant_id: str = Depends(get_tenant_id)
 ):
     """Get the current/latest rate for a client"""
-    # Verify client belongs to tenant
-    client = await db.clients.find_one({"id": client_id, "tenant_id": tenant_id}, {"_id": 0})
-    if not client:
-        raise HTTPException(status_code=404, detail="Client not found")
+    # Latest rate effective on or before today. effective_from holds either a
+    # date or a full ISO timestamp, so compare as strings against tomorrow's date.
+    tomorrow = (datetime.now(timezone.utc) + timedelta(days=1)).strftime("%Y-%m-%d")
     
-    # Get all rates for this client and find the most recent effective one
-    all_rates = await db.client_rates.find(
-        {"client_id": client_id},
-        {"_id": 0}
-    ).to_list(100)
+    # Rates carry tenant_id, so filtering on it doubles as the ownership check
+    rate = await db.client_rates.find_one(
+        {"client_id": client_id, "tenant_id": tenant_id, "effective_from": {"$gt": "", "$lt": tomorrow}},
+        {"_id": 0},
+        sort=[("effective_from", -1)]
+    )
     
-    if not all_rates:
+    if not rate:
         return {"client_id": client_id, "rate_per_kg": None, "message": "No rate set for this client"}
     
-    today = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+    # Normalize the response - support both rate_value and rate_per_kg field names
+    rate_per_kg = rate.get("rate_per_kg") or rate.get("rate_value") or 0
     
-    # Filter rates that are effective (effective_from <= today)
-    # Handle both date-only and full ISO timestamp formats
-    effective_rates = []
-    for rate in all_rates:
-        effective_from = rate.get("effective_from", "")
-        if effective_from:
-            # Extract just the date part (first 10 chars) for comparison
-            effective_date = effective_from[:10] if len(effective_from) >= 10 else effective_from
-            if effective_date <= today:
-                effective_rates.append((effective_date, rate))
-    
-    if effective_rates:
-        # Sort by effective_date descending and get the most recent
-        effective_rates.sort(key=lambda x: x[0], reverse=True)
-        rate = effective_rates[0][1]
-        
-        # Normalize the response - support both rate_value and rate_per_kg field names
-        rate_per_kg = rate.get("rate_per_kg") or rate.get("rate_value") or 0
-        
-        return {
-            **rate,
-            "rate_per_kg": rate_per_kg  # Ensure rate_per_kg is always present
-        }
-    
-    # No effective rate found
-    return {"client_id": client_id, "rate_per_kg": None, "message": "No rate set for this client"}
+    return {
+        **rate,
+        "rate_per_kg": rate_per_kg  # Ensure rate_per_kg is always present
+    }
 
-@router.get("/clients/{client_id}/rates", response_model=List[ClientRate])
+@router.get("/clients/{client_id}/rates", response_class=ORJSONResponse)
 async def list_client_rates(
     client_id: str,
     tenant_id: str = Depends(get_tenant_id)
 ):
     """List rates for a client"""
-    # Verify client belongs to tenant
-    client = await db.clients.find_one({"id": client_id, "tenant_id": tenant_id}, {"_id": 0})
+    # Verify client belongs to tenant while fetching its rates
+    client, rates = await asyncio.gather(
+        db.clients.find_one({"id": client_id, "tenant_id": tenant_id}, {"_id": 1}),
+        db.client_rates.find({"client_id": client_id}, CLIENT_RATE_PROJECTION).to_list(100)
+    )
     if not client:
         raise HTTPException(status_code=404, detail="Client not found")
     
-    rates = await db.client_rates.find({"client_id": client_id}, {"_id": 0}).to_list(100)
     return rates
 
 @router.post("/clients/{client_id}/rates", response_model=ClientRate)
@@ -270,14 +305,23 @@ async def create_client_rate(
     rate = ClientRate(
         **rate_data.model_dump(),
         client_id=client_id,
+        tenant_id=tenant_id,
         created_by=user["id"]
     )
     
-    if not rate.effective_from:
+    # Store effective_from as a plain YYYY-MM-DD date so rate lookups can
+    # range-compare it directly against the (client_id, effective_from) index
+    if rate.effective_from:
+        try:
+            rate.effective_from = datetime.fromisoformat(
+                rate.effective_from.replace('Z', '+00:00')
+            ).strftime("%Y-%m-%d")
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid effective_from date")
+    else:
         rate.effective_from = datetime.now(timezone.utc).strftime("%Y-%m-%d")
     
-    doc = rate.model_dump()
-    doc['created_at'] = doc['created_at'].isoformat()
+    doc = rate.model_dump(mode="json")
     await db.client_rates.insert_one(doc)
     
     return rate
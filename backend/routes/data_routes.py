@@ -12,6 +12,7 @@ import uuid
 from database import db
 from dependencies import get_current_user, get_tenant_id
 from services.barcode_service import generate_barcode
+from utils.helpers import get_tenant_defaults, invalidate_dashboard_cache
 
 router = APIRouter()
 
@@ -57,6 +58,9 @@ async def reset_tenant_data(
     await db.trips.delete_many({"tenant_id": tenant_id})
     await db.clients.delete_many({"tenant_id": tenant_id})
     await db.client_rates.delete_many({"tenant_id": tenant_id})
+    # Invoice numbering restarts along with the deleted invoices
+    await db.counters.delete_many({"_id": {"$regex": f"^invoice:{tenant_id}:"}})
+    invalidate_dashboard_cache(tenant_id)
     
     # Also delete recipients if collection exists
     try:
@@ -104,7 +108,7 @@ async def import_parcels_from_csv(
     reader = csv.DictReader(io.StringIO(text_content))
     
     # Get tenant settings for default rate
-    tenant = await db.tenants.find_one({"id": tenant_id}, {"_id": 0})
+    tenant = await get_tenant_defaults(tenant_id)
     default_rate_value = tenant.get("default_rate_value", 36.0) if tenant else 36.0
     default_rate_type = tenant.get("default_rate_type", "per_kg") if tenant else "per_kg"
     
@@ -291,6 +295,8 @@ async def import_parcels_from_csv(
             stats["parcels_created"] += 1
             stats["total_weight"] += weight
     
+    invalidate_dashboard_cache(tenant_id)
+    
     # Build summary message
     if target_warehouse:
         summary = f"Imported {stats['parcels_created']} parcels for {stats['clients_created'] + stats['clients_matched']} clients to {target_warehouse['name']}. Total weight: {round(stats['total_weight'], 2)} kg"
@@ -329,7 +335,7 @@ async def import_clients_from_csv(
     text_content = content.decode('utf-8')
     
     # Get tenant settings for default rate
-    tenant = await db.tenants.find_one({"id": tenant_id}, {"_id": 0})
+    tenant = await get_tenant_defaults(tenant_id)
     default_rate_value = tenant.get("default_rate_value", 36.0) if tenant else 36.0
     default_rate_type = tenant.get("default_rate_type", "per_kg") if tenant else "per_kg"
     
@@ -356,13 +362,13 @@ async def import_clients_from_csv(
     }
     
     # Get existing client names for duplicate detection
-    existing_clients = await db.clients.find(
-        {"tenant_id": tenant_id},
-        {"_id": 0, "name": 1}
-    ).to_list(10000)
-    existing_names = {c["name"].lower() for c in existing_clients}
+    existing_names = {
+        c["name"].lower()
+        async for c in db.clients.find({"tenant_id": tenant_id}, {"_id": 0, "name": 1})
+    }
     
     now = datetime.now(timezone.utc).isoformat()
+    new_clients = []
     
     for row in reader:
         if has_headers:
@@ -422,10 +428,14 @@ async def import_clients_from_csv(
             "created_by": user["id"]
         }
         
-        await db.clients.insert_one(client)
+        new_clients.append(client)
         existing_names.add(name.lower())
         stats["imported"] += 1
     
+    if new_clients:
+        await db.clients.insert_many(new_clients)
+        invalidate_dashboard_cache(tenant_id)
+    
     summary = f"Imported {stats['imported']} clients successfully."
     if stats["skipped"] > 0:
         summary += f" {stats['skipped']} rows skipped (missing name)."
@@ -449,11 +459,11 @@ async def export_clients_to_csv(
     """
     from fastapi.responses import StreamingResponse
     
-    # Get all active clients
-    clients = await db.clients.find(
+    # Stream all active clients straight into the CSV
+    clients = db.clients.find(
         {"tenant_id": tenant_id, "status": {"$ne": "merged"}},
         {"_id": 0}
-    ).to_list(10000)
+    )
     
     # Build CSV content
     output = io.StringIO()
@@ -463,7 +473,7 @@ async def export_clients_to_csv(
     writer.writerow(['Client Name', 'Phone', 'Email', 'VAT No', 'Physical Address', 'Billing Address', 'Rate'])
     
     # Write client rows
-    for client in clients:
+    async for client in clients:
         writer.writerow([
             client.get('name', ''),
             client.get('phone', ''),
@@ -3,26 +3,51 @@ Finance routes for Servex Holdings backend.
 Handles finance hub operations: client statements, trip worksheets, overdue tracking.
 """
 from fastapi import APIRouter, HTTPException, Depends
-from fastapi.responses import StreamingResponse
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from pydantic import BaseModel
 from typing import List, Optional
+from collections import defaultdict
 from datetime import datetime, timezone, timedelta
 from io import BytesIO
+import asyncio
+import hashlib
 import uuid
 
+from cachetools import TTLCache
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from reportlab.lib.units import mm
+from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
+from reportlab.lib.enums import TA_CENTER
+
 from database import db
 from dependencies import get_current_user, get_tenant_id
 from models.enums import InvoiceStatus
+from services.pdf_service import run_pdf_render
 
 router = APIRouter()
 
+# Rendered trip worksheet PDFs keyed by (tenant_id, trip_id, generated-at minute,
+# data fingerprint). The footer prints the generation time to the minute, so a
+# cached PDF is only reused within that minute and never shows a stale time
+_worksheet_pdf_cache = TTLCache(maxsize=100, ttl=60)
+
+# Projections for the finance views - only the fields each view reads
+TRIP_PROJECTION = {"_id": 0, "id": 1, "trip_number": 1, "status": 1, "route": 1, "departure_date": 1}
+INVOICE_PROJECTION = {
+    "_id": 0, "id": 1, "invoice_number": 1, "client_id": 1, "trip_id": 1,
+    "client_name": 1, "client_email": 1, "trip_number": 1, "recipient": 1,
+    "total": 1, "paid_amount": 1, "status": 1, "due_date": 1, "created_at": 1
+}
+
 # ============ SETTINGS - CURRENCIES ============
 
 @router.get("/settings/currencies")
 async def get_currencies(tenant_id: str = Depends(get_tenant_id)):
     """Get currency settings including exchange rates"""
     # Try to get from tenant settings, fallback to defaults
-    settings = await db.settings.find_one({"tenant_id": tenant_id}, {"_id": 0})
+    settings = await db.settings.find_one({"tenant_id": tenant_id}, {"_id": 0, "currencies": 1})
     
     if settings and settings.get("currencies"):
         return {"currencies": settings["currencies"]}
@@ -52,118 +77,144 @@ async def update_currencies(
     
     return {"message": "Currencies updated", "currencies": currencies}
 
-@router.get("/finance/client-statements")
+@router.get("/finance/client-statements", response_class=ORJSONResponse)
 async def get_client_statements(tenant_id: str = Depends(get_tenant_id)):
     """
     Get all clients with their outstanding amounts grouped by trip.
     Returns data matching the Excel statement summary format.
     """
-    # Get all clients for this tenant (limit to 1000)
-    clients = await db.clients.find({"tenant_id": tenant_id}).to_list(1000)
+    # Outstanding per client per trip for invoices that are not fully paid
+    pipeline = [
+        {"$match": {
+            "tenant_id": tenant_id,
+            "status": {"$in": ["draft", "sent", "overdue"]}
+        }},
+        {"$project": {
+            "_id": 0,
+            "client_id": 1,
+            "trip_id": 1,
+            "status": 1,
+            "outstanding": {"$subtract": [
+                {"$ifNull": ["$total", 0]},
+                {"$ifNull": ["$paid_amount", 0]}
+            ]}
+        }},
+        {"$group": {
+            "_id": {"client_id": "$client_id", "trip_id": "$trip_id"},
+            "outstanding": {"$sum": "$outstanding"},
+            # Only invoices with something left to pay count towards the trip columns
+            "trip_outstanding": {"$sum": {"$cond": [{"$gt": ["$outstanding", 0]}, "$outstanding", 0]}},
+            "overdue": {"$sum": {"$cond": [{"$eq": ["$status", "overdue"]}, "$outstanding", 0]}},
+            "count": {"$sum": 1}
+        }},
+        {"$group": {
+            "_id": "$_id.client_id",
+            "total_outstanding": {"$sum": "$outstanding"},
+            "overdue": {"$sum": "$overdue"},
+            "invoice_count": {"$sum": "$count"},
+            "trips": {"$push": {"trip_id": "$_id.trip_id", "outstanding": "$trip_outstanding"}}
+        }},
+        {"$match": {"total_outstanding": {"$gt": 0}}},
+        {"$lookup": {
+            "from": "clients",
+            "let": {"client_id": "$_id"},
+            "pipeline": [
+                {"$match": {"tenant_id": tenant_id, "$expr": {"$eq": ["$id", "$$client_id"]}}},
+                {"$project": {"_id": 0, "name": 1, "email": 1, "phone": 1}}
+            ],
+            "as": "client"
+        }},
+        {"$unwind": "$client"},
+        # Per-client rows and the summary totals from the same pass
+        {"$facet": {
+            "statements": [
+                {"$sort": {"total_outstanding": -1}},
+                {"$addFields": {"total_outstanding": {"$round": ["$total_outstanding", 2]}}}
+            ],
+            "summary": [
+                {"$group": {
+                    "_id": None,
+                    "total_outstanding": {"$sum": "$total_outstanding"},
+                    "overdue_amount": {"$sum": "$overdue"},
+                    "clients_with_debt": {"$sum": 1}
+                }},
+                {"$project": {
+                    "_id": 0,
+                    "total_outstanding": {"$round": ["$total_outstanding", 2]},
+                    "overdue_amount": {"$round": ["$overdue_amount", 2]},
+                    "clients_with_debt": 1
+                }}
+            ]
+        }}
+    ]
     
-    # Get all trips to determine which trips to show as columns
-    trips = await db.trips.find(
-        {"tenant_id": tenant_id}
-    ).sort("created_at", -1).limit(10).to_list(10)
+    # Recent trips (the statement columns) and the statement facets are independent
+    trips, (facets,) = await asyncio.gather(
+        db.trips.find(
+            {"tenant_id": tenant_id},
+            {"_id": 0, "id": 1, "trip_number": 1}
+        ).sort("created_at", -1).limit(10).to_list(10),
+        db.invoices.aggregate(pipeline).to_list(1)
+    )
     
     trip_numbers = [t.get("trip_number", f"T{i}") for i, t in enumerate(trips)]
     trip_ids = {t.get("id"): t.get("trip_number") for t in trips}
     
-    # Get all invoices that are not fully paid (limit to 5000)
-    invoices = await db.invoices.find({
-        "tenant_id": tenant_id,
-        "status": {"$in": ["draft", "sent", "overdue"]}
-    }).to_list(5000)
-    
     # Build client statements
     client_statements = []
-    total_outstanding = 0
-    total_overdue = 0
-    
-    for client in clients:
-        client_id = client.get("id")
-        client_invoices = [inv for inv in invoices if inv.get("client_id") == client_id]
-        
-        if not client_invoices:
-            continue
-        
-        # Calculate total outstanding for this client
-        client_total = sum(
-            (inv.get("total", 0) - inv.get("paid_amount", 0))
-            for inv in client_invoices
-        )
-        
-        if client_total <= 0:
-            continue
-        
-        # Group by trip
-        trip_amounts = {}
-        for inv in client_invoices:
-            trip_id = inv.get("trip_id")
-            trip_num = trip_ids.get(trip_id, "Other")
-            outstanding = inv.get("total", 0) - inv.get("paid_amount", 0)
+    for row in facets["statements"]:
+        # Group by trip, folding trips outside the recent columns into "Other"
+        trip_amounts = defaultdict(float)
+        for trip in row["trips"]:
+            outstanding = trip["outstanding"]
             if outstanding > 0:
-                trip_amounts[trip_num] = trip_amounts.get(trip_num, 0) + outstanding
-        
-        # Count overdue
-        client_overdue = sum(
-            (inv.get("total", 0) - inv.get("paid_amount", 0))
-            for inv in client_invoices
-            if inv.get("status") == "overdue"
-        )
-        
-        total_outstanding += client_total
-        total_overdue += client_overdue
+                trip_amounts[trip_ids.get(trip.get("trip_id"), "Other")] += outstanding
         
+        client = row["client"]
         client_statements.append({
-            "client_id": client_id,
+            "client_id": row["_id"],
             "client_name": client.get("name", "Unknown"),
             "client_email": client.get("email"),
             "client_phone": client.get("phone"),
-            "total_outstanding": round(client_total, 2),
-            "trip_amounts": trip_amounts,
-            "invoice_count": len(client_invoices),
-            "has_overdue": client_overdue > 0
+            "total_outstanding": row["total_outstanding"],
+            "trip_amounts": dict(trip_amounts),
+            "invoice_count": row["invoice_count"],
+            "has_overdue": row["overdue"] > 0
         })
     
-    # Sort by total outstanding (highest first)
-    client_statements.sort(key=lambda x: x["total_outstanding"], reverse=True)
+    # The summary facet is empty when no client owes anything
+    summary = facets["summary"][0] if facets["summary"] else {
+        "total_outstanding": 0,
+        "clients_with_debt": 0,
+        "overdue_amount": 0
+    }
     
     return {
         "statements": client_statements,
         "trip_columns": trip_numbers[:8],  # Show last 8 trips
-        "summary": {
-            "total_outstanding": round(total_outstanding, 2),
-            "clients_with_debt": len(client_statements),
-            "overdue_amount": round(total_overdue, 2)
-        }
+        "summary": summary
     }
 
 @router.get("/finance/client-statements/{client_id}/invoices")
 async def get_client_statement_invoices(client_id: str, tenant_id: str = Depends(get_tenant_id)):
     """Get all unpaid/partial invoices for a specific client"""
-    invoices = await db.invoices.find({
+    cursor = db.invoices.find({
         "tenant_id": tenant_id,
         "client_id": client_id,
         "status": {"$in": ["draft", "sent", "overdue"]}
-    }).sort("created_at", -1).to_list(1000)
-    
-    # Get trip info for each invoice
-    trip_ids = list(set(inv.get("trip_id") for inv in invoices if inv.get("trip_id")))
-    trips = await db.trips.find({"id": {"$in": trip_ids}}).to_list(1000)
-    trip_map = {t.get("id"): t for t in trips}
+    }, INVOICE_PROJECTION).sort("created_at", -1).limit(1000).batch_size(500)
     
     result = []
-    for inv in invoices:
-        trip = trip_map.get(inv.get("trip_id"), {})
-        outstanding = inv.get("total", 0) - inv.get("paid_amount", 0)
+    async for inv in cursor:
+        total = inv.get("total", 0)
+        paid = inv.get("paid_amount", 0)
         result.append({
             "id": inv.get("id"),
             "invoice_number": inv.get("invoice_number"),
-            "trip_number": trip.get("trip_number", "-"),
-            "total": inv.get("total", 0),
-            "paid_amount": inv.get("paid_amount", 0),
-            "outstanding": outstanding,
+            "trip_number": inv.get("trip_number") or "-",
+            "total": total,
+            "paid_amount": paid,
+            "outstanding": total - paid,
             "due_date": inv.get("due_date"),
             "status": inv.get("status"),
             "created_at": inv.get("created_at")
@@ -174,35 +225,33 @@ async def get_client_statement_invoices(client_id: str, tenant_id: str = Depends
 
 # ============ FINANCE - TRIP WORKSHEETS ============
 
+async def get_trip_client_weights(trip_id: str) -> dict:
+    """Total shipment weight per client on a trip, summed by MongoDB"""
+    pipeline = [
+        {"$match": {"trip_id": trip_id, "client_id": {"$nin": [None, ""]}}},
+        {"$group": {"_id": "$client_id", "weight": {"$sum": "$total_weight"}}}
+    ]
+    return {row["_id"]: row["weight"] async for row in db.shipments.aggregate(pipeline)}
+
+
 @router.get("/finance/trip-worksheet/{trip_id}")
 async def get_trip_worksheet(trip_id: str, tenant_id: str = Depends(get_tenant_id)):
     """
     Get invoice breakdown for a specific trip (like the S25 Worksheet PDF).
     """
-    # Get trip - use id field instead of _id
-    trip = await db.trips.find_one({"id": trip_id, "tenant_id": tenant_id})
+    # Get trip - use id field instead of _id - and map client_id to total shipment weight
+    trip, client_weights = await asyncio.gather(
+        db.trips.find_one({"id": trip_id, "tenant_id": tenant_id}, TRIP_PROJECTION),
+        get_trip_client_weights(trip_id)
+    )
     if not trip:
         raise HTTPException(status_code=404, detail="Trip not found")
     
-    # Get all invoices for this trip
-    invoices = await db.invoices.find({
+    # Stream all invoices for this trip
+    cursor = db.invoices.find({
         "tenant_id": tenant_id,
         "trip_id": trip_id
-    }).to_list(1000)
-    
-    # Get clients - use id field instead of _id
-    client_ids = list(set(inv.get("client_id") for inv in invoices if inv.get("client_id")))
-    clients = await db.clients.find({"id": {"$in": client_ids}}).to_list(1000)
-    client_map = {c.get("id"): c for c in clients}
-    
-    # Get shipments for weight info
-    shipments = await db.shipments.find({"trip_id": trip_id}).to_list(1000)
-    # Map client_id to total weight
-    client_weights = {}
-    for s in shipments:
-        cid = s.get("client_id")
-        if cid:
-            client_weights[cid] = client_weights.get(cid, 0) + (s.get("total_weight", 0) or 0)
+    }, INVOICE_PROJECTION).limit(1000).batch_size(500)
     
     # Build invoice list
     invoice_list = []
@@ -210,9 +259,10 @@ async def get_trip_worksheet(trip_id: str, tenant_id: str = Depends(get_tenant_i
     total_collected = 0
     total_outstanding = 0
     invoices_paid = 0
+    now_iso = datetime.now(timezone.utc).isoformat()
     
-    for inv in invoices:
-        client = client_map.get(inv.get("client_id"), {})
+    async for inv in cursor:
+        client_name = inv.get("client_name") or "Unknown"
         total = inv.get("total", 0)
         paid = inv.get("paid_amount", 0)
         outstanding = total - paid
@@ -222,41 +272,30 @@ async def get_trip_worksheet(trip_id: str, tenant_id: str = Depends(get_tenant_i
         total_collected += paid
         total_outstanding += outstanding
         
-        if inv.get("status") == "paid":
-            invoices_paid += 1
-        
         # Determine status for display
         status = inv.get("status", "draft")
-        if status == "sent" and inv.get("due_date"):
-            try:
-                due_str = inv["due_date"]
-                if isinstance(due_str, str):
-                    if 'T' in due_str:
-                        due = datetime.fromisoformat(due_str.replace("Z", "+00:00"))
-                    else:
-                        due = datetime.fromisoformat(due_str).replace(tzinfo=timezone.utc)
-                else:
-                    due = due_str
-                if due and due.tzinfo is None:
-                    due = due.replace(tzinfo=timezone.utc)
-                if due < datetime.now(timezone.utc):
-                    status = "overdue"
-            except (ValueError, TypeError, AttributeError):
-                pass
+        due_date = inv.get("due_date")
+        if status == "paid":
+            invoices_paid += 1
+        elif status == "sent" and due_date and due_date < now_iso:
+            # ISO strings order lexically; a date-only due_date sorts before any
+            # timestamp on that day, so an invoice is overdue from the start of its
+            # due date (UTC), same as /finance/overdue
+            status = "overdue"
         
         invoice_list.append({
             "id": inv.get("id"),
             "invoice_number": inv.get("invoice_number"),
             "client_id": inv.get("client_id"),
-            "client_name": client.get("name", "Unknown"),
-            "client_email": client.get("email"),
-            "recipient": inv.get("recipient") or client.get("name", "-"),
+            "client_name": client_name,
+            "client_email": inv.get("client_email"),
+            "recipient": inv.get("recipient") or inv.get("client_name") or "-",
             "weight_kg": round(weight, 2),
             "total_amount": round(total, 2),
             "paid_amount": round(paid, 2),
             "outstanding": round(outstanding, 2),
             "status": status,
-            "due_date": inv.get("due_date"),
+            "due_date": due_date,
             "created_at": inv.get("created_at")
         })
     
@@ -277,48 +316,66 @@ async def get_trip_worksheet(trip_id: str, tenant_id: str = Depends(get_tenant_i
             "total_outstanding": round(total_outstanding, 2),
             "collection_percent": round((total_collected / total_revenue * 100) if total_revenue > 0 else 0, 1),
             "invoices_paid": invoices_paid,
-            "invoices_total": len(invoices)
+            "invoices_total": len(invoice_list)
         },
         "invoices": invoice_list
     }
 
 
-@router.get("/finance/trip-worksheet/{trip_id}/pdf")
-async def get_trip_worksheet_pdf(trip_id: str, tenant_id: str = Depends(get_tenant_id)):
-    """
-    Generate PDF worksheet for a trip with invoice breakdown.
+# Trip worksheet PDF colors and styles, built once and shared by every render
+OLIVE = colors.HexColor('#6B633C')
+DARK_GRAY = colors.HexColor('#3C3F42')
+LIGHT_GRAY = colors.HexColor('#F5F5F5')
+
+
+def build_worksheet_styles():
     """
-    from reportlab.lib import colors
-    from reportlab.lib.pagesizes import A4
-    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-    from reportlab.lib.units import mm
-    from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
-    from reportlab.lib.enums import TA_RIGHT, TA_CENTER, TA_LEFT
-    
-    # Get trip
-    trip = await db.trips.find_one({"id": trip_id, "tenant_id": tenant_id})
-    if not trip:
-        raise HTTPException(status_code=404, detail="Trip not found")
-    
-    # Get all invoices for this trip
-    invoices = await db.invoices.find({
-        "tenant_id": tenant_id,
-        "trip_id": trip_id
-    }, {"_id": 0}).to_list(1000)
-    
-    # Get clients
-    client_ids = list(set(inv.get("client_id") for inv in invoices if inv.get("client_id")))
-    clients = await db.clients.find({"id": {"$in": client_ids}}, {"_id": 0}).to_list(1000)
-    client_map = {c.get("id"): c for c in clients}
-    
-    # Get shipments for weight info
-    shipments = await db.shipments.find({"trip_id": trip_id}, {"_id": 0}).to_list(1000)
-    client_weights = {}
-    for s in shipments:
-        cid = s.get("client_id")
-        if cid:
-            client_weights[cid] = client_weights.get(cid, 0) + (s.get("total_weight", 0) or 0)
+    Build the trip worksheet paragraph styles.
     
+    Returns:
+        The sample style sheet extended with the Worksheet* styles
+    """
+    # Use unique names to avoid conflicts with getSampleStyleSheet()
+    styles = getSampleStyleSheet()
+    styles.add(ParagraphStyle(name='WorksheetTitle', fontSize=18, fontName='Helvetica-Bold', textColor=OLIVE, alignment=TA_CENTER))
+    styles.add(ParagraphStyle(name='WorksheetSubtitle', fontSize=12, fontName='Helvetica', textColor=DARK_GRAY, alignment=TA_CENTER))
+    styles.add(ParagraphStyle(name='WorksheetSectionTitle', fontSize=11, fontName='Helvetica-Bold', textColor=DARK_GRAY))
+    styles.add(ParagraphStyle(name='WorksheetFooter', fontSize=8, textColor=colors.gray, alignment=TA_CENTER))
+    return styles
+
+
+WORKSHEET_STYLES = build_worksheet_styles()
+
+SUMMARY_TABLE_STYLE = TableStyle([
+    ('BACKGROUND', (0, 0), (-1, 0), OLIVE),
+    ('TEXTCOLOR', (0, 0), (-1, 0), colors.white),
+    ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+    ('FONTSIZE', (0, 0), (-1, -1), 10),
+    ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+    ('GRID', (0, 0), (-1, -1), 0.5, colors.lightgrey),
+    ('BOTTOMPADDING', (0, 0), (-1, -1), 6),
+    ('TOPPADDING', (0, 0), (-1, -1), 6),
+])
+
+INVOICE_TABLE_STYLE = TableStyle([
+    ('BACKGROUND', (0, 0), (-1, 0), OLIVE),
+    ('TEXTCOLOR', (0, 0), (-1, 0), colors.white),
+    ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+    ('FONTSIZE', (0, 0), (-1, -1), 9),
+    ('ALIGN', (2, 0), (-1, -1), 'RIGHT'),
+    ('ALIGN', (0, 0), (1, -1), 'LEFT'),
+    ('GRID', (0, 0), (-1, -1), 0.5, colors.lightgrey),
+    ('BOTTOMPADDING', (0, 0), (-1, -1), 5),
+    ('TOPPADDING', (0, 0), (-1, -1), 5),
+    # Alternating row colors, starting below the header
+    ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, LIGHT_GRAY]),
+])
+
+
+def render_trip_worksheet_pdf(trip: dict, invoices: list, client_weights: dict, generated_at: str) -> bytes:
+    """
+    Render the trip worksheet PDF and return its bytes.
+    """
     # Calculate totals
     total_revenue = sum(inv.get("total", 0) for inv in invoices)
     total_paid = sum(inv.get("paid_amount", 0) for inv in invoices)
@@ -328,17 +385,7 @@ async def get_trip_worksheet_pdf(trip_id: str, tenant_id: str = Depends(get_tena
     buffer = BytesIO()
     doc = SimpleDocTemplate(buffer, pagesize=A4, leftMargin=15*mm, rightMargin=15*mm, topMargin=15*mm, bottomMargin=15*mm)
     
-    # Define colors
-    olive = colors.HexColor('#6B633C')
-    dark_gray = colors.HexColor('#3C3F42')
-    light_gray = colors.HexColor('#F5F5F5')
-    
-    # Styles - use unique names to avoid conflicts with getSampleStyleSheet()
-    styles = getSampleStyleSheet()
-    styles.add(ParagraphStyle(name='WorksheetTitle', fontSize=18, fontName='Helvetica-Bold', textColor=olive, alignment=TA_CENTER))
-    styles.add(ParagraphStyle(name='WorksheetSubtitle', fontSize=12, fontName='Helvetica', textColor=dark_gray, alignment=TA_CENTER))
-    styles.add(ParagraphStyle(name='WorksheetSectionTitle', fontSize=11, fontName='Helvetica-Bold', textColor=dark_gray))
-    
+    styles = WORKSHEET_STYLES
     elements = []
     
     # Title
@@ -362,16 +409,7 @@ async def get_trip_worksheet_pdf(trip_id: str, tenant_id: str = Depends(get_tena
         [f"R {total_revenue:,.2f}", f"R {total_paid:,.2f}", f"R {total_outstanding:,.2f}", f"{len(invoices)}"]
     ]
     summary_table = Table(summary_data, colWidths=[45*mm, 45*mm, 45*mm, 35*mm])
-    summary_table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (-1, 0), olive),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.white),
-        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, -1), 10),
-        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-        ('GRID', (0, 0), (-1, -1), 0.5, colors.lightgrey),
-        ('BOTTOMPADDING', (0, 0), (-1, -1), 6),
-        ('TOPPADDING', (0, 0), (-1, -1), 6),
-    ]))
+    summary_table.setStyle(SUMMARY_TABLE_STYLE)
     elements.append(summary_table)
     elements.append(Spacer(1, 8*mm))
     
@@ -379,65 +417,74 @@ async def get_trip_worksheet_pdf(trip_id: str, tenant_id: str = Depends(get_tena
     elements.append(Paragraph("Invoice Details", styles['WorksheetSectionTitle']))
     elements.append(Spacer(1, 3*mm))
     
-    # Invoice table header
-    table_data = [['Invoice #', 'Client', 'Weight (kg)', 'Total', 'Paid', 'Outstanding', 'Status']]
-    
-    # Sort invoices by client name
-    sorted_invoices = sorted(invoices, key=lambda x: client_map.get(x.get("client_id"), {}).get("name", "").lower())
-    
-    for inv in sorted_invoices:
-        client = client_map.get(inv.get("client_id"), {})
-        weight = client_weights.get(inv.get("client_id"), 0)
-        total = inv.get("total", 0)
-        paid = inv.get("paid_amount", 0)
-        outstanding = total - paid
-        status = inv.get("status", "draft").title()
-        
-        table_data.append([
+    # Invoice table header and rows (invoices arrive sorted by client name)
+    table_data = [['Invoice #', 'Client', 'Weight (kg)', 'Total', 'Paid', 'Outstanding', 'Status']] + [
+        [
             inv.get("invoice_number", "-"),
-            client.get("name", "Unknown")[:25],
-            f"{weight:.1f}",
-            f"R {total:,.2f}",
-            f"R {paid:,.2f}",
-            f"R {outstanding:,.2f}",
-            status
-        ])
+            (inv.get("client_name") or "Unknown")[:25],
+            f"{client_weights.get(inv.get('client_id'), 0):.1f}",
+            f"R {inv.get('total', 0):,.2f}",
+            f"R {inv.get('paid_amount', 0):,.2f}",
+            f"R {inv.get('total', 0) - inv.get('paid_amount', 0):,.2f}",
+            inv.get("status", "draft").title()
+        ]
+        for inv in invoices
+    ]
     
     if len(table_data) == 1:
         table_data.append(['-', 'No invoices found', '-', '-', '-', '-', '-'])
     
     invoice_table = Table(table_data, colWidths=[25*mm, 45*mm, 20*mm, 28*mm, 28*mm, 28*mm, 18*mm])
-    invoice_table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (-1, 0), olive),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.white),
-        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, -1), 9),
-        ('ALIGN', (2, 0), (-1, -1), 'RIGHT'),
-        ('ALIGN', (0, 0), (1, -1), 'LEFT'),
-        ('GRID', (0, 0), (-1, -1), 0.5, colors.lightgrey),
-        ('BOTTOMPADDING', (0, 0), (-1, -1), 5),
-        ('TOPPADDING', (0, 0), (-1, -1), 5),
-    ]))
-    
-    # Alternating row colors
-    for i in range(1, len(table_data)):
-        if i % 2 == 0:
-            invoice_table.setStyle(TableStyle([('BACKGROUND', (0, i), (-1, i), light_gray)]))
+    invoice_table.setStyle(INVOICE_TABLE_STYLE)
     
     elements.append(invoice_table)
     elements.append(Spacer(1, 10*mm))
     
     # Footer
-    elements.append(Paragraph(f"Generated on {datetime.now().strftime('%Y-%m-%d %H:%M')} | Servex Holdings", 
-                              ParagraphStyle(name='Footer', fontSize=8, textColor=colors.gray, alignment=TA_CENTER)))
+    elements.append(Paragraph(f"Generated on {generated_at} | Servex Holdings", 
+                              styles['WorksheetFooter']))
     
     # Build PDF
     doc.build(elements)
-    buffer.seek(0)
+    return buffer.getvalue()
+
+
+@router.get("/finance/trip-worksheet/{trip_id}/pdf")
+async def get_trip_worksheet_pdf(trip_id: str, tenant_id: str = Depends(get_tenant_id)):
+    """
+    Generate PDF worksheet for a trip with invoice breakdown.
+    """
+    # Fetch the trip, its invoices and client_id -> total shipment weight together
+    trip, invoices, client_weights = await asyncio.gather(
+        db.trips.find_one({"id": trip_id, "tenant_id": tenant_id}, TRIP_PROJECTION),
+        db.invoices.find({
+            "tenant_id": tenant_id,
+            "trip_id": trip_id
+        }, INVOICE_PROJECTION).to_list(1000),
+        get_trip_client_weights(trip_id)
+    )
+    if not trip:
+        raise HTTPException(status_code=404, detail="Trip not found")
+    
+    # Order by client name in memory; a collated query could not use the
+    # (tenant_id, trip_id) index
+    invoices.sort(key=lambda inv: (inv.get("client_name") or "").lower())
+    
+    # Reuse the rendered PDF while the worksheet data is unchanged
+    fingerprint = hashlib.sha256(
+        repr((trip, invoices, sorted(client_weights.items()))).encode()
+    ).hexdigest()
+    generated_at = datetime.now().strftime('%Y-%m-%d %H:%M')
+    cache_key = (tenant_id, trip_id, generated_at, fingerprint)
+    pdf_bytes = _worksheet_pdf_cache.get(cache_key)
+    if pdf_bytes is None:
+        pdf_bytes = await run_pdf_render(render_trip_worksheet_pdf, trip, invoices, client_weights, generated_at)
+        _worksheet_pdf_cache[cache_key] = pdf_bytes
     
+    trip_number = trip.get("trip_number", "Unknown")
     filename = f"Worksheet-{trip_number}.pdf"
     return StreamingResponse(
-        buffer,
+        BytesIO(pdf_bytes),
         media_type="application/pdf",
         headers={"Content-Disposition": f"attachment; filename={filename}"}
     )
@@ -445,81 +492,59 @@ async def get_trip_worksheet_pdf(trip_id: str, tenant_id: str = Depends(get_tena
 
 # ============ FINANCE - OVERDUE INVOICES ============
 
-@router.get("/finance/overdue")
+@router.get("/finance/overdue", response_class=ORJSONResponse)
 async def get_overdue_invoices(tenant_id: str = Depends(get_tenant_id)):
     """Get all overdue invoices sorted by days overdue"""
     now = datetime.now(timezone.utc)
     
-    # Get invoices where due_date < now and status is not paid
-    invoices = await db.invoices.find({
-        "tenant_id": tenant_id,
-        "status": {"$in": ["draft", "sent", "overdue"]},
-        "due_date": {"$lt": now.isoformat()}
-    }).to_list(1000)
-    
-    # Get clients - use id field instead of _id
-    client_ids = list(set(inv.get("client_id") for inv in invoices if inv.get("client_id")))
-    clients = await db.clients.find({"id": {"$in": client_ids}}).to_list(1000)
-    client_map = {c.get("id"): c for c in clients}
-    
-    # Get trips - use id field instead of _id
-    trip_ids = list(set(inv.get("trip_id") for inv in invoices if inv.get("trip_id")))
-    trips = await db.trips.find({"id": {"$in": trip_ids}}).to_list(1000)
-    trip_map = {t.get("id"): t for t in trips}
+    # Invoices where due_date < now, status is not paid and something is
+    # still outstanding, with days overdue computed server-side
+    pipeline = [
+        {"$match": {
+            "tenant_id": tenant_id,
+            "status": {"$in": ["draft", "sent", "overdue"]},
+            "outstanding": {"$gt": 0},
+            "due_date": {"$lt": now.isoformat()}
+        }},
+        {"$addFields": {
+            # Date-only and full ISO strings both convert; unparseable dates count as 0 days
+            "due": {"$convert": {"input": "$due_date", "to": "date", "onError": None, "onNull": None}}
+        }},
+        {"$addFields": {
+            "days_overdue": {"$cond": [
+                "$due",
+                {"$floor": {"$divide": [{"$subtract": [now, "$due"]}, 24 * 60 * 60 * 1000]}},
+                0
+            ]}
+        }},
+        {"$sort": {"days_overdue": -1}},
+        {"$limit": 1000},
+        {"$project": {
+            "_id": 0,
+            "id": 1,
+            "invoice_number": 1,
+            "client_id": 1,
+            "client_name": {"$ifNull": ["$client_name", "Unknown"]},
+            "client_email": {"$ifNull": ["$client_email", None]},
+            "client_whatsapp": {"$ifNull": ["$client_whatsapp", {"$ifNull": ["$client_phone", None]}]},
+            "trip_number": {"$ifNull": ["$trip_number", "-"]},
+            "due_date": 1,
+            "days_overdue": {"$toInt": "$days_overdue"},
+            "total": {"$ifNull": ["$total", 0]},
+            "paid_amount": {"$ifNull": ["$paid_amount", 0]},
+            "outstanding": 1
+        }}
+    ]
     
     result = []
-    for inv in invoices:
-        client = client_map.get(inv.get("client_id"), {})
-        trip = trip_map.get(inv.get("trip_id"), {})
-        
-        outstanding = inv.get("total", 0) - inv.get("paid_amount", 0)
-        if outstanding <= 0:
-            continue
-        
-        # Calculate days overdue
-        due_date = inv.get("due_date")
-        if isinstance(due_date, str):
-            # Handle ISO format with or without timezone
-            try:
-                if 'T' in due_date:
-                    due = datetime.fromisoformat(due_date.replace("Z", "+00:00"))
-                else:
-                    # Date-only format like "2025-12-31"
-                    due = datetime.fromisoformat(due_date).replace(tzinfo=timezone.utc)
-            except (ValueError, TypeError, AttributeError):
-                due = None
-            if due and due.tzinfo is None:
-                due = due.replace(tzinfo=timezone.utc)
-        elif due_date:
-            due = due_date
-            if due.tzinfo is None:
-                due = due.replace(tzinfo=timezone.utc)
-        else:
-            due = None
-        
-        days_overdue = (now - due).days if due else 0
-        
-        result.append({
-            "id": inv.get("id"),
-            "invoice_number": inv.get("invoice_number"),
-            "client_id": inv.get("client_id"),
-            "client_name": client.get("name", "Unknown"),
-            "client_email": client.get("email"),
-            "client_whatsapp": client.get("whatsapp") or client.get("phone"),
-            "trip_number": trip.get("trip_number", "-"),
-            "due_date": due_date,
-            "days_overdue": days_overdue,
-            "total": inv.get("total", 0),
-            "paid_amount": inv.get("paid_amount", 0),
-            "outstanding": outstanding
-        })
-    
-    # Sort by days overdue (most overdue first)
-    result.sort(key=lambda x: x["days_overdue"], reverse=True)
+    total_overdue = 0
+    async for inv in db.invoices.aggregate(pipeline):
+        total_overdue += inv["outstanding"]
+        result.append(inv)
     
     return {
         "invoices": result,
-        "total_overdue": sum(i["outstanding"] for i in result),
+        "total_overdue": total_overdue,
         "count": len(result)
     }
 
@@ -544,10 +569,13 @@ async def send_invoice_email(
     NOTE: This is a placeholder - actual email sending requires SMTP configuration.
     """
     # Get invoice - use id field instead of _id
-    invoice = await db.invoices.find_one({"id": invoice_id, "tenant_id": tenant_id})
+    invoice = await db.invoices.find_one({"id": invoice_id, "tenant_id": tenant_id}, {"_id": 1})
     if not invoice:
         raise HTTPException(status_code=404, detail="Invoice not found")
     
+    # One timestamp for the email log, the invoice and the audit entry
+    now_iso = datetime.now(timezone.utc).isoformat()
+    
     # Log the email attempt (even if we can't actually send)
     email_log = {
         "id": str(uuid.uuid4()),
@@ -557,34 +585,33 @@ async def send_invoice_email(
         "subject": request.subject,
         "body": request.body,
         "sent_by": current_user.get("id"),
-        "sent_at": datetime.now(timezone.utc).isoformat(),
+        "sent_at": now_iso,
         "status": "logged"  # Would be "sent" with actual SMTP
     }
     
     # In production, this would use SendGrid or SMTP
-    # For now, we just log it
-    await db.email_logs.insert_one(email_log)
-    
-    # Update invoice with email sent info
-    await db.invoices.update_one(
-        {"id": invoice_id},
-        {"$set": {
-            "email_sent_at": datetime.now(timezone.utc).isoformat(),
-            "email_sent_to": request.to
-        }}
+    # For now, we just log it. The email log, the invoice's email sent info
+    # and the audit log don't depend on each other, so write them together
+    await asyncio.gather(
+        db.email_logs.insert_one(email_log),
+        db.invoices.update_one(
+            {"id": invoice_id},
+            {"$set": {
+                "email_sent_at": now_iso,
+                "email_sent_to": request.to
+            }}
+        ),
+        db.audit_logs.insert_one({
+            "id": str(uuid.uuid4()),
+            "tenant_id": tenant_id,
+            "user_id": current_user.get("id"),
+            "action": "email_sent",
+            "table_name": "invoices",
+            "record_id": invoice_id,
+            "old_value": None,
+            "new_value": {"to": request.to, "subject": request.subject},
+            "created_at": now_iso
+        })
     )
     
-    # Create audit log
-    await db.audit_logs.insert_one({
-        "id": str(uuid.uuid4()),
-        "tenant_id": tenant_id,
-        "user_id": current_user.get("id"),
-        "action": "email_sent",
-        "table_name": "invoices",
-        "record_id": invoice_id,
-        "old_value": None,
-        "new_value": {"to": request.to, "subject": request.subject},
-        "created_at": datetime.now(timezone.utc).isoformat()
-    })
-    
     return {"message": "Email sent successfully (MOCKED)", "to": request.to}
@@ -3,18 +3,154 @@ Fleet routes for Servex Holdings backend.
 Handles vehicle and driver management including compliance tracking.
 """
 from fastapi import APIRouter, HTTPException, Depends, UploadFile, File
+from fastapi.responses import ORJSONResponse
 from typing import List, Optional
-from datetime import datetime, timezone, timedelta
+from datetime import date, datetime, timezone, timedelta
+from bisect import bisect_right
+from operator import itemgetter
+import asyncio
 import base64
 
+from cachetools import TTLCache
+from pymongo import ReturnDocument
+
 from database import db
-from dependencies import get_current_user, get_tenant_id
+from dependencies import get_current_user, get_tenant_id, get_date_boundaries, DateBoundaries
 from models.schemas import Vehicle, VehicleCreate, VehicleUpdate, VehicleCompliance, VehicleComplianceCreate, Driver, DriverCreate, DriverUpdate, DriverCompliance, DriverComplianceCreate, NotificationCreate, WhatsAppLogCreate
 from models.enums import VehicleStatus, VehicleComplianceType, DriverStatus, DriverComplianceType, WhatsAppStatus
+from utils.helpers import (
+    get_unread_notification_count as cached_unread_count, seed_unread_count, invalidate_unread_count,
+    get_cached_dashboard_stats, cache_dashboard_stats
+)
 
 router = APIRouter()
 
-@router.get("/vehicles")
+# Projections for the reminder/compliance overviews - only the fields they read
+VEHICLE_SUMMARY_PROJECTION = {"_id": 0, "id": 1, "name": 1, "registration_number": 1}
+DRIVER_SUMMARY_PROJECTION = {"_id": 0, "id": 1, "name": 1, "phone": 1}
+COMPLIANCE_ITEM_FIELDS = {
+    "_id": 0, "id": 1, "item_type": 1, "item_label": 1, "expiry_date": 1,
+    "reminder_days_before": 1, "notify_channels": 1, "file_name": 1, "file_type": 1
+}
+VEHICLE_COMPLIANCE_PROJECTION = {**COMPLIANCE_ITEM_FIELDS, "vehicle_id": 1, "provider": 1, "policy_number": 1}
+DRIVER_COMPLIANCE_PROJECTION = {**COMPLIANCE_ITEM_FIELDS, "driver_id": 1, "license_number": 1, "issuing_country": 1}
+
+# Per-tenant cache for the read-heavy compliance overviews; fleet writes clear it
+_compliance_cache = TTLCache(maxsize=2000, ttl=300)
+
+
+def invalidate_compliance_cache(tenant_id: str):
+    """Drop a tenant's cached compliance reminders and overview"""
+    _compliance_cache.pop((tenant_id, "reminders"), None)
+    _compliance_cache.pop((tenant_id, "all"), None)
+
+
+# Shipment statuses broken out on the dashboard
+DASHBOARD_SHIPMENT_STATUSES = ("warehouse", "in_transit", "delivered")
+
+
+def compliance_reminder_date(expiry_date: str, reminder_days_before: int) -> str:
+    """
+    Work out the day a compliance item's reminder window opens.
+    
+    Args:
+        expiry_date: Expiry date in format YYYY-MM-DD
+        reminder_days_before: Days before expiry that reminders start
+    
+    Returns:
+        Reminder date string in format YYYY-MM-DD
+    """
+    try:
+        expiry = date.fromisoformat(expiry_date)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid expiry_date, expected YYYY-MM-DD")
+    return (expiry - timedelta(days=reminder_days_before)).isoformat()
+
+
+def compliance_summary_pipeline(query: dict, compliance_collection: str, owner_field: str) -> list:
+    """
+    Build the pipeline listing vehicles/drivers with their compliance_issues count.
+    
+    Args:
+        query: Match filter for the vehicles/drivers collection
+        compliance_collection: Compliance collection to look up (vehicle_compliance/driver_compliance)
+        owner_field: Field on compliance items referencing the owner (vehicle_id/driver_id)
+    
+    Returns:
+        Aggregation pipeline; each document gets compliance_issues, the number
+        of compliance items that have already expired
+    """
+    today = get_date_boundaries().today
+    return [
+        {"$match": query},
+        {"$sort": {"name": 1}},
+        {"$limit": 100},
+        {"$lookup": {
+            "from": compliance_collection,
+            "let": {"owner_id": "$id"},
+            "pipeline": [
+                {"$match": {"$expr": {"$and": [
+                    {"$eq": [f"${owner_field}", "$$owner_id"]},
+                    {"$lt": ["$expiry_date", today]}
+                ]}}},
+                {"$count": "n"}
+            ],
+            "as": "expired"
+        }},
+        {"$addFields": {"compliance_issues": {"$ifNull": [{"$arrayElemAt": ["$expired.n", 0]}, 0]}}},
+        {"$project": {"_id": 0, "expired": 0}}
+    ]
+
+
+def compliance_reminder_stages(tenant_id: str, entity_type: str, entity_fields: dict, item_fields: tuple, today_str: str) -> list:
+    """
+    Build the stages selecting a tenant's due compliance items as reminder
+    entries joined with their vehicle/driver.
+    
+    Args:
+        tenant_id: Tenant whose compliance items are read
+        entity_type: "vehicle" or "driver"; also names the compliance collection and owner field
+        entity_fields: Extra entry fields taken from the vehicle/driver ("$owner.<field>"), as aggregation expressions
+        item_fields: Type-specific compliance item fields copied onto each entry (None when missing)
+        today_str: Today's date (YYYY-MM-DD); only items within their reminder window or overdue are kept
+    
+    Returns:
+        Pipeline stages for the {entity_type}_compliance collection
+    """
+    owner_field = f"{entity_type}_id"
+    return [
+        # Range scan on the stored reminder_date index
+        {"$match": {"tenant_id": tenant_id, "$or": [
+            {"reminder_date": {"$lte": today_str}},
+            {"expiry_date": {"$lt": today_str}}
+        ]}},
+        {"$lookup": {
+            "from": f"{entity_type}s",
+            "let": {"owner_id": f"${owner_field}"},
+            "pipeline": [
+                {"$match": {"$expr": {"$eq": ["$id", "$$owner_id"]}}},
+                {"$project": {"_id": 0, "name": 1, "registration_number": 1, "phone": 1}}
+            ],
+            "as": "owner"
+        }},
+        {"$unwind": "$owner"},
+        {"$project": {
+            "_id": 0,
+            "type": {"$literal": entity_type},
+            "entity_id": f"${owner_field}",
+            "entity_name": {"$ifNull": ["$owner.name", "Unknown"]},
+            **entity_fields,
+            "compliance_id": "$id",
+            "item_type": "$item_type",
+            "item_label": {"$ifNull": ["$item_label", None]},
+            "expiry_date": "$expiry_date",
+            "notify_channels": {"$ifNull": ["$notify_channels", []]},
+            **{field: {"$ifNull": [f"${field}", None]} for field in item_fields}
+        }}
+    ]
+
+
+@router.get("/vehicles", response_class=ORJSONResponse)
 async def list_vehicles(
     status: Optional[str] = None,
     tenant_id: str = Depends(get_tenant_id)
@@ -24,18 +160,9 @@ async def list_vehicles(
     if status and status != "all":
         query["status"] = status
     
-    vehicles = await db.vehicles.find(query, {"_id": 0}).sort("name", 1).to_list(100)
-    
-    # Add compliance summary for each vehicle
-    for vehicle in vehicles:
-        compliance_items = await db.vehicle_compliance.find(
-            {"vehicle_id": vehicle["id"]},
-            {"_id": 0, "expiry_date": 1, "item_type": 1}
-        ).to_list(100)
-        
-        today = datetime.now(timezone.utc).strftime("%Y-%m-%d")
-        overdue_count = sum(1 for c in compliance_items if c["expiry_date"] < today)
-        vehicle["compliance_issues"] = overdue_count
+    # Add compliance summary (count of expired items) for each vehicle in the same query
+    pipeline = compliance_summary_pipeline(query, "vehicle_compliance", "vehicle_id")
+    vehicles = await db.vehicles.aggregate(pipeline).to_list(100)
     
     return vehicles
 
@@ -67,9 +194,7 @@ async def create_vehicle(
         tenant_id=tenant_id
     )
     
-    doc = vehicle.model_dump()
-    doc['created_at'] = doc['created_at'].isoformat()
-    await db.vehicles.insert_one(doc)
+    await db.vehicles.insert_one(vehicle.model_dump())
     
     return vehicle
 
@@ -82,15 +207,20 @@ async def update_vehicle(
     """Update vehicle"""
     update_dict = {k: v for k, v in update_data.model_dump().items() if v is not None}
     
+    query = {"id": vehicle_id, "tenant_id": tenant_id}
     if update_dict:
-        result = await db.vehicles.update_one(
-            {"id": vehicle_id, "tenant_id": tenant_id},
-            {"$set": update_dict}
+        vehicle = await db.vehicles.find_one_and_update(
+            query,
+            {"$set": update_dict},
+            projection={"_id": 0},
+            return_document=ReturnDocument.AFTER
         )
-        if result.matched_count == 0:
-            raise HTTPException(status_code=404, detail="Vehicle not found")
+    else:
+        vehicle = await db.vehicles.find_one(query, {"_id": 0})
+    if not vehicle:
+        raise HTTPException(status_code=404, detail="Vehicle not found")
     
-    vehicle = await db.vehicles.find_one({"id": vehicle_id, "tenant_id": tenant_id}, {"_id": 0})
+    invalidate_compliance_cache(tenant_id)
     return vehicle
 
 @router.delete("/vehicles/{vehicle_id}")
@@ -99,13 +229,16 @@ async def delete_vehicle(
     tenant_id: str = Depends(get_tenant_id)
 ):
     """Delete vehicle and its compliance items"""
-    result = await db.vehicles.delete_one({"id": vehicle_id, "tenant_id": tenant_id})
+    # Delete the vehicle and its compliance items together; scoping the items
+    # by tenant_id keeps another tenant's vehicle id from touching anything
+    result, _ = await asyncio.gather(
+        db.vehicles.delete_one({"id": vehicle_id, "tenant_id": tenant_id}),
+        db.vehicle_compliance.delete_many({"vehicle_id": vehicle_id, "tenant_id": tenant_id})
+    )
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Vehicle not found")
     
-    # Delete compliance items
-    await db.vehicle_compliance.delete_many({"vehicle_id": vehicle_id})
-    
+    invalidate_compliance_cache(tenant_id)
     return {"message": "Vehicle deleted"}
 
 # Vehicle Compliance Routes
@@ -115,12 +248,8 @@ async def list_vehicle_compliance(
     tenant_id: str = Depends(get_tenant_id)
 ):
     """List compliance items for a vehicle"""
-    vehicle = await db.vehicles.find_one({"id": vehicle_id, "tenant_id": tenant_id}, {"_id": 0})
-    if not vehicle:
-        raise HTTPException(status_code=404, detail="Vehicle not found")
-    
     compliance = await db.vehicle_compliance.find(
-        {"vehicle_id": vehicle_id},
+        {"vehicle_id": vehicle_id, "tenant_id": tenant_id},
         {"_id": 0}
     ).sort("expiry_date", 1).to_list(100)
     
@@ -133,19 +262,20 @@ async def add_vehicle_compliance(
     tenant_id: str = Depends(get_tenant_id)
 ):
     """Add compliance item to vehicle"""
-    vehicle = await db.vehicles.find_one({"id": vehicle_id, "tenant_id": tenant_id}, {"_id": 0})
-    if not vehicle:
+    # Existence check only; counted from the (tenant_id, id) index without fetching the vehicle
+    if not await db.vehicles.count_documents({"id": vehicle_id, "tenant_id": tenant_id}, limit=1):
         raise HTTPException(status_code=404, detail="Vehicle not found")
     
     compliance = VehicleCompliance(
         **compliance_data.model_dump(),
-        vehicle_id=vehicle_id
+        vehicle_id=vehicle_id,
+        tenant_id=tenant_id,
+        reminder_date=compliance_reminder_date(compliance_data.expiry_date, compliance_data.reminder_days_before)
     )
     
-    doc = compliance.model_dump()
-    doc['created_at'] = doc['created_at'].isoformat()
-    await db.vehicle_compliance.insert_one(doc)
+    await db.vehicle_compliance.insert_one(compliance.model_dump())
     
+    invalidate_compliance_cache(tenant_id)
     return compliance
 
 @router.put("/vehicles/{vehicle_id}/compliance/{compliance_id}")
@@ -156,20 +286,20 @@ async def update_vehicle_compliance(
     tenant_id: str = Depends(get_tenant_id)
 ):
     """Update vehicle compliance item"""
-    vehicle = await db.vehicles.find_one({"id": vehicle_id, "tenant_id": tenant_id}, {"_id": 0})
-    if not vehicle:
-        raise HTTPException(status_code=404, detail="Vehicle not found")
-    
     update_dict = update_data.model_dump()
-    
-    result = await db.vehicle_compliance.update_one(
-        {"id": compliance_id, "vehicle_id": vehicle_id},
-        {"$set": update_dict}
+    update_dict["reminder_date"] = compliance_reminder_date(update_data.expiry_date, update_data.reminder_days_before)
+    
+    # tenant_id on the item authorises the update without loading the vehicle
+    compliance = await db.vehicle_compliance.find_one_and_update(
+        {"id": compliance_id, "vehicle_id": vehicle_id, "tenant_id": tenant_id},
+        {"$set": update_dict},
+        projection={"_id": 0},
+        return_document=ReturnDocument.AFTER
     )
-    if result.matched_count == 0:
+    if not compliance:
         raise HTTPException(status_code=404, detail="Compliance item not found")
     
-    compliance = await db.vehicle_compliance.find_one({"id": compliance_id}, {"_id": 0})
+    invalidate_compliance_cache(tenant_id)
     return compliance
 
 @router.delete("/vehicles/{vehicle_id}/compliance/{compliance_id}")
@@ -179,19 +309,18 @@ async def delete_vehicle_compliance(
     tenant_id: str = Depends(get_tenant_id)
 ):
     """Delete vehicle compliance item"""
-    vehicle = await db.vehicles.find_one({"id": vehicle_id, "tenant_id": tenant_id}, {"_id": 0})
-    if not vehicle:
-        raise HTTPException(status_code=404, detail="Vehicle not found")
-    
-    result = await db.vehicle_compliance.delete_one({"id": compliance_id, "vehicle_id": vehicle_id})
+    result = await db.vehicle_compliance.delete_one(
+        {"id": compliance_id, "vehicle_id": vehicle_id, "tenant_id": tenant_id}
+    )
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Compliance item not found")
     
+    invalidate_compliance_cache(tenant_id)
     return {"message": "Compliance item deleted"}
 
 # ============ DRIVER ROUTES ============
 
-@router.get("/drivers")
+@router.get("/drivers", response_class=ORJSONResponse)
 async def list_drivers(
     status: Optional[str] = None,
     tenant_id: str = Depends(get_tenant_id)
@@ -201,18 +330,9 @@ async def list_drivers(
     if status and status != "all":
         query["status"] = status
     
-    drivers = await db.drivers.find(query, {"_id": 0}).sort("name", 1).to_list(100)
-    
-    # Add compliance summary for each driver
-    for driver in drivers:
-        compliance_items = await db.driver_compliance.find(
-            {"driver_id": driver["id"]},
-            {"_id": 0, "expiry_date": 1, "item_type": 1}
-        ).to_list(100)
-        
-        today = datetime.now(timezone.utc).strftime("%Y-%m-%d")
-        overdue_count = sum(1 for c in compliance_items if c["expiry_date"] < today)
-        driver["compliance_issues"] = overdue_count
+    # Add compliance summary (count of expired items) for each driver in the same query
+    pipeline = compliance_summary_pipeline(query, "driver_compliance", "driver_id")
+    drivers = await db.drivers.aggregate(pipeline).to_list(100)
     
     return drivers
 
@@ -244,9 +364,7 @@ async def create_driver(
         tenant_id=tenant_id
     )
     
-    doc = driver.model_dump()
-    doc['created_at'] = doc['created_at'].isoformat()
-    await db.drivers.insert_one(doc)
+    await db.drivers.insert_one(driver.model_dump())
     
     return driver
 
@@ -259,15 +377,20 @@ async def update_driver(
     """Update driver"""
     update_dict = {k: v for k, v in update_data.model_dump().items() if v is not None}
     
+    query = {"id": driver_id, "tenant_id": tenant_id}
     if update_dict:
-        result = await db.drivers.update_one(
-            {"id": driver_id, "tenant_id": tenant_id},
-            {"$set": update_dict}
+        driver = await db.drivers.find_one_and_update(
+            query,
+            {"$set": update_dict},
+            projection={"_id": 0},
+            return_document=ReturnDocument.AFTER
         )
-        if result.matched_count == 0:
-            raise HTTPException(status_code=404, detail="Driver not found")
+    else:
+        driver = await db.drivers.find_one(query, {"_id": 0})
+    if not driver:
+        raise HTTPException(status_code=404, detail="Driver not found")
     
-    driver = await db.drivers.find_one({"id": driver_id, "tenant_id": tenant_id}, {"_id": 0})
+    invalidate_compliance_cache(tenant_id)
     return driver
 
 @router.delete("/drivers/{driver_id}")
@@ -276,13 +399,16 @@ async def delete_driver(
     tenant_id: str = Depends(get_tenant_id)
 ):
     """Delete driver and their compliance items"""
-    result = await db.drivers.delete_one({"id": driver_id, "tenant_id": tenant_id})
+    # Delete the driver and its compliance items together; scoping the items
+    # by tenant_id keeps another tenant's driver id from touching anything
+    result, _ = await asyncio.gather(
+        db.drivers.delete_one({"id": driver_id, "tenant_id": tenant_id}),
+        db.driver_compliance.delete_many({"driver_id": driver_id, "tenant_id": tenant_id})
+    )
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Driver not found")
     
-    # Delete compliance items
-    await db.driver_compliance.delete_many({"driver_id": driver_id})
-    
+    invalidate_compliance_cache(tenant_id)
     return {"message": "Driver deleted"}
 
 # Driver Compliance Routes
@@ -292,12 +418,8 @@ async def list_driver_compliance(
     tenant_id: str = Depends(get_tenant_id)
 ):
     """List compliance items for a driver"""
-    driver = await db.drivers.find_one({"id": driver_id, "tenant_id": tenant_id}, {"_id": 0})
-    if not driver:
-        raise HTTPException(status_code=404, detail="Driver not found")
-    
     compliance = await db.driver_compliance.find(
-        {"driver_id": driver_id},
+        {"driver_id": driver_id, "tenant_id": tenant_id},
         {"_id": 0}
     ).sort("expiry_date", 1).to_list(100)
     
@@ -310,19 +432,20 @@ async def add_driver_compliance(
     tenant_id: str = Depends(get_tenant_id)
 ):
     """Add compliance item to driver"""
-    driver = await db.drivers.find_one({"id": driver_id, "tenant_id": tenant_id}, {"_id": 0})
-    if not driver:
+    # Existence check only; counted from the (tenant_id, id) index without fetching the driver
+    if not await db.drivers.count_documents({"id": driver_id, "tenant_id": tenant_id}, limit=1):
         raise HTTPException(status_code=404, detail="Driver not found")
     
     compliance = DriverCompliance(
         **compliance_data.model_dump(),
-        driver_id=driver_id
+        driver_id=driver_id,
+        tenant_id=tenant_id,
+        reminder_date=compliance_reminder_date(compliance_data.expiry_date, compliance_data.reminder_days_before)
     )
     
-    doc = compliance.model_dump()
-    doc['created_at'] = doc['created_at'].isoformat()
-    await db.driver_compliance.insert_one(doc)
+    await db.driver_compliance.insert_one(compliance.model_dump())
     
+    invalidate_compliance_cache(tenant_id)
     return compliance
 
 @router.put("/drivers/{driver_id}/compliance/{compliance_id}")
@@ -333,20 +456,20 @@ async def update_driver_compliance(
     tenant_id: str = Depends(get_tenant_id)
 ):
     """Update driver compliance item"""
-    driver = await db.drivers.find_one({"id": driver_id, "tenant_id": tenant_id}, {"_id": 0})
-    if not driver:
-        raise HTTPException(status_code=404, detail="Driver not found")
-    
     update_dict = update_data.model_dump()
-    
-    result = await db.driver_compliance.update_one(
-        {"id": compliance_id, "driver_id": driver_id},
-        {"$set": update_dict}
+    update_dict["reminder_date"] = compliance_reminder_date(update_data.expiry_date, update_data.reminder_days_before)
+    
+    # tenant_id on the item authorises the update without loading the driver
+    compliance = await db.driver_compliance.find_one_and_update(
+        {"id": compliance_id, "driver_id": driver_id, "tenant_id": tenant_id},
+        {"$set": update_dict},
+        projection={"_id": 0},
+        return_document=ReturnDocument.AFTER
     )
-    if result.matched_count == 0:
+    if not compliance:
         raise HTTPException(status_code=404, detail="Compliance item not found")
     
-    compliance = await db.driver_compliance.find_one({"id": compliance_id}, {"_id": 0})
+    invalidate_compliance_cache(tenant_id)
     return compliance
 
 @router.delete("/drivers/{driver_id}/compliance/{compliance_id}")
@@ -356,25 +479,60 @@ async def delete_driver_compliance(
     tenant_id: str = Depends(get_tenant_id)
 ):
     """Delete driver compliance item"""
-    driver = await db.drivers.find_one({"id": driver_id, "tenant_id": tenant_id}, {"_id": 0})
-    if not driver:
-        raise HTTPException(status_code=404, detail="Driver not found")
-    
-    result = await db.driver_compliance.delete_one({"id": compliance_id, "driver_id": driver_id})
+    result = await db.driver_compliance.delete_one(
+        {"id": compliance_id, "driver_id": driver_id, "tenant_id": tenant_id}
+    )
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Compliance item not found")
     
+    invalidate_compliance_cache(tenant_id)
     return {"message": "Compliance item deleted"}
 
 # ============ COMPLIANCE REMINDERS ============
 
-@router.get("/reminders")
-async def get_compliance_reminders(tenant_id: str = Depends(get_tenant_id)):
+@router.get("/reminders", response_class=ORJSONResponse)
+async def get_compliance_reminders(
+    tenant_id: str = Depends(get_tenant_id),
+    dates: DateBoundaries = Depends(get_date_boundaries)
+):
     """Get all upcoming compliance expirations grouped by urgency"""
-    today = datetime.now(timezone.utc)
-    today_str = today.strftime("%Y-%m-%d")
-    week_later = (today + timedelta(days=7)).strftime("%Y-%m-%d")
-    month_later = (today + timedelta(days=30)).strftime("%Y-%m-%d")
+    today_str, week_later, month_later = dates.today, dates.week, dates.month
+    
+    cache_key = (tenant_id, "reminders")
+    cached = _compliance_cache.get(cache_key)
+    if cached and cached[0] == today_str:
+        return cached[1]
+    
+    # Flatten both fleets' compliance items into reminder entries and bucket
+    # them by urgency in one query
+    pipeline = compliance_reminder_stages(
+        tenant_id, "vehicle",
+        {"registration": {"$ifNull": ["$owner.registration_number", ""]}},
+        ("provider", "policy_number"),
+        today_str
+    ) + [
+        {"$unionWith": {
+            "coll": "driver_compliance",
+            "pipeline": compliance_reminder_stages(
+                tenant_id, "driver",
+                {"phone": {"$ifNull": ["$owner.phone", ""]}},
+                ("license_number", "issuing_country"),
+                today_str
+            )
+        }},
+        {"$sort": {"expiry_date": 1}},
+        {"$group": {
+            "_id": {"$switch": {
+                "branches": [
+                    {"case": {"$lt": ["$expiry_date", today_str]}, "then": "overdue"},
+                    {"case": {"$lte": ["$expiry_date", week_later]}, "then": "due_this_week"},
+                    {"case": {"$lte": ["$expiry_date", month_later]}, "then": "due_this_month"}
+                ],
+                "default": "upcoming"
+            }},
+            "items": {"$push": "$$ROOT"}
+        }}
+    ]
     
     reminders = {
         "overdue": [],
@@ -383,91 +541,13 @@ async def get_compliance_reminders(tenant_id: str = Depends(get_tenant_id)):
         "upcoming": []
     }
     
-    # Get all vehicles
-    vehicles = await db.vehicles.find({"tenant_id": tenant_id}, {"_id": 0}).to_list(100)
-    vehicle_map = {v["id"]: v for v in vehicles}
-    
-    # Get vehicle compliance items
-    vehicle_compliance = await db.vehicle_compliance.find(
-        {"vehicle_id": {"$in": list(vehicle_map.keys())}},
-        {"_id": 0}
-    ).to_list(500)
-    
-    for item in vehicle_compliance:
-        vehicle = vehicle_map.get(item["vehicle_id"], {})
-        reminder_date = (datetime.strptime(item["expiry_date"], "%Y-%m-%d") - 
-                        timedelta(days=item.get("reminder_days_before", 30))).strftime("%Y-%m-%d")
-        
-        # Only include if within reminder window or overdue
-        if item["expiry_date"] < today_str or reminder_date <= today_str:
-            entry = {
-                "type": "vehicle",
-                "entity_id": item["vehicle_id"],
-                "entity_name": vehicle.get("name", "Unknown"),
-                "registration": vehicle.get("registration_number", ""),
-                "compliance_id": item["id"],
-                "item_type": item["item_type"],
-                "item_label": item.get("item_label") or item["item_type"].replace("_", " ").title(),
-                "expiry_date": item["expiry_date"],
-                "notify_channels": item.get("notify_channels", []),
-                "provider": item.get("provider"),
-                "policy_number": item.get("policy_number")
-            }
-            
-            if item["expiry_date"] < today_str:
-                reminders["overdue"].append(entry)
-            elif item["expiry_date"] <= week_later:
-                reminders["due_this_week"].append(entry)
-            elif item["expiry_date"] <= month_later:
-                reminders["due_this_month"].append(entry)
-            else:
-                reminders["upcoming"].append(entry)
-    
-    # Get all drivers
-    drivers = await db.drivers.find({"tenant_id": tenant_id}, {"_id": 0}).to_list(100)
-    driver_map = {d["id"]: d for d in drivers}
+    # Each category arrives sorted by expiry date
+    async for bucket in db.vehicle_compliance.aggregate(pipeline):
+        for entry in bucket["items"]:
+            entry["item_label"] = entry["item_label"] or entry["item_type"].replace("_", " ").title()
+        reminders[bucket["_id"]] = bucket["items"]
     
-    # Get driver compliance items
-    driver_compliance = await db.driver_compliance.find(
-        {"driver_id": {"$in": list(driver_map.keys())}},
-        {"_id": 0}
-    ).to_list(500)
-    
-    for item in driver_compliance:
-        driver = driver_map.get(item["driver_id"], {})
-        reminder_date = (datetime.strptime(item["expiry_date"], "%Y-%m-%d") - 
-                        timedelta(days=item.get("reminder_days_before", 30))).strftime("%Y-%m-%d")
-        
-        # Only include if within reminder window or overdue
-        if item["expiry_date"] < today_str or reminder_date <= today_str:
-            entry = {
-                "type": "driver",
-                "entity_id": item["driver_id"],
-                "entity_name": driver.get("name", "Unknown"),
-                "phone": driver.get("phone", ""),
-                "compliance_id": item["id"],
-                "item_type": item["item_type"],
-                "item_label": item.get("item_label") or item["item_type"].replace("_", " ").title(),
-                "expiry_date": item["expiry_date"],
-                "notify_channels": item.get("notify_channels", []),
-                "license_number": item.get("license_number"),
-                "issuing_country": item.get("issuing_country")
-            }
-            
-            if item["expiry_date"] < today_str:
-                reminders["overdue"].append(entry)
-            elif item["expiry_date"] <= week_later:
-                reminders["due_this_week"].append(entry)
-            elif item["expiry_date"] <= month_later:
-                reminders["due_this_month"].append(entry)
-            else:
-                reminders["upcoming"].append(entry)
-    
-    # Sort each category by expiry date
-    for category in reminders:
-        reminders[category].sort(key=lambda x: x["expiry_date"])
-    
-    return {
+    result = {
         "reminders": reminders,
         "summary": {
             "overdue": len(reminders["overdue"]),
@@ -477,39 +557,38 @@ async def get_compliance_reminders(tenant_id: str = Depends(get_tenant_id)):
             "total": sum(len(reminders[k]) for k in reminders)
         }
     }
+    _compliance_cache[cache_key] = (today_str, result)
+    return result
 
-@router.get("/compliance/all")
-async def get_all_compliance_items(tenant_id: str = Depends(get_tenant_id)):
+@router.get("/compliance/all", response_class=ORJSONResponse)
+async def get_all_compliance_items(
+    tenant_id: str = Depends(get_tenant_id),
+    dates: DateBoundaries = Depends(get_date_boundaries)
+):
     """Get ALL compliance items (vehicles and drivers) sorted by expiry date ascending"""
-    today = datetime.now(timezone.utc)
-    today_str = today.strftime("%Y-%m-%d")
-    thirty_days = (today + timedelta(days=30)).strftime("%Y-%m-%d")
-    sixty_days = (today + timedelta(days=60)).strftime("%Y-%m-%d")
+    today_str = dates.today
+    
+    cache_key = (tenant_id, "all")
+    cached = _compliance_cache.get(cache_key)
+    if cached and cached[0] == today_str:
+        return cached[1]
+    
+    thirty_days, sixty_days = dates.month, dates.sixty_days
     
     all_items = []
     
     # Get all vehicles
-    vehicles = await db.vehicles.find({"tenant_id": tenant_id}, {"_id": 0}).to_list(100)
+    vehicles = await db.vehicles.find({"tenant_id": tenant_id}, VEHICLE_SUMMARY_PROJECTION).to_list(100)
     vehicle_map = {v["id"]: v for v in vehicles}
     
     # Get vehicle compliance items
     vehicle_compliance = await db.vehicle_compliance.find(
         {"vehicle_id": {"$in": list(vehicle_map.keys())}},
-        {"_id": 0}
+        VEHICLE_COMPLIANCE_PROJECTION
     ).to_list(500)
     
     for item in vehicle_compliance:
         vehicle = vehicle_map.get(item["vehicle_id"], {})
-        expiry = item["expiry_date"]
-        
-        # Determine status color
-        if expiry < today_str or expiry <= thirty_days:
-            status_color = "red"
-        elif expiry <= sixty_days:
-            status_color = "yellow"
-        else:
-            status_color = "green"
-        
         all_items.append({
             "type": "vehicle",
             "entity_id": item["vehicle_id"],
@@ -518,8 +597,8 @@ async def get_all_compliance_items(tenant_id: str = Depends(get_tenant_id)):
             "compliance_id": item["id"],
             "item_type": item["item_type"],
             "item_label": item.get("item_label") or item["item_type"].replace("_", " ").title(),
-            "expiry_date": expiry,
-            "status_color": status_color,
+            "expiry_date": item["expiry_date"],
+            "status_color": None,  # Set once all items are sorted
             "provider": item.get("provider"),
             "policy_number": item.get("policy_number"),
             "file_name": item.get("file_name"),
@@ -527,27 +606,17 @@ async def get_all_compliance_items(tenant_id: str = Depends(get_tenant_id)):
         })
     
     # Get all drivers
-    drivers = await db.drivers.find({"tenant_id": tenant_id}, {"_id": 0}).to_list(100)
+    drivers = await db.drivers.find({"tenant_id": tenant_id}, DRIVER_SUMMARY_PROJECTION).to_list(100)
     driver_map = {d["id"]: d for d in drivers}
     
     # Get driver compliance items
     driver_compliance = await db.driver_compliance.find(
         {"driver_id": {"$in": list(driver_map.keys())}},
-        {"_id": 0}
+        DRIVER_COMPLIANCE_PROJECTION
     ).to_list(500)
     
     for item in driver_compliance:
         driver = driver_map.get(item["driver_id"], {})
-        expiry = item["expiry_date"]
-        
-        # Determine status color
-        if expiry < today_str or expiry <= thirty_days:
-            status_color = "red"
-        elif expiry <= sixty_days:
-            status_color = "yellow"
-        else:
-            status_color = "green"
-        
         all_items.append({
             "type": "driver",
             "entity_id": item["driver_id"],
@@ -556,17 +625,25 @@ async def get_all_compliance_items(tenant_id: str = Depends(get_tenant_id)):
             "compliance_id": item["id"],
             "item_type": item["item_type"],
             "item_label": item.get("item_label") or item["item_type"].replace("_", " ").title(),
-            "expiry_date": expiry,
-            "status_color": status_color,
+            "expiry_date": item["expiry_date"],
+            "status_color": None,  # Set once all items are sorted
             "license_number": item.get("license_number"),
             "issuing_country": item.get("issuing_country"),
             "file_name": item.get("file_name"),
             "file_type": item.get("file_type")
         })
     
-    # Sort all items by expiry date ascending
-    all_items.sort(key=lambda x: x["expiry_date"])
-    
+    # Sort all items by expiry date ascending, then color them by slicing at
+    # the 30/60 day boundaries (overdue items fall in the red slice)
+    all_items.sort(key=itemgetter("expiry_date"))
+    expiry_dates = [item["expiry_date"] for item in all_items]
+    red_end = bisect_right(expiry_dates, thirty_days)
+    yellow_end = bisect_right(expiry_dates, sixty_days, lo=red_end)
+    for start, end, status_color in ((0, red_end, "red"), (red_end, yellow_end, "yellow"), (yellow_end, None, "green")):
+        for item in all_items[start:end]:
+            item["status_color"] = status_color
+    
+    _compliance_cache[cache_key] = (today_str, all_items)
     return all_items
 
 # ============ DASHBOARD STATS ============
@@ -574,81 +651,111 @@ async def get_all_compliance_items(tenant_id: str = Depends(get_tenant_id)):
 @router.get("/dashboard/stats")
 async def get_dashboard_stats(tenant_id: str = Depends(get_tenant_id)):
     """Get dashboard statistics"""
-    # Count totals
-    total_clients = await db.clients.count_documents({"tenant_id": tenant_id, "status": "active"})
-    total_shipments = await db.shipments.count_documents({"tenant_id": tenant_id})
-    total_trips = await db.trips.count_documents({"tenant_id": tenant_id})
-    
-    # Status counts
-    warehouse_count = await db.shipments.count_documents({"tenant_id": tenant_id, "status": "warehouse"})
-    in_transit_count = await db.shipments.count_documents({"tenant_id": tenant_id, "status": "in_transit"})
-    delivered_count = await db.shipments.count_documents({"tenant_id": tenant_id, "status": "delivered"})
-    
-    # Recent shipments
-    recent_shipments = await db.shipments.find(
-        {"tenant_id": tenant_id},
-        {"_id": 0}
-    ).sort("created_at", -1).limit(5).to_list(5)
+    cached = get_cached_dashboard_stats(tenant_id)
+    if cached:
+        return cached
+    
+    # Counts and recent shipments are independent, so fetch them concurrently
+    (
+        total_clients,
+        total_shipments,
+        total_trips,
+        status_rows,
+        recent_shipments
+    ) = await asyncio.gather(
+        db.clients.count_documents({"tenant_id": tenant_id, "status": "active"}),
+        db.shipments.count_documents({"tenant_id": tenant_id}),
+        db.trips.count_documents({"tenant_id": tenant_id}),
+        # Status counts, one bucket per status
+        db.shipments.aggregate([
+            {"$match": {"tenant_id": tenant_id, "status": {"$in": list(DASHBOARD_SHIPMENT_STATUSES)}}},
+            {"$group": {"_id": "$status", "count": {"$sum": 1}}}
+        ]).to_list(None),
+        # Recent shipments, enriched with client names
+        db.shipments.aggregate([
+            {"$match": {"tenant_id": tenant_id}},
+            {"$sort": {"created_at": -1}},
+            {"$limit": 5},
+            {"$lookup": {
+                "from": "clients",
+                "let": {"client_id": "$client_id"},
+                "pipeline": [
+                    {"$match": {"$expr": {"$eq": ["$id", "$$client_id"]}}},
+                    {"$project": {"_id": 0, "name": 1}}
+                ],
+                "as": "client"
+            }},
+            {"$addFields": {"client_name": {"$ifNull": [{"$arrayElemAt": ["$client.name", 0]}, "Unknown"]}}},
+            {"$project": {"_id": 0, "client": 0}}
+        ]).to_list(5)
+    )
     
-    # Enrich with client names
-    for shipment in recent_shipments:
-        client = await db.clients.find_one({"id": shipment["client_id"]}, {"_id": 0, "name": 1})
-        shipment["client_name"] = client["name"] if client else "Unknown"
+    status_counts = {row["_id"]: row["count"] for row in status_rows}
     
-    return {
+    stats = {
         "total_clients": total_clients,
         "total_shipments": total_shipments,
         "total_trips": total_trips,
-        "shipment_status": {
-            "warehouse": warehouse_count,
-            "in_transit": in_transit_count,
-            "delivered": delivered_count
-        },
+        "shipment_status": {status: status_counts.get(status, 0) for status in DASHBOARD_SHIPMENT_STATUSES},
         "recent_shipments": recent_shipments
     }
+    cache_dashboard_stats(tenant_id, stats)
+    return stats
 
 # ============ AUDIT LOG ENDPOINTS ============
 
-@router.get("/audit-logs/{table_name}/{record_id}")
+@router.get("/audit-logs/{table_name}/{record_id}", response_class=ORJSONResponse)
 async def get_audit_history(
     table_name: str,
     record_id: str,
     tenant_id: str = Depends(get_tenant_id)
 ):
     """Get audit history for a specific record"""
-    logs = []
-    cursor = db.audit_logs.find(
-        {"tenant_id": tenant_id, "table_name": table_name, "record_id": record_id},
-        {"_id": 0}
-    ).sort("created_at", -1).limit(50)
-    
-    async for log in cursor:
-        # Get user name
-        user = await db.users.find_one({"id": log["user_id"]}, {"_id": 0, "name": 1})
-        log["user_name"] = user["name"] if user else "Unknown"
-        logs.append(log)
-    
-    return logs
+    # Latest entries with the acting user's name
+    return await db.audit_logs.aggregate([
+        {"$match": {"tenant_id": tenant_id, "table_name": table_name, "record_id": record_id}},
+        {"$sort": {"created_at": -1}},
+        {"$limit": 50},
+        {"$lookup": {
+            "from": "users",
+            "let": {"user_id": "$user_id"},
+            "pipeline": [
+                {"$match": {"$expr": {"$eq": ["$id", "$$user_id"]}}},
+                {"$project": {"_id": 0, "name": 1}}
+            ],
+            "as": "user"
+        }},
+        {"$addFields": {"user_name": {"$ifNull": [{"$arrayElemAt": ["$user.name", 0]}, "Unknown"]}}},
+        {"$project": {"_id": 0, "user": 0}}
+    ]).to_list(50)
 
 # ============ NOTIFICATION ENDPOINTS ============
 
-@router.get("/notifications")
-async def list_notifications(
-    unread_only: bool = False,
+@router.get("/notifications/summary", response_class=ORJSONResponse)
+async def get_notification_summary(
     tenant_id: str = Depends(get_tenant_id),
     user: dict = Depends(get_current_user)
 ):
-    """Get notifications for the current user"""
-    query = {"tenant_id": tenant_id, "user_id": user["id"]}
-    if unread_only:
-        query["read_at"] = None
-    
-    notifications = []
-    cursor = db.notifications.find(query, {"_id": 0}).sort("created_at", -1).limit(50)
-    async for notification in cursor:
-        notifications.append(notification)
-    
-    return notifications
+    """Get the latest notifications and the unread count in one call"""
+    result = await db.notifications.aggregate([
+        {"$match": {"tenant_id": tenant_id, "user_id": user["id"]}},
+        {"$facet": {
+            "items": [
+                {"$sort": {"created_at": -1}},
+                {"$limit": 50},
+                {"$project": {"_id": 0}}
+            ],
+            "unread": [
+                {"$match": {"read_at": None}},
+                {"$count": "count"}
+            ]
+        }}
+    ]).to_list(1)
+    
+    facets = result[0]
+    unread_count = facets["unread"][0]["count"] if facets["unread"] else 0
+    seed_unread_count(tenant_id, user["id"], unread_count)
+    return {"items": facets["items"], "unread_count": unread_count}
 
 @router.get("/notifications/count")
 async def get_unread_notification_count(
@@ -656,11 +763,7 @@ async def get_unread_notification_count(
     user: dict = Depends(get_current_user)
 ):
     """Get count of unread notifications"""
-    count = await db.notifications.count_documents({
-        "tenant_id": tenant_id,
-        "user_id": user["id"],
-        "read_at": None
-    })
+    count = await cached_unread_count(tenant_id, user["id"])
     return {"unread_count": count}
 
 @router.post("/notifications")
@@ -674,6 +777,7 @@ async def create_notification_endpoint(
         **notification_data.model_dump()
     )
     await db.notifications.insert_one(notification.model_dump())
+    invalidate_unread_count(tenant_id, notification.user_id)
     return {"id": notification.id, "message": "Notification created"}
 
 @router.put("/notifications/{notification_id}/read")
@@ -689,6 +793,7 @@ async def mark_notification_read(
     )
     if result.modified_count == 0:
         raise HTTPException(status_code=404, detail="Notification not found")
+    invalidate_unread_count(tenant_id, user["id"])
     return {"message": "Notification marked as read"}
 
 @router.put("/notifications/read-all")
@@ -701,6 +806,7 @@ async def mark_all_notifications_read(
         {"tenant_id": tenant_id, "user_id": user["id"], "read_at": None},
         {"$set": {"read_at": datetime.now(timezone.utc)}}
     )
+    invalidate_unread_count(tenant_id, user["id"])
     return {"message": f"Marked {result.modified_count} notifications as read"}
 
 @router.put("/notifications/{notification_id}/resolve")
@@ -716,11 +822,12 @@ async def resolve_notification(
     )
     if result.modified_count == 0:
         raise HTTPException(status_code=404, detail="Notification not found")
+    invalidate_unread_count(tenant_id, user["id"])
     return {"message": "Notification resolved"}
 
 # ============ WHATSAPP LOG ENDPOINTS ============
 
-@router.get("/whatsapp-logs")
+@router.get("/whatsapp-logs", response_class=ORJSONResponse)
 async def list_whatsapp_logs(
     invoice_id: Optional[str] = None,
     tenant_id: str = Depends(get_tenant_id)
@@ -730,12 +837,7 @@ async def list_whatsapp_logs(
     if invoice_id:
         query["invoice_id"] = invoice_id
     
-    logs = []
-    cursor = db.whatsapp_logs.find(query, {"_id": 0}).sort("sent_at", -1).limit(100)
-    async for log in cursor:
-        logs.append(log)
-    
-    return logs
+    return await db.whatsapp_logs.find(query, {"_id": 0}).sort("sent_at", -1).to_list(100)
 
 @router.post("/whatsapp-logs")
 async def create_whatsapp_log(
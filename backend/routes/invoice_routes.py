@@ -3,10 +3,11 @@ Invoice routes for Servex Holdings backend.
 Handles invoice CRUD, line items, payments, and PDF generation.
 """
 from fastapi import APIRouter, HTTPException, Depends, Request
-from fastapi.responses import StreamingResponse
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from typing import List, Optional
 from datetime import datetime, timezone
 from io import BytesIO
+from collections import defaultdict
 import uuid
 
 from database import db
@@ -14,7 +15,7 @@ from dependencies import get_current_user, get_tenant_id
 from models.schemas import Invoice, InvoiceCreate, InvoiceUpdate, InvoiceLineItem, InvoiceLineItemCreate, InvoiceAdjustmentInput, Payment, PaymentCreate, InvoiceCreateEnhanced, InvoiceUpdateEnhanced, create_audit_log
 from models.enums import InvoiceStatus, PaymentMethod, AuditAction
 from services.barcode_service import generate_invoice_number
-from utils.helpers import calculate_due_date
+from utils.helpers import calculate_due_date, get_invoice_display_fields, invalidate_unread_count
 
 from services.pdf_service import generate_invoice_pdf
 router = APIRouter()
@@ -83,6 +84,9 @@ async def search_invoices(
     
     invoices = await db.invoices.find(query, {"_id": 0}).to_list(100)
     
+    if not invoices:
+        return []
+    
     # Get clients for name matching
     client_ids = list(set(inv.get("client_id") for inv in invoices if inv.get("client_id")))
     clients = await db.clients.find({"id": {"$in": client_ids}}, {"_id": 0}).to_list(100)
@@ -214,6 +218,8 @@ async def create_invoice(
         "subtotal": subtotal,
         "adjustments": adjustments_total,
         "total": total,
+        "paid_amount": 0,
+        "outstanding": total,
         "status": invoice_data.status or "draft",
         "due_date": due_date,
         "issue_date": invoice_data.issue_date or datetime.now(timezone.utc).strftime("%Y-%m-%d"),
@@ -229,7 +235,9 @@ async def create_invoice(
         "client_address_snapshot": client.get("billing_address") or client.get("physical_address"),
         "client_vat_snapshot": client.get("vat_number"),
         "client_phone_snapshot": client.get("phone"),
-        "client_email_snapshot": client.get("email")
+        "client_email_snapshot": client.get("email"),
+        # Current client/trip display fields (kept in sync on rename)
+        **await get_invoice_display_fields(tenant_id, invoice_data.client_id, invoice_data.trip_id, client)
     }
     
     await db.invoices.insert_one(invoice_doc)
@@ -421,6 +429,17 @@ async def update_invoice(
         adjustments = update_dict.get("adjustments", invoice.get("adjustments", 0))
         update_dict["total"] = subtotal + adjustments
     
+    if "total" in update_dict:
+        update_dict["outstanding"] = update_dict["total"] - invoice.get("paid_amount", 0)
+    
+    # Refresh denormalised display fields when the client or trip changes
+    if "client_id" in update_dict or "trip_id" in update_dict:
+        update_dict.update(await get_invoice_display_fields(
+            tenant_id,
+            update_dict.get("client_id", invoice.get("client_id")),
+            update_dict.get("trip_id", invoice.get("trip_id"))
+        ))
+    
     # Determine action type
     action = AuditAction.status_change if "status" in update_dict else AuditAction.update
     
@@ -566,7 +585,11 @@ async def add_invoice_item(
     
     await db.invoices.update_one(
         {"id": invoice_id},
-        {"$set": {"subtotal": new_subtotal, "total": new_total}}
+        {"$set": {
+            "subtotal": new_subtotal,
+            "total": new_total,
+            "outstanding": new_total - invoice.get("paid_amount", 0)
+        }}
     )
     
     return item
@@ -605,7 +628,11 @@ async def delete_invoice_item(
     
     await db.invoices.update_one(
         {"id": invoice_id},
-        {"$set": {"subtotal": new_subtotal, "total": new_total}}
+        {"$set": {
+            "subtotal": new_subtotal,
+            "total": new_total,
+            "outstanding": new_total - invoice.get("paid_amount", 0)
+        }}
     )
     
     return {"message": "Item deleted"}
@@ -684,18 +711,9 @@ async def create_payment(
         ip_address=request.client.host if request.client else None
     )
     
-    # Check if invoice is fully paid
+    # Store the new paid/outstanding amounts and check if invoice is fully paid
     if payment_data.invoice_id:
-        invoice = await db.invoices.find_one(
-            {"id": payment_data.invoice_id},
-            {"_id": 0}
-        )
-        payments = await db.payments.find(
-            {"invoice_id": payment_data.invoice_id},
-            {"_id": 0, "amount": 1}
-        ).to_list(100)
-        
-        total_paid = sum(p["amount"] for p in payments)
+        total_paid = await sync_invoice_paid_amount(payment_data.invoice_id)
         
         if total_paid >= invoice["total"]:
             await db.invoices.update_one(
@@ -738,17 +756,11 @@ async def delete_payment(
         ip_address=request.client.host if request.client else None
     )
     
-    # Recheck invoice paid status
+    # Store the new paid/outstanding amounts and recheck invoice paid status
     if invoice_id:
+        total_paid = await sync_invoice_paid_amount(invoice_id)
         invoice = await db.invoices.find_one({"id": invoice_id}, {"_id": 0})
         if invoice and invoice["status"] == "paid":
-            payments = await db.payments.find(
-                {"invoice_id": invoice_id},
-                {"_id": 0, "amount": 1}
-            ).to_list(100)
-            
-            total_paid = sum(p["amount"] for p in payments)
-            
             if total_paid < invoice["total"]:
                 # Revert to sent or overdue
                 today = datetime.now(timezone.utc).strftime("%Y-%m-%d")
@@ -790,6 +802,16 @@ async def list_invoices_enhanced(
     
     invoices = await db.invoices.find(query, {"_id": 0}).sort(sort_field, sort_order).to_list(500)
     
+    # Fetch payments for all invoices in one query and total them per invoice
+    paid_by_invoice = defaultdict(float)
+    if invoices:
+        payments = await db.payments.find(
+            {"invoice_id": {"$in": [inv["id"] for inv in invoices]}},
+            {"_id": 0, "invoice_id": 1, "amount": 1}
+        ).to_list(None)
+        for p in payments:
+            paid_by_invoice[p["invoice_id"]] += p.get("amount", 0) or 0
+    
     # Enrich with client names and trip numbers
     result = []
     for inv in invoices:
@@ -798,9 +820,7 @@ async def list_invoices_enhanced(
         if inv.get("trip_id"):
             trip = await db.trips.find_one({"id": inv["trip_id"]}, {"_id": 0, "trip_number": 1})
         
-        # Get payment info
-        payments = await db.payments.find({"invoice_id": inv["id"]}, {"_id": 0, "amount": 1}).to_list(100)
-        paid_amount = sum(p.get("amount", 0) for p in payments)
+        paid_amount = paid_by_invoice[inv["id"]]
         
         # Check overdue
         today = datetime.now(timezone.utc).strftime("%Y-%m-%d")
@@ -885,6 +905,24 @@ async def get_invoice_full(
     }
 
 
+async def sync_invoice_paid_amount(invoice_id: str) -> float:
+    """Store paid_amount (sum of payments) and outstanding on an invoice, returning paid_amount"""
+    totals = await db.payments.aggregate([
+        {"$match": {"invoice_id": invoice_id}},
+        {"$group": {"_id": None, "paid": {"$sum": "$amount"}}}
+    ]).to_list(1)
+    paid_amount = totals[0]["paid"] if totals else 0
+    
+    await db.invoices.update_one(
+        {"id": invoice_id},
+        [{"$set": {
+            "paid_amount": paid_amount,
+            "outstanding": {"$subtract": [{"$ifNull": ["$total", 0]}, paid_amount]}
+        }}]
+    )
+    return paid_amount
+
+
 async def recalculate_invoice_totals(invoice_id: str):
     """Helper function to recalculate invoice subtotal, adjustments and total"""
     # Get all line items
@@ -908,14 +946,15 @@ async def recalculate_invoice_totals(invoice_id: str):
     
     total = subtotal + adjustments_total
     
-    # Update invoice
+    # Update invoice, keeping the stored outstanding amount in step with the total
     await db.invoices.update_one(
         {"id": invoice_id},
-        {"$set": {
+        [{"$set": {
             "subtotal": subtotal,
             "adjustments": adjustments_total,
-            "total": total
-        }}
+            "total": total,
+            "outstanding": {"$subtract": [total, {"$ifNull": ["$paid_amount", 0]}]}
+        }}]
     )
 
 
@@ -1057,8 +1096,8 @@ async def record_invoice_payment(
     
     await db.payments.insert_one(payment)
     
-    # Check if fully paid
-    new_paid_total = paid_so_far + amount
+    # Store the new paid/outstanding amounts and check if fully paid
+    new_paid_total = await sync_invoice_paid_amount(invoice_id)
     if new_paid_total >= invoice["total"]:
         await db.invoices.update_one(
             {"id": invoice_id},
@@ -1188,6 +1227,9 @@ async def get_trip_parcels_for_invoicing(
         {"_id": 0}
     ).to_list(1000)
     
+    if not shipments:
+        return []
+    
     # Get clients for enrichment
     client_ids = list(set(s.get("client_id") for s in shipments if s.get("client_id")))
     clients = await db.clients.find({"id": {"$in": client_ids}}, {"_id": 0}).to_list(1000)
@@ -1377,9 +1419,16 @@ async def list_invoice_comments(
     ).sort("created_at", -1).to_list(100)
     
     # Enrich with user names
+    creator_ids = list({c.get("created_by") for c in comments if c.get("created_by")})
+    users = await db.users.find(
+        {"id": {"$in": creator_ids}},
+        {"_id": 0, "id": 1, "name": 1}
+    ).to_list(None) if creator_ids else []
+    users_by_id = {u["id"]: u for u in users}
+    
     result = []
     for comment in comments:
-        user = await db.users.find_one({"id": comment.get("created_by")}, {"name": 1, "_id": 0})
+        user = users_by_id.get(comment.get("created_by"))
         result.append({
             **comment,
             "user_name": user.get("name") if user else "Unknown"
@@ -1426,12 +1475,14 @@ async def add_invoice_comment(
             "created_at": datetime.now(timezone.utc).isoformat()
         }
         await db.notifications.insert_one(notification)
+        invalidate_unread_count(tenant_id, mentioned_user_id)
     
     return {"id": comment_id, "message": "Comment added"}
 
 # ============ NOTIFICATION ROUTES ============
 
-@router.get("/notifications")
+# Serves GET /notifications: this router is included before fleet_routes
+@router.get("/notifications", response_class=ORJSONResponse)
 async def list_notifications(
     unread_only: bool = False,
     tenant_id: str = Depends(get_tenant_id),
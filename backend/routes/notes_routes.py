@@ -11,6 +11,7 @@ import re
 
 from database import db
 from dependencies import get_current_user, get_tenant_id
+from utils.helpers import invalidate_unread_count
 
 router = APIRouter()
 
@@ -39,18 +40,28 @@ async def list_notes(
         {"_id": 0}
     ).sort("created_at", -1).to_list(100)
     
-    # Enrich with user info
+    # Enrich with user info: authors and mentions resolved in one query
+    user_ids = set()
     for note in notes:
-        author = await db.users.find_one({"id": note["author_id"]}, {"_id": 0, "name": 1, "email": 1})
+        user_ids.add(note["author_id"])
+        user_ids.update(note.get("mentioned_users") or [])
+    users = await db.users.find(
+        {"id": {"$in": list(user_ids)}},
+        {"_id": 0, "id": 1, "name": 1}
+    ).to_list(None) if user_ids else []
+    users_by_id = {u["id"]: u for u in users}
+    
+    for note in notes:
+        author = users_by_id.get(note["author_id"])
         note["author_name"] = author.get("name", "Unknown") if author else "Unknown"
         
         # Get mentioned user names
         if note.get("mentioned_users"):
-            mentioned = await db.users.find(
-                {"id": {"$in": note["mentioned_users"]}},
-                {"_id": 0, "id": 1, "name": 1}
-            ).to_list(100)
-            note["mentioned_user_names"] = {u["id"]: u["name"] for u in mentioned}
+            note["mentioned_user_names"] = {
+                uid: users_by_id[uid]["name"]
+                for uid in note["mentioned_users"]
+                if uid in users_by_id
+            }
     
     return notes
 
@@ -108,6 +119,7 @@ async def create_note(
                 "created_at": datetime.now(timezone.utc).isoformat()
             }
             await db.notifications.insert_one(notification)
+            invalidate_unread_count(tenant_id, mentioned_id)
     
     # Return with author name
     note["author_name"] = user.get("name", "Unknown")
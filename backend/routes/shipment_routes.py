@@ -11,6 +11,7 @@ from dependencies import get_current_user, get_tenant_id
 from models.schemas import Shipment, ShipmentCreate, ShipmentUpdate, ShipmentPiece, ShipmentPieceCreate, ShipmentPieceBase, create_audit_log
 from models.enums import ShipmentStatus, AuditAction
 from services.barcode_service import generate_barcode
+from utils.helpers import invalidate_dashboard_cache
 
 router = APIRouter()
 
@@ -148,6 +149,7 @@ async def create_shipment(
     doc = shipment.model_dump()
     doc['created_at'] = doc['created_at'].isoformat()
     await db.shipments.insert_one(doc)
+    invalidate_dashboard_cache(tenant_id)
     
     # Audit log
     await create_audit_log(
@@ -186,6 +188,7 @@ async def update_shipment(
             {"id": shipment_id, "tenant_id": tenant_id},
             {"$set": update_dict}
         )
+        invalidate_dashboard_cache(tenant_id)
         if result.matched_count == 0:
             raise HTTPException(status_code=404, detail="Shipment not found")
     
@@ -243,6 +246,7 @@ async def patch_shipment(
         {"id": shipment_id, "tenant_id": tenant_id},
         {"$set": update_dict}
     )
+    invalidate_dashboard_cache(tenant_id)
     
     # Get updated shipment
     shipment = await db.shipments.find_one(
@@ -266,6 +270,7 @@ async def delete_shipment(
         raise HTTPException(status_code=404, detail="Shipment not found")
     
     result = await db.shipments.delete_one({"id": shipment_id, "tenant_id": tenant_id})
+    invalidate_dashboard_cache(tenant_id)
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Shipment not found")
     
@@ -315,6 +320,7 @@ async def verify_shipment(
         {"id": shipment_id, "tenant_id": tenant_id},
         {"$set": update_dict}
     )
+    invalidate_dashboard_cache(tenant_id)
     
     # Audit log
     await create_audit_log(
@@ -411,12 +417,13 @@ async def scan_barcode(barcode: str, tenant_id: str = Depends(get_tenant_id)):
         # If not found, try partial ID match (first 8 characters)
         if not shipment:
             # Search for shipment where ID starts with the input
-            shipments = await db.shipments.find(
+            # Stream ids so the scan stops at the first match
+            cursor = db.shipments.find(
                 {"tenant_id": tenant_id},
                 {"_id": 0, "id": 1}
-            ).to_list(10000)
+            )
             
-            for s in shipments:
+            async for s in cursor:
                 if s["id"][:8].upper() == barcode_upper or s["id"].upper().startswith(barcode_upper):
                     shipment = await db.shipments.find_one(
                         {"id": s["id"], "tenant_id": tenant_id},
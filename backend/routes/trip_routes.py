@@ -3,40 +3,94 @@ Trip routes for Servex Holdings backend.
 Handles trip CRUD operations, trip details, and expense management.
 """
 from fastapi import APIRouter, HTTPException, Depends, UploadFile, File, Request
-from typing import List, Optional
-from datetime import datetime, timezone
+from fastapi.responses import ORJSONResponse
+from typing import Optional
+from datetime import datetime, timezone, timedelta
+from collections import defaultdict
+import asyncio
 import uuid
 
-from database import db
+from pymongo import ReturnDocument, UpdateOne
+
+from database import db, NUMERIC_COLLATION
 from dependencies import get_current_user, get_tenant_id
 from models.schemas import Trip, TripCreate, TripUpdate, TripExpense, TripExpenseCreate, TripExpenseUpdate, create_audit_log
 from models.enums import TripStatus, ExpenseCategory, AuditAction
-from services.barcode_service import generate_barcode
+from services.barcode_service import format_invoice_number, generate_barcode, reserve_invoice_sequence, trip_barcode_expression
+from utils.helpers import invalidate_dashboard_cache
 
 router = APIRouter()
 
+# Read paths return only the model's fields (what response_model used to filter to)
+TRIP_LIST_PROJECTION = {"_id": 0, **{field: 1 for field in Trip.model_fields}}
+TRIP_EXPENSE_PROJECTION = {"_id": 0, **{field: 1 for field in TripExpense.model_fields}}
+
+# Shipment statuses that count as loaded onto the trip
+LOADED_STATUSES = ['staged', 'loaded', 'in_transit', 'delivered']
+
+
+# Reduces the grouped client id set to total_clients (ignoring parcels without a client)
+CLIENT_COUNT_STAGE = {"$project": {
+    "total_parcels": 1, "total_weight": 1, "total_pieces": 1, "loaded_parcels": 1, "shipment_ids": 1,
+    "total_clients": {"$size": {"$setDifference": ["$clients", [None, ""]]}}
+}}
+
+
+def shipment_stats_fields(group_id) -> dict:
+    """
+    Build the $group fields summarising a trip's shipments server-side, so
+    only the counts (not the shipment documents) come back.
+    
+    Args:
+        group_id: $group _id expression (None for a single trip, "$trip_id" per trip)
+    
+    Returns:
+        $group specification with total_parcels, total_weight, clients,
+        loaded_parcels and shipment_ids (follow it with CLIENT_COUNT_STAGE)
+    """
+    return {
+        "_id": group_id,
+        "total_parcels": {"$sum": 1},
+        "total_weight": {"$sum": {"$ifNull": ["$total_weight", 0]}},
+        "clients": {"$addToSet": "$client_id"},
+        "loaded_parcels": {"$sum": {"$cond": [{"$in": ["$status", LOADED_STATUSES]}, 1, 0]}},
+        "shipment_ids": {"$push": "$id"}
+    }
+
+
+async def find_by_id(collection, record_id: Optional[str], projection: dict) -> Optional[dict]:
+    """
+    Find a document by its id field, skipping the query when no id is set.
+    
+    Args:
+        collection: Motor collection to read
+        record_id: Document id (e.g. an optional reference on a trip)
+        projection: Fields to return
+    
+    Returns:
+        Document dict, or None if record_id is empty or nothing matches
+    """
+    if not record_id:
+        return None
+    return await collection.find_one({"id": record_id}, projection)
+
 @router.get("/trips/next-number")
 async def get_next_trip_number(tenant_id: str = Depends(get_tenant_id)):
     """Get the next sequential trip number for creating a new trip"""
-    # Find the latest trip number starting with 'S' followed by 1-4 digits only
-    trips = await db.trips.find(
+    # Highest trip number starting with 'S' followed by 1-4 digits only, read
+    # from the numerically collated trip_number index
+    latest = await db.trips.find_one(
         {"tenant_id": tenant_id, "trip_number": {"$regex": "^S\\d{1,4}$"}},
-        {"trip_number": 1, "_id": 0}
-    ).to_list(1000)
-    
-    max_num = 0
-    for trip in trips:
-        try:
-            num = int(trip["trip_number"][1:])
-            if num > max_num:
-                max_num = num
-        except (ValueError, IndexError):
-            continue
+        {"trip_number": 1, "_id": 0},
+        sort=[("trip_number", -1)],
+        collation=NUMERIC_COLLATION
+    )
     
+    max_num = int(latest["trip_number"][1:]) if latest else 0
     next_number = f"S{max_num + 1}"
     return {"next_trip_number": next_number}
 
-@router.get("/trips", response_model=List[Trip])
+@router.get("/trips", response_class=ORJSONResponse)
 async def list_trips(
     status: Optional[str] = None,
     tenant_id: str = Depends(get_tenant_id)
@@ -50,8 +104,8 @@ async def list_trips(
         else:
             query["status"] = status
     
-    trips = await db.trips.find(query, {"_id": 0}).sort("departure_date", -1).to_list(100)
-    return trips
+    # Stored trips are returned as-is, without re-validating each through Trip
+    trips = await db.trips.find(query, TRIP_LIST_PROJECTION).sort("departure_date", -1).to_list(100)
     return trips
 
 @router.get("/trips/{trip_id}")
@@ -111,10 +165,10 @@ async def create_trip(
     )
     
     doc = trip.model_dump()
-    doc['created_at'] = doc['created_at'].isoformat()
     if doc.get('locked_at'):
         doc['locked_at'] = doc['locked_at'].isoformat()
     await db.trips.insert_one(doc)
+    invalidate_dashboard_cache(tenant_id)
     
     # Audit log
     await create_audit_log(
@@ -184,6 +238,13 @@ async def update_trip(
             {"$set": update_dict}
         )
     
+    # Keep the trip number denormalised on invoices in sync
+    if "trip_number" in update_dict and update_dict["trip_number"] != trip.get("trip_number"):
+        await db.invoices.update_many(
+            {"tenant_id": tenant_id, "trip_id": trip_id},
+            {"$set": {"trip_number": update_dict["trip_number"]}}
+        )
+    
     new_trip = await db.trips.find_one({"id": trip_id, "tenant_id": tenant_id}, {"_id": 0})
     
     # Audit log
@@ -228,6 +289,7 @@ async def delete_trip(
     
     # Delete trip
     await db.trips.delete_one({"id": trip_id, "tenant_id": tenant_id})
+    invalidate_dashboard_cache(tenant_id)
     
     # Audit log
     await create_audit_log(
@@ -262,23 +324,20 @@ async def assign_shipment_to_trip(
         {"id": shipment_id, "tenant_id": tenant_id},
         {"$set": {"trip_id": trip_id, "status": "staged"}}
     )
+    invalidate_dashboard_cache(tenant_id)
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Shipment not found")
     
-    # Update piece barcodes with new trip number
-    pieces = await db.shipment_pieces.find({"shipment_id": shipment_id}, {"_id": 0}).to_list(100)
-    
-    shipment_count = await db.shipments.count_documents({
-        "tenant_id": tenant_id,
-        "trip_id": trip_id
-    })
+    # Update piece barcodes with new trip number. The shipment count is part of
+    # the barcode, so it is read fresh (an index-only count on tenant_id/trip_id)
+    # rather than cached - a stale count would repeat barcodes
+    shipment_count = await db.shipments.count_documents({"tenant_id": tenant_id, "trip_id": trip_id})
     
-    for piece in pieces:
-        new_barcode = generate_barcode(trip["trip_number"], shipment_count, piece["piece_number"])
-        await db.shipment_pieces.update_one(
-            {"id": piece["id"]},
-            {"$set": {"barcode": new_barcode}}
-        )
+    # The trip barcode is deterministic, so the server builds it for every piece
+    await db.shipment_pieces.update_many(
+        {"shipment_id": shipment_id},
+        [{"$set": {"barcode": trip_barcode_expression(trip["trip_number"], shipment_count)}}]
+    )
     
     return {"message": "Shipment assigned to trip"}
 
@@ -302,18 +361,25 @@ async def unassign_shipment_from_trip(
         {"id": shipment_id, "tenant_id": tenant_id, "trip_id": trip_id},
         {"$set": {"trip_id": None, "status": "warehouse"}}
     )
+    invalidate_dashboard_cache(tenant_id)
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Shipment not found or not assigned to this trip")
     
-    # Update piece barcodes back to TEMP format
-    pieces = await db.shipment_pieces.find({"shipment_id": shipment_id}, {"_id": 0}).to_list(100)
+    # Update piece barcodes back to TEMP format (random per piece, so built here)
+    pieces = await db.shipment_pieces.find(
+        {"shipment_id": shipment_id},
+        {"_id": 0, "id": 1, "piece_number": 1}
+    ).to_list(100)
     
-    for piece in pieces:
-        new_barcode = generate_barcode(None, 0, piece["piece_number"])
-        await db.shipment_pieces.update_one(
+    updates = [
+        UpdateOne(
             {"id": piece["id"]},
-            {"$set": {"barcode": new_barcode}}
+            {"$set": {"barcode": generate_barcode(None, 0, piece["piece_number"])}}
         )
+        for piece in pieces
+    ]
+    if updates:
+        await db.shipment_pieces.bulk_write(updates, ordered=False)
     
     return {"message": "Shipment removed from trip"}
 
@@ -327,65 +393,48 @@ async def get_trip_summary(
     if not trip:
         raise HTTPException(status_code=404, detail="Trip not found")
     
-    # Get vehicle details if assigned
-    vehicle = None
-    if trip.get("vehicle_id"):
-        vehicle = await db.vehicles.find_one({"id": trip["vehicle_id"]}, {"_id": 0})
-    
-    # Get driver details if assigned
-    driver = None
-    if trip.get("driver_id"):
-        driver = await db.drivers.find_one({"id": trip["driver_id"]}, {"_id": 0})
-    
-    # Get shipments assigned to this trip
-    shipments = await db.shipments.find(
-        {"trip_id": trip_id, "tenant_id": tenant_id},
-        {"_id": 0}
-    ).to_list(1000)
-    
-    # Calculate stats
-    total_parcels = len(shipments)
-    total_weight = sum(s.get("total_weight", 0) or 0 for s in shipments)
-    unique_clients = set(s.get("client_id") for s in shipments if s.get("client_id"))
-    
-    # Count pieces
-    total_pieces = 0
-    for shipment in shipments:
-        pieces = await db.shipment_pieces.count_documents({"shipment_id": shipment["id"]})
-        total_pieces += pieces
+    # Vehicle, driver, creator and shipment stats are independent
+    stats_pipeline = [
+        {"$match": {"trip_id": trip_id, "tenant_id": tenant_id}},
+        {"$lookup": {
+            "from": "shipment_pieces",
+            "localField": "id",
+            "foreignField": "shipment_id",
+            "pipeline": [{"$project": {"_id": 1}}],
+            "as": "pieces"
+        }},
+        {"$group": {
+            **shipment_stats_fields(None),
+            "total_pieces": {"$sum": {"$size": "$pieces"}}
+        }},
+        CLIENT_COUNT_STAGE
+    ]
+    vehicle, driver, created_by_user, stats = await asyncio.gather(
+        find_by_id(db.vehicles, trip.get("vehicle_id"), {"_id": 0}),
+        find_by_id(db.drivers, trip.get("driver_id"), {"_id": 0}),
+        find_by_id(db.users, trip.get("created_by"), {"name": 1, "_id": 0}),
+        db.shipments.aggregate(stats_pipeline).to_list(1)
+    )
+    stats = stats[0] if stats else {}
     
-    # Count loaded parcels (status in ['staged', 'loaded', 'in_transit', 'delivered'])
-    loaded_statuses = ['staged', 'loaded', 'in_transit', 'delivered']
-    loaded_parcels = sum(1 for s in shipments if s.get("status") in loaded_statuses)
+    total_parcels = stats.get("total_parcels", 0)
+    total_pieces = stats.get("total_pieces", 0)
+    total_weight = stats.get("total_weight", 0)
+    loaded_parcels = stats.get("loaded_parcels", 0)
     loading_percentage = round((loaded_parcels / total_parcels * 100) if total_parcels > 0 else 0)
     
-    # Get invoiced value - query invoices by BOTH trip_id and shipment_ids
-    shipment_ids = [s["id"] for s in shipments]
-    
-    # First get invoices linked directly by trip_id
-    trip_invoices = await db.invoices.find(
-        {"tenant_id": tenant_id, "trip_id": trip_id},
+    # Invoiced value counts invoices linked by trip_id and, for backward
+    # compatibility, invoices linked by the trip's shipment_ids; one $or
+    # query returns each invoice once
+    shipment_ids = stats.get("shipment_ids", [])
+    invoice_links = [{"trip_id": trip_id}]
+    if shipment_ids:
+        invoice_links.append({"shipment_ids": {"$in": shipment_ids}})
+    invoices = await db.invoices.find(
+        {"tenant_id": tenant_id, "$or": invoice_links},
         {"id": 1, "total": 1, "_id": 0}
     ).to_list(1000)
-    
-    # Also get invoices linked by shipment_ids (for backward compatibility)
-    shipment_invoices = await db.invoices.find(
-        {"tenant_id": tenant_id, "shipment_ids": {"$in": shipment_ids}},
-        {"id": 1, "total": 1, "_id": 0}
-    ).to_list(1000) if shipment_ids else []
-    
-    # Combine and deduplicate
-    seen_invoice_ids = set()
-    invoiced_value = 0
-    for inv in trip_invoices + shipment_invoices:
-        if inv["id"] not in seen_invoice_ids:
-            seen_invoice_ids.add(inv["id"])
-            invoiced_value += inv.get("total", 0) or 0
-    
-    # Get created by user
-    created_by_user = None
-    if trip.get("created_by"):
-        created_by_user = await db.users.find_one({"id": trip["created_by"]}, {"name": 1, "_id": 0})
+    invoiced_value = sum(inv.get("total", 0) or 0 for inv in invoices)
     
     return {
         "trip": {
@@ -397,7 +446,7 @@ async def get_trip_summary(
             "total_parcels": total_parcels,
             "total_pieces": total_pieces,
             "total_weight": round(total_weight, 2),
-            "total_clients": len(unique_clients),
+            "total_clients": stats.get("total_clients", 0),
             "invoiced_value": round(invoiced_value, 2),
             "loaded_parcels": loaded_parcels,
             "loading_percentage": loading_percentage
@@ -417,67 +466,67 @@ async def list_trips_with_stats(
         query["status"] = status
     
     trips = await db.trips.find(query, {"_id": 0}).sort("created_at", -1).to_list(100)
+    trip_ids = [trip["id"] for trip in trips]
+    
+    # Shipment stats per trip, vehicles and drivers for the whole page, one query each
+    shipment_stats, vehicles, drivers = await asyncio.gather(
+        db.shipments.aggregate([
+            {"$match": {"tenant_id": tenant_id, "trip_id": {"$in": trip_ids}}},
+            {"$group": shipment_stats_fields("$trip_id")},
+            CLIENT_COUNT_STAGE
+        ]).to_list(None),
+        db.vehicles.find(
+            {"id": {"$in": list({trip["vehicle_id"] for trip in trips if trip.get("vehicle_id")})}},
+            {"_id": 0, "id": 1, "registration_number": 1, "vehicle_type": 1}
+        ).to_list(None),
+        db.drivers.find(
+            {"id": {"$in": list({trip["driver_id"] for trip in trips if trip.get("driver_id")})}},
+            {"_id": 0, "id": 1, "name": 1, "phone": 1}
+        ).to_list(None)
+    )
+    stats_by_trip = {row["_id"]: row for row in shipment_stats}
+    vehicles_by_id = {v.pop("id"): v for v in vehicles}
+    drivers_by_id = {d.pop("id"): d for d in drivers}
+    
+    # Invoices linked by trip_id, or by shipment_ids (for backward
+    # compatibility) to every trip carrying one of their shipments, in one query
+    shipment_trips = {
+        shipment_id: row["_id"]
+        for row in shipment_stats
+        for shipment_id in row["shipment_ids"]
+    }
+    invoice_links = [{"trip_id": {"$in": trip_ids}}]
+    if shipment_trips:
+        invoice_links.append({"shipment_ids": {"$in": list(shipment_trips)}})
+    invoices = await db.invoices.find(
+        {"tenant_id": tenant_id, "$or": invoice_links},
+        {"id": 1, "trip_id": 1, "total": 1, "shipment_ids": 1, "_id": 0}
+    ).to_list(None)
+    
+    # Deduplicate per trip
+    trip_invoice_totals = {trip_id: {} for trip_id in trip_ids}
+    for inv in invoices:
+        linked_trips = {shipment_trips.get(sid) for sid in inv.get("shipment_ids") or []}
+        linked_trips.add(inv.get("trip_id"))
+        for trip_id in linked_trips & trip_invoice_totals.keys():
+            trip_invoice_totals[trip_id][inv["id"]] = inv.get("total", 0) or 0
     
     result = []
     for trip in trips:
-        # Get shipments for this trip
-        shipments = await db.shipments.find(
-            {"trip_id": trip["id"], "tenant_id": tenant_id},
-            {"_id": 0, "id": 1, "total_weight": 1, "client_id": 1, "status": 1}
-        ).to_list(1000)
-        
-        total_parcels = len(shipments)
-        total_weight = sum(s.get("total_weight", 0) or 0 for s in shipments)
-        unique_clients = set(s.get("client_id") for s in shipments if s.get("client_id"))
-        
-        # Count loaded
-        loaded_statuses = ['staged', 'loaded', 'in_transit', 'delivered']
-        loaded_parcels = sum(1 for s in shipments if s.get("status") in loaded_statuses)
+        stats = stats_by_trip.get(trip["id"], {})
+        total_parcels = stats.get("total_parcels", 0)
+        loaded_parcels = stats.get("loaded_parcels", 0)
         loading_percentage = round((loaded_parcels / total_parcels * 100) if total_parcels > 0 else 0)
         
-        # Get invoiced value - query by BOTH trip_id and shipment_ids
-        shipment_ids = [s["id"] for s in shipments]
-        
-        # Get invoices linked by trip_id
-        trip_invoices = await db.invoices.find(
-            {"tenant_id": tenant_id, "trip_id": trip["id"]},
-            {"id": 1, "total": 1, "_id": 0}
-        ).to_list(1000)
-        
-        # Also get invoices linked by shipment_ids
-        shipment_invoices = []
-        if shipment_ids:
-            shipment_invoices = await db.invoices.find(
-                {"tenant_id": tenant_id, "shipment_ids": {"$in": shipment_ids}},
-                {"id": 1, "total": 1, "_id": 0}
-            ).to_list(1000)
-        
-        # Combine and deduplicate
-        seen_invoice_ids = set()
-        invoiced_value = 0
-        for inv in trip_invoices + shipment_invoices:
-            if inv["id"] not in seen_invoice_ids:
-                seen_invoice_ids.add(inv["id"])
-                invoiced_value += inv.get("total", 0) or 0
-        
-        # Get vehicle and driver info
-        vehicle = None
-        if trip.get("vehicle_id"):
-            vehicle = await db.vehicles.find_one({"id": trip["vehicle_id"]}, {"_id": 0, "registration_number": 1, "vehicle_type": 1})
-        
-        driver = None
-        if trip.get("driver_id"):
-            driver = await db.drivers.find_one({"id": trip["driver_id"]}, {"_id": 0, "name": 1, "phone": 1})
-        
         result.append({
             **trip,
-            "vehicle": vehicle,
-            "driver": driver,
+            "vehicle": vehicles_by_id.get(trip.get("vehicle_id")),
+            "driver": drivers_by_id.get(trip.get("driver_id")),
             "stats": {
                 "total_parcels": total_parcels,
-                "total_weight": round(total_weight, 2),
-                "total_clients": len(unique_clients),
-                "invoiced_value": round(invoiced_value, 2),
+                "total_weight": round(stats.get("total_weight", 0), 2),
+                "total_clients": stats.get("total_clients", 0),
+                "invoiced_value": round(sum(trip_invoice_totals[trip["id"]].values()), 2),
                 "loaded_parcels": loaded_parcels,
                 "loading_percentage": loading_percentage
             }
@@ -487,20 +536,37 @@ async def list_trips_with_stats(
 
 # ============ TRIP EXPENSES ROUTES ============
 
-@router.get("/trips/{trip_id}/expenses", response_model=List[TripExpense])
+async def get_trip_or_404(trip_id: str, tenant_id: str = Depends(get_tenant_id)) -> dict:
+    """
+    Dependency loading the trip named in the path, scoped to the tenant.
+    
+    Only the fields the expense routes check are read.
+    
+    Args:
+        trip_id: Trip ID from the path
+        tenant_id: Current tenant
+    
+    Returns:
+        Trip dict with id and locked_at
+    
+    Raises:
+        HTTPException: 404 if the trip doesn't exist for this tenant
+    """
+    trip = await db.trips.find_one({"id": trip_id, "tenant_id": tenant_id}, {"_id": 0, "id": 1, "locked_at": 1})
+    if not trip:
+        raise HTTPException(status_code=404, detail="Trip not found")
+    return trip
+
+
+@router.get("/trips/{trip_id}/expenses", response_class=ORJSONResponse)
 async def list_trip_expenses(
     trip_id: str,
-    tenant_id: str = Depends(get_tenant_id)
+    trip: dict = Depends(get_trip_or_404)
 ):
     """List all expenses for a trip"""
-    # Verify trip exists and belongs to tenant
-    trip = await db.trips.find_one({"id": trip_id, "tenant_id": tenant_id}, {"_id": 0})
-    if not trip:
-        raise HTTPException(status_code=404, detail="Trip not found")
-    
     expenses = await db.trip_expenses.find(
         {"trip_id": trip_id},
-        {"_id": 0}
+        TRIP_EXPENSE_PROJECTION
     ).sort("expense_date", -1).to_list(100)
     
     return expenses
@@ -509,15 +575,10 @@ async def list_trip_expenses(
 async def create_trip_expense(
     trip_id: str,
     expense_data: TripExpenseCreate,
-    tenant_id: str = Depends(get_tenant_id),
+    trip: dict = Depends(get_trip_or_404),
     user: dict = Depends(get_current_user)
 ):
     """Add an expense to a trip"""
-    # Verify trip exists and belongs to tenant
-    trip = await db.trips.find_one({"id": trip_id, "tenant_id": tenant_id}, {"_id": 0})
-    if not trip:
-        raise HTTPException(status_code=404, detail="Trip not found")
-    
     expense = TripExpense(
         **expense_data.model_dump(),
         trip_id=trip_id,
@@ -525,7 +586,6 @@ async def create_trip_expense(
     )
     
     doc = expense.model_dump()
-    doc['created_at'] = doc['created_at'].isoformat()
     await db.trip_expenses.insert_one(doc)
     
     return expense
@@ -535,45 +595,38 @@ async def update_trip_expense(
     trip_id: str,
     expense_id: str,
     update_data: TripExpenseUpdate,
-    tenant_id: str = Depends(get_tenant_id),
+    trip: dict = Depends(get_trip_or_404),
     user: dict = Depends(get_current_user)
 ):
     """Update a trip expense (locked trips: owner only)"""
-    # Verify trip exists and belongs to tenant
-    trip = await db.trips.find_one({"id": trip_id, "tenant_id": tenant_id}, {"_id": 0})
-    if not trip:
-        raise HTTPException(status_code=404, detail="Trip not found")
-    
     # Check if trip is locked (only owner can edit expenses on locked trips)
     if trip.get("locked_at") and user.get("role") != "owner":
         raise HTTPException(status_code=403, detail="Trip is locked. Only owner can edit expenses.")
     
     update_dict = {k: v for k, v in update_data.model_dump().items() if v is not None}
     
+    query = {"id": expense_id, "trip_id": trip_id}
     if update_dict:
-        result = await db.trip_expenses.update_one(
-            {"id": expense_id, "trip_id": trip_id},
-            {"$set": update_dict}
+        expense = await db.trip_expenses.find_one_and_update(
+            query,
+            {"$set": update_dict},
+            projection={"_id": 0},
+            return_document=ReturnDocument.AFTER
         )
-        if result.matched_count == 0:
+        if not expense:
             raise HTTPException(status_code=404, detail="Expense not found")
-    
-    expense = await db.trip_expenses.find_one({"id": expense_id, "trip_id": trip_id}, {"_id": 0})
+    else:
+        expense = await db.trip_expenses.find_one(query, {"_id": 0})
     return expense
 
 @router.delete("/trips/{trip_id}/expenses/{expense_id}")
 async def delete_trip_expense(
     trip_id: str,
     expense_id: str,
-    tenant_id: str = Depends(get_tenant_id),
+    trip: dict = Depends(get_trip_or_404),
     user: dict = Depends(get_current_user)
 ):
     """Delete a trip expense (locked trips: owner only)"""
-    # Verify trip exists and belongs to tenant
-    trip = await db.trips.find_one({"id": trip_id, "tenant_id": tenant_id}, {"_id": 0})
-    if not trip:
-        raise HTTPException(status_code=404, detail="Trip not found")
-    
     # Check if trip is locked
     if trip.get("locked_at") and user.get("role") != "owner":
         raise HTTPException(status_code=403, detail="Trip is locked. Only owner can delete expenses.")
@@ -608,17 +661,30 @@ async def get_trip_parcels(
     
     parcels = await db.shipments.find(query, {"_id": 0}).sort("created_at", -1).to_list(500)
     
-    # Enrich with client names and piece counts
+    # Enrich with client names and pieces, each fetched in one batch
+    clients, pieces = await asyncio.gather(
+        db.clients.find(
+            {"id": {"$in": list({p["client_id"] for p in parcels if p.get("client_id")})}},
+            {"_id": 0, "id": 1, "name": 1}
+        ).to_list(None),
+        db.shipment_pieces.find(
+            {"shipment_id": {"$in": [p["id"] for p in parcels]}},
+            {"_id": 0}
+        ).to_list(None)
+    )
+    client_names = {c["id"]: c.get("name") for c in clients}
+    pieces_by_shipment = defaultdict(list)
+    for piece in pieces:
+        pieces_by_shipment[piece["shipment_id"]].append(piece)
+    
     result = []
     for parcel in parcels:
-        client = await db.clients.find_one({"id": parcel.get("client_id")}, {"_id": 0, "name": 1})
-        pieces = await db.shipment_pieces.find({"shipment_id": parcel["id"]}, {"_id": 0}).to_list(100)
-        
+        parcel_pieces = pieces_by_shipment.get(parcel["id"], [])
         result.append({
             **parcel,
-            "client_name": client.get("name") if client else "Unknown",
-            "pieces": pieces,
-            "piece_count": len(pieces)
+            "client_name": client_names.get(parcel.get("client_id"), "Unknown"),
+            "pieces": parcel_pieces,
+            "piece_count": len(parcel_pieces)
         })
     
     return result
@@ -637,22 +703,22 @@ async def get_trip_clients_summary(
     # Get all parcels for this trip
     parcels = await db.shipments.find(
         {"trip_id": trip_id, "tenant_id": tenant_id},
-        {"_id": 0}
+        {"_id": 0, "id": 1, "client_id": 1, "total_weight": 1}
     ).to_list(500)
     
     # Group by client
     client_data = {}
+    shipment_clients = {}
     for parcel in parcels:
         client_id = parcel.get("client_id")
         if not client_id:
             continue
         
         if client_id not in client_data:
-            client = await db.clients.find_one({"id": client_id}, {"_id": 0})
             client_data[client_id] = {
                 "client_id": client_id,
-                "client_name": client.get("name") if client else "Unknown",
-                "client_phone": client.get("phone") if client else None,
+                "client_name": None,
+                "client_phone": None,
                 "parcel_count": 0,
                 "total_weight": 0,
                 "shipment_ids": [],
@@ -662,73 +728,69 @@ async def get_trip_clients_summary(
         client_data[client_id]["parcel_count"] += 1
         client_data[client_id]["total_weight"] += parcel.get("total_weight", 0) or 0
         client_data[client_id]["shipment_ids"].append(parcel["id"])
+        shipment_clients[parcel["id"]] = client_id
+    
+    # Invoices linked by trip_id, plus invoices linked by shipment_ids (for
+    # backward compatibility), in one query; trip-linked invoices listed first
+    invoice_query = {"tenant_id": tenant_id, "trip_id": trip_id}
+    if shipment_clients:
+        invoice_query = {"tenant_id": tenant_id, "$or": [
+            {"trip_id": trip_id},
+            {"shipment_ids": {"$in": list(shipment_clients)}}
+        ]}
+    invoices = await db.invoices.find(
+        invoice_query,
+        {"_id": 0, "id": 1, "client_id": 1, "trip_id": 1, "shipment_ids": 1,
+         "invoice_number": 1, "total": 1, "status": 1}
+    ).to_list(1000)
+    invoices.sort(key=lambda inv: inv.get("trip_id") != trip_id)
+    
+    # Paid amounts and client details, each fetched in one batch
+    invoice_ids = [inv["id"] for inv in invoices]
+    paid_rows, clients = await asyncio.gather(
+        db.payments.aggregate([
+            {"$match": {"invoice_id": {"$in": invoice_ids}}},
+            {"$group": {"_id": "$invoice_id", "paid_amount": {"$sum": "$amount"}}}
+        ]).to_list(None),
+        db.clients.find(
+            {"id": {"$in": list({*client_data, *(inv.get("client_id") for inv in invoices if inv.get("client_id"))})}},
+            {"_id": 0, "id": 1, "name": 1, "phone": 1}
+        ).to_list(None)
+    )
+    paid_by_invoice = {row["_id"]: row["paid_amount"] for row in paid_rows}
+    clients_by_id = {c["id"]: c for c in clients}
     
-    # Get invoices for this trip (query by BOTH trip_id and shipment_ids)
-    trip_invoices = await db.invoices.find(
-        {"tenant_id": tenant_id, "trip_id": trip_id},
-        {"_id": 0}
-    ).to_list(100)
-    
-    # Build a map of client_id -> invoices from trip_invoices
-    trip_invoice_map = {}
-    for inv in trip_invoices:
-        cid = inv.get("client_id")
-        if cid:
-            if cid not in trip_invoice_map:
-                trip_invoice_map[cid] = []
-            trip_invoice_map[cid].append(inv)
-    
-    # For each client, add their invoices (from trip_id query OR shipment_ids query)
-    for client_id, data in client_data.items():
-        # First check invoices linked by trip_id
-        client_invoices = trip_invoice_map.get(client_id, [])
-        
-        # Also check invoices linked by shipment_ids (for backward compatibility)
-        if data["shipment_ids"]:
-            shipment_invoices = await db.invoices.find(
-                {"tenant_id": tenant_id, "client_id": client_id, "shipment_ids": {"$in": data["shipment_ids"]}},
-                {"_id": 0}
-            ).to_list(100)
-            # Add any invoices not already in the list
-            existing_ids = {inv["id"] for inv in client_invoices}
-            for inv in shipment_invoices:
-                if inv["id"] not in existing_ids:
-                    client_invoices.append(inv)
-        
-        for inv in client_invoices:
-            payments = await db.payments.find({"invoice_id": inv["id"]}, {"_id": 0, "amount": 1}).to_list(100)
-            paid_amount = sum(p.get("amount", 0) for p in payments)
-            data["invoices"].append({
-                "id": inv["id"],
-                "invoice_number": inv.get("invoice_number"),
-                "total": inv.get("total", 0),
-                "status": inv.get("status"),
-                "paid_amount": paid_amount
-            })
-    
-    # Also add any clients from trip invoices that aren't in the parcels list
-    for client_id, invs in trip_invoice_map.items():
-        if client_id not in client_data:
-            client = await db.clients.find_one({"id": client_id}, {"_id": 0})
+    for inv in invoices:
+        client_id = inv.get("client_id")
+        if not client_id:
+            continue
+        if inv.get("trip_id") != trip_id:
+            # Shipment-linked invoices belong to a client only through that client's own parcels
+            if not any(shipment_clients.get(sid) == client_id for sid in inv.get("shipment_ids") or []):
+                continue
+        elif client_id not in client_data:
+            # Clients invoiced on the trip without parcels on it
             client_data[client_id] = {
                 "client_id": client_id,
-                "client_name": client.get("name") if client else "Unknown",
-                "client_phone": client.get("phone") if client else None,
+                "client_name": None,
+                "client_phone": None,
                 "parcel_count": 0,
                 "total_weight": 0,
                 "shipment_ids": [],
                 "invoices": []
             }
-            for inv in invs:
-                payments = await db.payments.find({"invoice_id": inv["id"]}, {"_id": 0, "amount": 1}).to_list(100)
-                paid_amount = sum(p.get("amount", 0) for p in payments)
-                client_data[client_id]["invoices"].append({
-                    "id": inv["id"],
-                    "invoice_number": inv.get("invoice_number"),
-                    "total": inv.get("total", 0),
-                    "status": inv.get("status"),
-                    "paid_amount": paid_amount
-                })
+        client_data[client_id]["invoices"].append({
+            "id": inv["id"],
+            "invoice_number": inv.get("invoice_number"),
+            "total": inv.get("total", 0),
+            "status": inv.get("status"),
+            "paid_amount": paid_by_invoice.get(inv["id"], 0)
+        })
+    
+    for client_id, data in client_data.items():
+        client = clients_by_id.get(client_id)
+        data["client_name"] = client.get("name") if client else "Unknown"
+        data["client_phone"] = client.get("phone") if client else None
     
     # Calculate totals
     result = list(client_data.values())
@@ -754,32 +816,34 @@ async def get_trip_history(
     if not trip:
         raise HTTPException(status_code=404, detail="Trip not found")
     
-    # Get shipment IDs for this trip
-    shipments = await db.shipments.find(
-        {"trip_id": trip_id, "tenant_id": tenant_id},
-        {"id": 1, "_id": 0}
-    ).to_list(500)
-    shipment_ids = [s["id"] for s in shipments]
-    
-    # Build query for audit logs
-    queries = [{"record_id": trip_id, "table_name": "trips"}]
-    
-    if filter_type == "parcels" or filter_type is None:
-        for sid in shipment_ids:
-            queries.append({"record_id": sid, "table_name": "shipments"})
+    include_parcels = filter_type in ("parcels", None)
+    include_expenses = filter_type in ("expenses", None)
+    include_invoices = filter_type in ("invoices", None)
     
-    if filter_type == "expenses" or filter_type is None:
-        expenses = await db.trip_expenses.find({"trip_id": trip_id}, {"id": 1, "_id": 0}).to_list(100)
-        for exp in expenses:
-            queries.append({"record_id": exp["id"], "table_name": "trip_expenses"})
+    # Shipment and expense IDs for this trip, fetched concurrently
+    shipment_ids, expense_ids = await asyncio.gather(
+        db.shipments.distinct("id", {"trip_id": trip_id, "tenant_id": tenant_id})
+        if include_parcels or include_invoices else asyncio.sleep(0, result=[]),
+        db.trip_expenses.distinct("id", {"trip_id": trip_id})
+        if include_expenses else asyncio.sleep(0, result=[])
+    )
     
-    if filter_type == "invoices" or filter_type is None:
+    invoice_ids = []
+    if include_invoices and shipment_ids:
         invoices = await db.invoices.find(
             {"tenant_id": tenant_id, "shipment_ids": {"$in": shipment_ids}},
             {"id": 1, "_id": 0}
         ).to_list(100)
-        for inv in invoices:
-            queries.append({"record_id": inv["id"], "table_name": "invoices"})
+        invoice_ids = [inv["id"] for inv in invoices]
+    
+    # One clause per table, each a bounded $in on the audit log index
+    queries = [{"table_name": "trips", "record_id": trip_id}]
+    if include_parcels and shipment_ids:
+        queries.append({"table_name": "shipments", "record_id": {"$in": shipment_ids}})
+    if expense_ids:
+        queries.append({"table_name": "trip_expenses", "record_id": {"$in": expense_ids}})
+    if invoice_ids:
+        queries.append({"table_name": "invoices", "record_id": {"$in": invoice_ids}})
     
     # Get audit logs
     audit_logs = await db.audit_logs.find(
@@ -787,21 +851,19 @@ async def get_trip_history(
         {"_id": 0}
     ).sort("created_at", -1).to_list(200)
     
-    # Enrich with user names
-    result = []
-    user_cache = {}
+    # Enrich with user names, fetched in one batch
+    user_ids = list({log["user_id"] for log in audit_logs if log.get("user_id")})
+    users = await db.users.find(
+        {"id": {"$in": user_ids}},
+        {"_id": 0, "id": 1, "name": 1}
+    ).to_list(None)
+    user_names = {u["id"]: u.get("name") for u in users}
+    
     for log in audit_logs:
         user_id = log.get("user_id")
-        if user_id and user_id not in user_cache:
-            user = await db.users.find_one({"id": user_id}, {"name": 1, "_id": 0})
-            user_cache[user_id] = user.get("name") if user else "Unknown"
-        
-        result.append({
-            **log,
-            "user_name": user_cache.get(user_id, "System")
-        })
+        log["user_name"] = user_names.get(user_id, "Unknown") if user_id else "System"
     
-    return result
+    return audit_logs
 
 @router.post("/trips/{trip_id}/close")
 async def close_trip(
@@ -873,64 +935,102 @@ async def generate_trip_invoices(
             client_parcels[client_id] = []
         client_parcels[client_id].append(parcel)
     
-    # Generate invoices for each client
-    from datetime import datetime, timezone, timedelta
-    invoices_created = []
+    # Fetch existing invoices, client details and rates for every client at once.
+    # effective_from may be a date or a full ISO timestamp, so compare as strings
+    # against tomorrow's date
+    client_ids = list(client_parcels)
+    tomorrow = (datetime.now(timezone.utc) + timedelta(days=1)).strftime("%Y-%m-%d")
+    all_shipment_ids = [p["id"] for ps in client_parcels.values() for p in ps]
+    existing_invoices, clients, rates = await asyncio.gather(
+        db.invoices.find(
+            {"tenant_id": tenant_id, "client_id": {"$in": client_ids}, "shipment_ids": {"$in": all_shipment_ids}},
+            {"_id": 0, "client_id": 1, "shipment_ids": 1}
+        ).to_list(None),
+        db.clients.find({"tenant_id": tenant_id, "id": {"$in": client_ids}}, {"_id": 0}).to_list(None),
+        # Each client's current rate: the latest one already in effect
+        db.client_rates.aggregate([
+            {"$match": {
+                "tenant_id": tenant_id,
+                "client_id": {"$in": client_ids},
+                "effective_from": {"$gt": "", "$lt": tomorrow}
+            }},
+            {"$sort": {"client_id": 1, "effective_from": -1}},
+            {"$group": {"_id": "$client_id", "rate": {"$first": "$$ROOT"}}},
+            {"$replaceRoot": {"newRoot": "$rate"}},
+            {"$project": {"_id": 0}}
+        ]).to_list(None)
+    )
+    clients_by_id = {c["id"]: c for c in clients}
+    rate_by_client = {r["client_id"]: r for r in rates}
+    invoiced_shipments = defaultdict(list)
+    for inv in existing_invoices:
+        invoiced_shipments[inv["client_id"]].append(set(inv.get("shipment_ids") or []))
+    
+    # An invoice already exists when one covers all of the client's shipments
+    client_contexts = [
+        (
+            any(set(s["id"] for s in client_shipments) <= ids for ids in invoiced_shipments[client_id]),
+            clients_by_id.get(client_id),
+            rate_by_client.get(client_id)
+        )
+        for client_id, client_shipments in client_parcels.items()
+    ]
     
-    for client_id, client_shipments in client_parcels.items():
-        # Check if invoice already exists for these shipments
-        shipment_ids = [s["id"] for s in client_shipments]
-        existing = await db.invoices.find_one({
-            "tenant_id": tenant_id,
-            "client_id": client_id,
-            "shipment_ids": {"$all": shipment_ids}
-        })
+    # Reserve one block of invoice numbers for every client still to be invoiced
+    year = datetime.now(timezone.utc).year
+    to_invoice = sum(1 for existing, _, _ in client_contexts if not existing)
+    seq = await reserve_invoice_sequence(tenant_id, year, to_invoice) if to_invoice else 0
+    now = datetime.now(timezone.utc)
+    
+    new_invoices = []
+    invoices_created = []
+    for (client_id, client_shipments), (existing, client, rate) in zip(client_parcels.items(), client_contexts):
         if existing:
             continue
         
-        # Get client info
-        client = await db.clients.find_one({"id": client_id}, {"_id": 0})
-        
-        # Generate invoice number
-        year = datetime.now().year
-        count = await db.invoices.count_documents({"tenant_id": tenant_id})
-        invoice_number = f"INV-{year}-{str(count + 1).zfill(4)}"
+        invoice_number = format_invoice_number(year, seq)
+        seq += 1
         
         # Calculate totals
         total_weight = sum(s.get("total_weight", 0) or 0 for s in client_shipments)
-        
-        # Get client rate
-        rate = await db.client_rates.find_one({"client_id": client_id}, {"_id": 0})
         rate_per_kg = rate.get("rate_per_kg", 50) if rate else 50
         
         subtotal = total_weight * rate_per_kg
         vat = subtotal * 0.15
         total = subtotal + vat
         
-        invoice = {
+        new_invoices.append({
             "id": str(uuid.uuid4()),
             "tenant_id": tenant_id,
             "client_id": client_id,
             "invoice_number": invoice_number,
-            "shipment_ids": shipment_ids,
+            "shipment_ids": [s["id"] for s in client_shipments],
             "trip_id": trip_id,
             "subtotal": round(subtotal, 2),
             "vat": round(vat, 2),
             "total": round(total, 2),
+            "paid_amount": 0,
+            "outstanding": round(total, 2),
             "status": "draft",
-            "issue_date": datetime.now(timezone.utc).isoformat(),
-            "due_date": (datetime.now(timezone.utc) + timedelta(days=30)).isoformat(),
+            "issue_date": now.isoformat(),
+            "due_date": (now + timedelta(days=30)).isoformat(),
             "created_by": user["id"],
-            "created_at": datetime.now(timezone.utc).isoformat()
-        }
-        
-        await db.invoices.insert_one(invoice)
+            "created_at": now.isoformat(),
+            "client_name": client.get("name") if client else None,
+            "client_email": client.get("email") if client else None,
+            "client_phone": client.get("phone") if client else None,
+            "client_whatsapp": client.get("whatsapp") if client else None,
+            "trip_number": trip.get("trip_number")
+        })
         invoices_created.append({
             "invoice_number": invoice_number,
             "client_name": client.get("name") if client else "Unknown",
             "total": total
         })
     
+    if new_invoices:
+        await db.invoices.insert_many(new_invoices)
+    
     return {
         "message": f"Created {len(invoices_created)} invoice(s)",
         "invoices": invoices_created
@@ -961,6 +1061,7 @@ async def remove_parcel_from_trip(
         {"id": parcel_id},
         {"$set": {"trip_id": None, "status": "warehouse"}}
     )
+    invalidate_dashboard_cache(tenant_id)
     
     # Reset barcodes to TEMP
     pieces = await db.shipment_pieces.find({"shipment_id": parcel_id}, {"_id": 0}).to_list(100)
@@ -997,21 +1098,25 @@ async def list_trip_documents(
     if not trip:
         raise HTTPException(status_code=404, detail="Trip not found")
     
-    docs = await db.trip_documents.find(
-        {"trip_id": trip_id},
-        {"_id": 0}
-    ).sort("uploaded_at", -1).to_list(100)
-    
-    # Enrich with uploader names
-    result = []
-    for doc in docs:
-        uploader = await db.users.find_one({"id": doc.get("uploaded_by")}, {"name": 1, "_id": 0})
-        result.append({
-            **doc,
-            "uploader_name": uploader.get("name") if uploader else "Unknown"
-        })
-    
-    return result
+    # Latest documents with the uploader's name, joined server-side
+    docs = await db.trip_documents.aggregate([
+        {"$match": {"trip_id": trip_id}},
+        {"$sort": {"uploaded_at": -1}},
+        {"$limit": 100},
+        {"$lookup": {
+            "from": "users",
+            "let": {"user_id": "$uploaded_by"},
+            "pipeline": [
+                {"$match": {"$expr": {"$eq": ["$id", "$$user_id"]}}},
+                {"$project": {"_id": 0, "name": 1}}
+            ],
+            "as": "uploader"
+        }},
+        {"$addFields": {"uploader_name": {"$ifNull": [{"$arrayElemAt": ["$uploader.name", 0]}, "Unknown"]}}},
+        {"$project": {"_id": 0, "uploader": 0}}
+    ]).to_list(100)
+    
+    return docs
 
 @router.post("/trips/{trip_id}/documents")
 async def upload_trip_document(
@@ -1120,5 +1225,6 @@ async def duplicate_trip(
     }
     
     await db.trips.insert_one(new_trip)
+    invalidate_dashboard_cache(tenant_id)
     
     return {"id": new_trip["id"], "trip_number": new_trip_number, "message": "Trip duplicated successfully"}
@@ -12,6 +12,7 @@ from dependencies import get_current_user, get_tenant_id
 from models.enums import ShipmentStatus, AuditAction
 from models.schemas import create_audit_log
 from services.barcode_service import generate_barcode
+from utils.helpers import invalidate_dashboard_cache
 
 router = APIRouter()
 
@@ -250,6 +251,7 @@ async def bulk_update_parcel_status(
         {"id": {"$in": parcel_ids}, "tenant_id": tenant_id},
         {"$set": update_data}
     )
+    invalidate_dashboard_cache(tenant_id)
     
     # Create audit logs for each
     for pid in parcel_ids:
@@ -309,12 +311,13 @@ async def scan_and_collect_parcel(
     
     if not shipment:
         # Try partial ID match (first 8 characters)
-        shipments = await db.shipments.find(
+        # Stream ids so the scan stops at the first match
+        cursor = db.shipments.find(
             {"tenant_id": tenant_id},
             {"_id": 0, "id": 1}
-        ).to_list(10000)
+        )
         
-        for s in shipments:
+        async for s in cursor:
             if s["id"][:8].upper() == barcode_upper or s["id"].upper().startswith(barcode_upper):
                 shipment = await db.shipments.find_one(
                     {"id": s["id"], "tenant_id": tenant_id},
@@ -347,6 +350,7 @@ async def scan_and_collect_parcel(
         {"id": shipment["id"], "tenant_id": tenant_id},
         {"$set": update_data}
     )
+    invalidate_dashboard_cache(tenant_id)
     
     # Create audit log
     await create_audit_log(
@@ -399,6 +403,7 @@ async def bulk_assign_parcels_to_trip(
         {"id": {"$in": parcel_ids}, "tenant_id": tenant_id},
         {"$set": update_data}
     )
+    invalidate_dashboard_cache(tenant_id)
     
     # Update barcodes if assigning to a trip
     if trip_id:
@@ -438,6 +443,7 @@ async def bulk_delete_parcels(
     result = await db.shipments.delete_many(
         {"id": {"$in": parcel_ids}, "tenant_id": tenant_id}
     )
+    invalidate_dashboard_cache(tenant_id)
     
     # Audit logs
     for pid in parcel_ids:
@@ -489,6 +495,7 @@ async def bulk_collect_parcels(
         {"id": {"$in": valid_ids}, "tenant_id": tenant_id},
         {"$set": update_data}
     )
+    invalidate_dashboard_cache(tenant_id)
     
     # Audit logs
     for pid in valid_ids:
@@ -7,6 +7,9 @@ from datetime import datetime, timezone
 import random
 import string
 
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
 from database import db
 
 
@@ -29,9 +32,42 @@ def generate_barcode(trip_number: Optional[str], shipment_seq: int, piece_number
         return f"TEMP-{random_digits}"
 
 
+def trip_barcode_expression(trip_number: str, shipment_seq: int) -> dict:
+    """
+    Aggregation expression building the same trip barcode as generate_barcode
+    from a piece document's piece_number, for pipeline-style update_many.
+    
+    Args:
+        trip_number: Trip number (e.g., "S27")
+        shipment_seq: Shipment sequence number (zero-padded to 3 digits)
+    
+    Returns:
+        Expression evaluating to e.g. "S27-001-01" for each piece
+    """
+    piece_number = {"$toString": "$piece_number"}
+    return {"$concat": [
+        f"{trip_number}-{shipment_seq:03d}-",
+        {"$cond": [{"$lt": ["$piece_number", 10]}, {"$concat": ["0", piece_number]}, piece_number]}
+    ]}
+
+
+def format_invoice_number(year: int, seq: int) -> str:
+    """
+    Format an invoice number as INV-YYYY-NNN
+    
+    Args:
+        year: Invoice year
+        seq: Sequence number within the year (zero-padded to 3 digits)
+    
+    Returns:
+        Invoice number string (e.g., "INV-2026-001")
+    """
+    return f"INV-{year}-{seq:03d}"
+
+
 async def generate_invoice_number(tenant_id: str) -> str:
     """
-    Generate invoice number in format: INV-YYYY-NNN
+    Generate the next invoice number in format: INV-YYYY-NNN
     
     Args:
         tenant_id: Tenant ID to scope invoice numbering
@@ -40,20 +76,62 @@ async def generate_invoice_number(tenant_id: str) -> str:
         Invoice number string (e.g., "INV-2026-001")
     """
     current_year = datetime.now(timezone.utc).year
+    seq = await reserve_invoice_sequence(tenant_id, current_year)
+    return format_invoice_number(current_year, seq)
+
+
+async def get_highest_invoice_sequence(tenant_id: str, year: int) -> int:
+    """
+    Highest sequence number among the tenant's INV-YYYY-N... invoices for a year.
     
-    # Find the highest invoice number for this tenant this year
-    pattern = f"INV-{current_year}-"
-    last_invoice = await db.invoices.find_one(
-        {"tenant_id": tenant_id, "invoice_number": {"$regex": f"^{pattern}"}},
-        {"_id": 0, "invoice_number": 1},
-        sort=[("invoice_number", -1)]
-    )
+    Compared numerically, so mixed padding widths (e.g. "INV-2026-999" and
+    "INV-2026-1000") are ordered correctly.
     
-    if last_invoice:
-        # Extract the sequence number and increment
-        last_num = int(last_invoice["invoice_number"].split("-")[-1])
-        next_num = last_num + 1
-    else:
-        next_num = 1
+    Args:
+        tenant_id: Tenant ID to scope invoice numbering
+        year: Invoice year
+    
+    Returns:
+        Highest sequence number, or 0 if the tenant has no invoices that year
+    """
+    result = await db.invoices.aggregate([
+        {"$match": {"tenant_id": tenant_id, "invoice_number": {"$regex": f"^INV-{year}-[0-9]+$"}}},
+        {"$group": {"_id": None, "seq": {"$max": {
+            "$toInt": {"$arrayElemAt": [{"$split": ["$invoice_number", "-"]}, 2]}
+        }}}}
+    ]).to_list(1)
+    return result[0]["seq"] if result else 0
+
+
+async def reserve_invoice_sequence(tenant_id: str, year: int, count: int = 1) -> int:
+    """
+    Atomically reserve a block of invoice sequence numbers.
+    
+    The counter lives in the counters collection, keyed per tenant and year,
+    and is shared by manual and trip-generated invoices. A missing counter is
+    seeded once from the highest existing number for that year, so new numbers
+    carry on from invoices numbered before the counter existed.
+    
+    Args:
+        tenant_id: Tenant ID to scope invoice numbering
+        year: Invoice year
+        count: How many consecutive numbers to reserve
     
-    return f"INV-{current_year}-{next_num:03d}"
+    Returns:
+        First sequence number of the reserved block
+    """
+    key = f"invoice:{tenant_id}:{year}"
+    if not await db.counters.find_one({"_id": key}, {"_id": 1}):
+        seed = await get_highest_invoice_sequence(tenant_id, year)
+        try:
+            await db.counters.insert_one({"_id": key, "seq": seed})
+        except DuplicateKeyError:
+            pass  # Another request seeded it first
+    
+    counter = await db.counters.find_one_and_update(
+        {"_id": key},
+        {"$inc": {"seq": count}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    return counter["seq"] - count + 1
@@ -2,9 +2,13 @@
 PDF generation service for Servex Holdings backend.
 Handles invoice PDF generation using ReportLab.
 """
+import asyncio
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
 from datetime import datetime
 from pathlib import Path
+from cachetools import TTLCache
 from fastapi import HTTPException
 from fastapi.responses import StreamingResponse
 from reportlab.lib.pagesizes import letter, A4
@@ -14,8 +18,78 @@ from reportlab.lib.units import inch, mm
 from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, Image
 from reportlab.lib.enums import TA_CENTER, TA_RIGHT, TA_LEFT
 
+from config import PDF_RENDER_WORKERS
 from database import db
 
+# Dedicated pool for ReportLab rendering so PDF bursts don't starve the
+# default executor used by asyncio.to_thread
+pdf_executor = ThreadPoolExecutor(max_workers=PDF_RENDER_WORKERS, thread_name_prefix="pdf-render")
+
+# Rendered invoice PDFs keyed by (tenant_id, invoice_id, generated-at minute,
+# data fingerprint); the footer prints the generation time to the minute
+_invoice_pdf_cache = TTLCache(maxsize=100, ttl=60)
+
+
+def _load_logo_size(path: Path):
+    """Return the (width, height) the invoice logo is drawn at, or None if it can't be read"""
+    if not path.exists():
+        return None
+    try:
+        from PIL import Image as PILImage
+        with PILImage.open(path) as img:
+            return 100, 100 * img.height / img.width
+    except Exception:
+        return None
+
+
+# Invoice colours and paragraph styles; both are read-only once built
+_OLIVE = colors.HexColor('#6B633C')
+_DARK_GRAY = colors.HexColor('#3C3F42')
+_LIGHT_GRAY = colors.HexColor('#F5F5F5')
+
+
+def _build_invoice_styles():
+    """Sample stylesheet extended with the invoice paragraph styles"""
+    styles = getSampleStyleSheet()
+    styles.add(ParagraphStyle(name='CompanyName', fontSize=14, fontName='Helvetica-Bold', textColor=_DARK_GRAY))
+    styles.add(ParagraphStyle(name='CompanyInfo', fontSize=9, fontName='Helvetica', textColor=_DARK_GRAY, leading=12))
+    styles.add(ParagraphStyle(name='InvoiceTitle', fontSize=22, fontName='Helvetica-Bold', textColor=_OLIVE, alignment=TA_RIGHT))
+    styles.add(ParagraphStyle(name='InvoiceInfo', fontSize=10, fontName='Helvetica', textColor=_DARK_GRAY, alignment=TA_RIGHT))
+    styles.add(ParagraphStyle(name='SectionTitle', fontSize=11, fontName='Helvetica-Bold', textColor=_DARK_GRAY))
+    styles.add(ParagraphStyle(name='ClientInfo', fontSize=10, fontName='Helvetica', textColor=_DARK_GRAY, leading=14))
+    styles.add(ParagraphStyle(name='TotalLabel', fontSize=12, fontName='Helvetica-Bold', textColor=_DARK_GRAY, alignment=TA_RIGHT))
+    styles.add(ParagraphStyle(name='TotalAmount', fontSize=16, fontName='Helvetica-Bold', textColor=_OLIVE, alignment=TA_RIGHT))
+    styles.add(ParagraphStyle(name='FooterStyle', fontSize=8, fontName='Helvetica', textColor=colors.gray, alignment=TA_CENTER))
+    styles.add(ParagraphStyle(name='PaymentTerms', fontSize=10, fontName='Helvetica', textColor=_DARK_GRAY, leading=14))
+    styles.add(ParagraphStyle(name='SmallText', fontSize=8, fontName='Helvetica', textColor=_DARK_GRAY))
+    return styles
+
+
+_INVOICE_STYLES = _build_invoice_styles()
+
+# Invoice header logo, probed and sized once at import
+_LOGO_PATH = Path(__file__).parent.parent / 'frontend' / 'public' / 'servex-logo.png'
+_LOGO_SIZE = _load_logo_size(_LOGO_PATH)
+
+
+async def run_pdf_render(render, *args):
+    """
+    Run a synchronous PDF render function on the PDF thread pool.
+    
+    Args:
+        render: Callable that builds the PDF and returns its bytes
+        *args: Positional arguments passed to render
+    
+    Returns:
+        Whatever render returns, typically the PDF bytes
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(pdf_executor, render, *args)
+
+
+# Display symbols for invoice currencies; unknown codes are shown as-is
+_CURRENCY_SYMBOLS = {"ZAR": "R", "KES": "KES", "USD": "$", "EUR": "€", "GBP": "£"}
+
 
 def format_weight(weight, decimals=4):
     """Format weight with specified decimal places"""
@@ -45,8 +119,7 @@ def format_currency(amount, currency="ZAR"):
     """Format currency amount"""
     if amount is None:
         return "-"
-    symbols = {"ZAR": "R", "KES": "KES", "USD": "$", "EUR": "€", "GBP": "£"}
-    symbol = symbols.get(currency, currency)
+    symbol = _CURRENCY_SYMBOLS.get(currency, currency)
     return f"{symbol} {float(amount):,.2f}"
 
 
@@ -72,88 +145,59 @@ def get_payment_terms_display(payment_terms, payment_terms_custom, total):
     return terms_map.get(payment_terms, payment_terms)
 
 
-async def generate_invoice_pdf(
-    invoice_id: str,
-    tenant_id: str
-):
-    """Generate a professional PDF invoice with full client and recipient details"""
-    
-    # Fetch invoice with all related data
-    invoice = await db.invoices.find_one({"id": invoice_id, "tenant_id": tenant_id}, {"_id": 0})
-    if not invoice:
-        raise HTTPException(status_code=404, detail="Invoice not found")
-    
-    # Get client (use snapshot if available, fallback to current)
-    client = await db.clients.find_one({"id": invoice.get("client_id")}, {"_id": 0})
+def render_invoice_pdf(
+    invoice: dict,
+    client: dict,
+    line_items: list,
+    shipments: dict,
+    adjustments: list,
+    payments: list,
+    generated_at: str
+) -> bytes:
+    """
+    Render an invoice PDF from its prefetched data.
+    
+    Args:
+        invoice: Invoice document
+        client: Client document, or None if the client no longer exists
+        line_items: Invoice line items
+        shipments: Shipments referenced by the line items, keyed by id
+        adjustments: Invoice adjustments
+        payments: Payments recorded against the invoice
+        generated_at: Generation time shown in the footer
+    
+    Returns:
+        PDF file contents
+    """
+    paid_amount = sum(p.get("amount", 0) for p in payments)
     
-    # Prefer snapshot data for historical accuracy
+    # Prefer client snapshot data for historical accuracy, fallback to current
     client_name = invoice.get("client_name_snapshot") or (client.get("name") if client else "Unknown")
     client_address = invoice.get("client_address_snapshot") or (client.get("billing_address") or client.get("physical_address") if client else "")
     client_vat = invoice.get("client_vat_snapshot") or (client.get("vat_number") if client else "")
     client_phone = invoice.get("client_phone_snapshot") or (client.get("phone") if client else "")
     client_email = invoice.get("client_email_snapshot") or (client.get("email") if client else "")
     
-    # Get line items with enriched data
-    line_items = await db.invoice_line_items.find({"invoice_id": invoice_id}, {"_id": 0}).to_list(100)
-    
-    # Get shipments for recipient details
-    shipment_ids = [li.get("shipment_id") for li in line_items if li.get("shipment_id")]
-    shipments = {}
-    if shipment_ids:
-        shipment_docs = await db.shipments.find(
-            {"id": {"$in": shipment_ids}},
-            {"_id": 0}
-        ).to_list(100)
-        shipments = {s["id"]: s for s in shipment_docs}
-    
-    # Get adjustments
-    adjustments = await db.invoice_adjustments.find({"invoice_id": invoice_id}, {"_id": 0}).to_list(100)
-    
-    # Get payments
-    payments = await db.payments.find({"invoice_id": invoice_id}, {"_id": 0}).to_list(100)
-    paid_amount = sum(p.get("amount", 0) for p in payments)
-    
-    # Define colors
-    olive = colors.HexColor('#6B633C')
-    dark_gray = colors.HexColor('#3C3F42')
-    light_gray = colors.HexColor('#F5F5F5')
-    
-    # Currency
+    # Currency is fixed per invoice, so resolve its symbol once
     currency = invoice.get("currency", "ZAR")
+    symbol = _CURRENCY_SYMBOLS.get(currency, currency)
+    
+    def money(amount):
+        return "-" if amount is None else f"{symbol} {float(amount):,.2f}"
     
     # Create PDF buffer
     buffer = BytesIO()
     doc = SimpleDocTemplate(buffer, pagesize=A4, leftMargin=15*mm, rightMargin=15*mm, topMargin=15*mm, bottomMargin=15*mm)
     
-    # Styles
-    styles = getSampleStyleSheet()
-    styles.add(ParagraphStyle(name='CompanyName', fontSize=14, fontName='Helvetica-Bold', textColor=dark_gray))
-    styles.add(ParagraphStyle(name='CompanyInfo', fontSize=9, fontName='Helvetica', textColor=dark_gray, leading=12))
-    styles.add(ParagraphStyle(name='InvoiceTitle', fontSize=22, fontName='Helvetica-Bold', textColor=olive, alignment=TA_RIGHT))
-    styles.add(ParagraphStyle(name='InvoiceInfo', fontSize=10, fontName='Helvetica', textColor=dark_gray, alignment=TA_RIGHT))
-    styles.add(ParagraphStyle(name='SectionTitle', fontSize=11, fontName='Helvetica-Bold', textColor=dark_gray))
-    styles.add(ParagraphStyle(name='ClientInfo', fontSize=10, fontName='Helvetica', textColor=dark_gray, leading=14))
-    styles.add(ParagraphStyle(name='TotalLabel', fontSize=12, fontName='Helvetica-Bold', textColor=dark_gray, alignment=TA_RIGHT))
-    styles.add(ParagraphStyle(name='TotalAmount', fontSize=16, fontName='Helvetica-Bold', textColor=olive, alignment=TA_RIGHT))
-    styles.add(ParagraphStyle(name='FooterStyle', fontSize=8, fontName='Helvetica', textColor=colors.gray, alignment=TA_CENTER))
-    styles.add(ParagraphStyle(name='PaymentTerms', fontSize=10, fontName='Helvetica', textColor=dark_gray, leading=14))
-    styles.add(ParagraphStyle(name='SmallText', fontSize=8, fontName='Helvetica', textColor=dark_gray))
+    styles = _INVOICE_STYLES
     
     elements = []
     
     # Header section
-    logo_path = Path(__file__).parent.parent / 'frontend' / 'public' / 'servex-logo.png'
-    
     left_content = []
-    if logo_path.exists():
-        try:
-            from PIL import Image as PILImage
-            img = PILImage.open(logo_path)
-            aspect = img.height / img.width
-            logo = Image(str(logo_path), width=100, height=100*aspect)
-            left_content.append(logo)
-        except Exception:
-            left_content.append(Paragraph("SERVEX HOLDINGS", styles['CompanyName']))
+    if _LOGO_SIZE:
+        logo_width, logo_height = _LOGO_SIZE
+        left_content.append(Image(str(_LOGO_PATH), width=logo_width, height=logo_height))
     else:
         left_content.append(Paragraph("SERVEX HOLDINGS", styles['CompanyName']))
     
@@ -273,8 +317,8 @@ async def generate_invoice_pdf(
             dimensions,
             str(int(qty)),
             format_weight(weight),
-            format_currency(rate, currency),
-            format_currency(amount, currency)
+            money(rate),
+            money(amount)
         ])
     
     if not line_items:
@@ -286,7 +330,7 @@ async def generate_invoice_pdf(
     
     # Table styling
     table_style = [
-        ('BACKGROUND', (0, 0), (-1, 0), olive),
+        ('BACKGROUND', (0, 0), (-1, 0), _OLIVE),
         ('TEXTCOLOR', (0, 0), (-1, 0), colors.white),
         ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
         ('FONTSIZE', (0, 0), (-1, 0), 9),
@@ -302,7 +346,7 @@ async def generate_invoice_pdf(
     # Alternating row colors
     for i in range(1, len(table_data)):
         if i % 2 == 0:
-            table_style.append(('BACKGROUND', (0, i), (-1, i), light_gray))
+            table_style.append(('BACKGROUND', (0, i), (-1, i), _LIGHT_GRAY))
     
     items_table.setStyle(TableStyle(table_style))
     elements.append(items_table)
@@ -323,7 +367,7 @@ async def generate_invoice_pdf(
             amt = adj.get("amount", 0)
             adj_data.append([
                 adj.get("description", "Adjustment"),
-                f"{sign} {format_currency(amt, currency)}"
+                f"{sign} {money(amt)}"
             ])
         
         adj_table = Table(adj_data, colWidths=[130*mm, 30*mm])
@@ -342,18 +386,18 @@ async def generate_invoice_pdf(
     outstanding = total - paid_amount
     
     totals_data = [
-        ['Subtotal:', format_currency(subtotal, currency)],
+        ['Subtotal:', money(subtotal)],
     ]
     
     if adj_total != 0:
         sign = "+" if adj_total >= 0 else ""
-        totals_data.append(['Adjustments:', f"{sign}{format_currency(adj_total, currency)}"])
+        totals_data.append(['Adjustments:', f"{sign}{money(adj_total)}"])
     
-    totals_data.append(['TOTAL:', format_currency(total, currency)])
+    totals_data.append(['TOTAL:', money(total)])
     
     if paid_amount > 0:
-        totals_data.append(['Paid:', format_currency(paid_amount, currency)])
-        totals_data.append(['Outstanding:', format_currency(outstanding, currency)])
+        totals_data.append(['Paid:', money(paid_amount)])
+        totals_data.append(['Outstanding:', money(outstanding)])
     
     totals_table = Table(totals_data, colWidths=[130*mm, 40*mm])
     totals_style = [
@@ -366,7 +410,7 @@ async def generate_invoice_pdf(
     total_row_idx = 2 if adj_total != 0 else 1
     totals_style.append(('FONTNAME', (0, total_row_idx), (-1, total_row_idx), 'Helvetica-Bold'))
     totals_style.append(('FONTSIZE', (0, total_row_idx), (-1, total_row_idx), 12))
-    totals_style.append(('TEXTCOLOR', (1, total_row_idx), (1, total_row_idx), olive))
+    totals_style.append(('TEXTCOLOR', (1, total_row_idx), (1, total_row_idx), _OLIVE))
     
     totals_table.setStyle(TableStyle(totals_style))
     elements.append(totals_table)
@@ -401,17 +445,90 @@ async def generate_invoice_pdf(
     
     # Footer
     elements.append(Paragraph(
-        f"Generated on {datetime.now().strftime('%Y-%m-%d %H:%M')} | Servex Holdings (Pty) Ltd | Thank you for your business",
+        f"Generated on {generated_at} | Servex Holdings (Pty) Ltd | Thank you for your business",
         styles['FooterStyle']
     ))
     
     # Build PDF
     doc.build(elements)
-    buffer.seek(0)
+    return buffer.getvalue()
+
+
+async def generate_invoice_pdf(
+    invoice_id: str,
+    tenant_id: str
+):
+    """Generate a professional PDF invoice with full client and recipient details"""
+    
+    # Fetch invoice with all related data in one round-trip
+    per_invoice = [{"$project": {"_id": 0}}, {"$limit": 100}]
+    results = await db.invoices.aggregate([
+        {"$match": {"id": invoice_id, "tenant_id": tenant_id}},
+        {"$limit": 1},
+        {"$project": {"_id": 0}},
+        {"$lookup": {
+            "from": "clients",
+            "localField": "client_id",
+            "foreignField": "id",
+            "pipeline": [{"$match": {"tenant_id": tenant_id}}, {"$project": {"_id": 0}}],
+            "as": "_client"
+        }},
+        {"$lookup": {
+            "from": "invoice_line_items",
+            "localField": "id",
+            "foreignField": "invoice_id",
+            "pipeline": per_invoice,
+            "as": "_line_items"
+        }},
+        # Shipments for recipient details, matched through the joined line items
+        {"$lookup": {
+            "from": "shipments",
+            "localField": "_line_items.shipment_id",
+            "foreignField": "id",
+            "pipeline": per_invoice,
+            "as": "_shipments"
+        }},
+        {"$lookup": {
+            "from": "invoice_adjustments",
+            "localField": "id",
+            "foreignField": "invoice_id",
+            "pipeline": per_invoice,
+            "as": "_adjustments"
+        }},
+        {"$lookup": {
+            "from": "payments",
+            "localField": "id",
+            "foreignField": "invoice_id",
+            "pipeline": per_invoice,
+            "as": "_payments"
+        }}
+    ]).to_list(1)
+    if not results:
+        raise HTTPException(status_code=404, detail="Invoice not found")
+    
+    invoice = results[0]
+    client = next(iter(invoice.pop("_client")), None)
+    line_items = invoice.pop("_line_items")
+    shipments = {s["id"]: s for s in invoice.pop("_shipments")}
+    adjustments = invoice.pop("_adjustments")
+    payments = invoice.pop("_payments")
+    
+    # Reuse the rendered PDF while the invoice data is unchanged
+    fingerprint = hashlib.sha256(
+        repr((invoice, client, line_items, shipments, adjustments, payments)).encode()
+    ).hexdigest()
+    generated_at = datetime.now().strftime('%Y-%m-%d %H:%M')
+    cache_key = (tenant_id, invoice_id, generated_at, fingerprint)
+    pdf_bytes = _invoice_pdf_cache.get(cache_key)
+    if pdf_bytes is None:
+        pdf_bytes = await run_pdf_render(
+            render_invoice_pdf, invoice, client, line_items, shipments, adjustments, payments, generated_at
+        )
+        _invoice_pdf_cache[cache_key] = pdf_bytes
     
     filename = f"Invoice-{invoice.get('invoice_number', invoice_id)}.pdf"
     return StreamingResponse(
-        buffer,
+        BytesIO(pdf_bytes),
         media_type="application/pdf",
         headers={"Content-Disposition": f"attachment; filename={filename}"}
     )
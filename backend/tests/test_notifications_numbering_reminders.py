@@ -0,0 +1,339 @@
+"""
+Notification summary, invoice numbering and compliance reminder tests
+Tests:
+- GET /api/notifications/summary - Latest notifications and unread count in one call
+- Invoice numbers stay continuous across manual (POST /api/invoices) and
+  trip (POST /api/trips/{id}/generate-invoices) invoices
+- GET /api/reminders - Compliance items land in the right urgency bucket
+"""
+import pytest
+import requests
+import os
+import re
+import uuid
+from datetime import datetime, timedelta, timezone
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', '').rstrip('/')
+AUTH_EMAIL = "admin@servex.com"
+AUTH_PASSWORD = "Servex2026!"
+
+INVOICE_NUMBER_RE = re.compile(r"^INV-(\d{4})-(\d{3,})$")
+
+
+@pytest.fixture(scope="module")
+def session():
+    """Create authenticated session"""
+    s = requests.Session()
+    s.headers.update({"Content-Type": "application/json"})
+
+    # Login
+    login_resp = s.post(f"{BASE_URL}/api/auth/login", json={
+        "email": AUTH_EMAIL,
+        "password": AUTH_PASSWORD
+    })
+    assert login_resp.status_code == 200, f"Login failed: {login_resp.text}"
+    print(f"✓ Logged in as {AUTH_EMAIL}")
+    return s
+
+
+@pytest.fixture(scope="module")
+def current_user(session):
+    """The logged in user"""
+    resp = session.get(f"{BASE_URL}/api/auth/me")
+    assert resp.status_code == 200
+    return resp.json()
+
+
+def parse_invoice_number(invoice_number):
+    """Split INV-YYYY-NNN into (year, sequence)"""
+    match = INVOICE_NUMBER_RE.match(invoice_number or "")
+    assert match, f"Unexpected invoice number format: {invoice_number}"
+    return int(match.group(1)), int(match.group(2))
+
+
+class TestNotificationSummary:
+    """GET /api/notifications/summary"""
+
+    notification_id = None
+
+    def test_summary_payload_shape(self, session):
+        """Summary returns the latest items and the unread count"""
+        response = session.get(f"{BASE_URL}/api/notifications/summary")
+        assert response.status_code == 200, f"Summary failed: {response.text}"
+
+        data = response.json()
+        assert set(data) == {"items", "unread_count"}
+        assert isinstance(data["items"], list)
+        assert isinstance(data["unread_count"], int)
+        assert len(data["items"]) <= 50
+
+        for item in data["items"]:
+            assert "id" in item
+            assert "title" in item
+            assert "_id" not in item
+        print(f"✓ Summary: {len(data['items'])} items, {data['unread_count']} unread")
+
+    def test_new_notification_counted_as_unread(self, session, current_user):
+        """A new notification appears first and raises the unread count"""
+        before = session.get(f"{BASE_URL}/api/notifications/summary").json()
+
+        payload = {
+            "user_id": current_user["id"],
+            "type": "system_event",
+            "title": f"TEST_Summary_{uuid.uuid4().hex[:6]}",
+            "message": "Notification summary test"
+        }
+        create_resp = session.post(f"{BASE_URL}/api/notifications", json=payload)
+        assert create_resp.status_code == 200, f"Create notification failed: {create_resp.text}"
+        TestNotificationSummary.notification_id = create_resp.json()["id"]
+
+        after = session.get(f"{BASE_URL}/api/notifications/summary").json()
+        assert after["unread_count"] == before["unread_count"] + 1
+        assert after["items"][0]["id"] == TestNotificationSummary.notification_id
+        assert after["items"][0]["title"] == payload["title"]
+        print(f"✓ Unread count went from {before['unread_count']} to {after['unread_count']}")
+
+    def test_unread_count_matches_count_endpoint(self, session):
+        """Summary and /notifications/count agree on the unread count"""
+        summary = session.get(f"{BASE_URL}/api/notifications/summary").json()
+        count_resp = session.get(f"{BASE_URL}/api/notifications/count")
+        assert count_resp.status_code == 200
+        assert count_resp.json()["unread_count"] == summary["unread_count"]
+        print(f"✓ Both endpoints report {summary['unread_count']} unread")
+
+    def test_read_notification_leaves_unread_count(self, session):
+        """Marking the notification read lowers the unread count"""
+        assert TestNotificationSummary.notification_id, "No notification from create test"
+        before = session.get(f"{BASE_URL}/api/notifications/summary").json()
+
+        read_resp = session.put(
+            f"{BASE_URL}/api/notifications/{TestNotificationSummary.notification_id}/read"
+        )
+        assert read_resp.status_code == 200
+
+        after = session.get(f"{BASE_URL}/api/notifications/summary").json()
+        assert after["unread_count"] == before["unread_count"] - 1
+
+        count_resp = session.get(f"{BASE_URL}/api/notifications/count")
+        assert count_resp.json()["unread_count"] == after["unread_count"]
+        print(f"✓ Unread count dropped to {after['unread_count']}")
+
+
+class TestInvoiceNumberContinuity:
+    """Manual and trip invoices draw from the same invoice number sequence"""
+
+    @pytest.fixture(scope="class")
+    def test_client(self, session):
+        """Create a test client for invoice tests"""
+        client_data = {
+            "name": f"TEST_Numbering_Client_{uuid.uuid4().hex[:6]}",
+            "phone": "+27821234567",
+            "email": "testnumbering@test.com",
+            "default_currency": "ZAR",
+            "default_rate_type": "per_kg",
+            "default_rate_value": 36.0
+        }
+        resp = session.post(f"{BASE_URL}/api/clients", json=client_data)
+        assert resp.status_code == 200, f"Failed to create client: {resp.text}"
+        client = resp.json()
+        yield client
+        # Cleanup
+        try:
+            session.delete(f"{BASE_URL}/api/clients/{client['id']}")
+        except:
+            pass
+
+    @pytest.fixture(scope="class")
+    def test_trip(self, session, test_client):
+        """Create a trip with one parcel for the test client"""
+        trip_data = {
+            "trip_number": f"TEST-NUM-{uuid.uuid4().hex[:6].upper()}",
+            "route": ["Johannesburg", "Harare"],
+            "departure_date": datetime.now(timezone.utc).strftime("%Y-%m-%d")
+        }
+        trip_resp = session.post(f"{BASE_URL}/api/trips", json=trip_data)
+        assert trip_resp.status_code == 200, f"Failed to create trip: {trip_resp.text}"
+        trip = trip_resp.json()
+
+        shipment_data = {
+            "client_id": test_client["id"],
+            "trip_id": trip["id"],
+            "description": "TEST_Numbering_Parcel",
+            "destination": "Harare",
+            "total_pieces": 1,
+            "total_weight": 12.5
+        }
+        ship_resp = session.post(f"{BASE_URL}/api/shipments", json=shipment_data)
+        assert ship_resp.status_code == 200, f"Failed to create shipment: {ship_resp.text}"
+        shipment = ship_resp.json()
+        yield trip
+        # Cleanup
+        try:
+            session.delete(f"{BASE_URL}/api/shipments/{shipment['id']}")
+            session.delete(f"{BASE_URL}/api/trips/{trip['id']}")
+        except:
+            pass
+
+    def create_manual_invoice(self, session, client_id):
+        """Create a draft manual invoice and return it"""
+        invoice_data = {
+            "client_id": client_id,
+            "currency": "ZAR",
+            "line_items": [{"description": "TEST - Numbering", "quantity": 1, "rate": 36, "amount": 36}],
+            "adjustments": [],
+            "total": 36,
+            "status": "draft"
+        }
+        resp = session.post(f"{BASE_URL}/api/invoices", json=invoice_data)
+        assert resp.status_code == 200, f"Failed to create invoice: {resp.text}"
+        return resp.json()
+
+    def delete_client_invoices(self, session, client_id):
+        """Remove every invoice raised for the test client"""
+        resp = session.get(f"{BASE_URL}/api/invoices", params={"client_id": client_id})
+        for invoice in resp.json():
+            session.delete(f"{BASE_URL}/api/invoices/{invoice['id']}")
+
+    def test_numbers_continue_across_manual_and_trip_invoices(self, session, test_client, test_trip):
+        """manual -> trip -> manual invoices get consecutive numbers"""
+        try:
+            first = self.create_manual_invoice(session, test_client["id"])
+
+            gen_resp = session.post(f"{BASE_URL}/api/trips/{test_trip['id']}/generate-invoices")
+            assert gen_resp.status_code == 200, f"Generate invoices failed: {gen_resp.text}"
+            generated = gen_resp.json()["invoices"]
+            assert len(generated) == 1, f"Expected one trip invoice, got {generated}"
+
+            last = self.create_manual_invoice(session, test_client["id"])
+
+            first_year, first_seq = parse_invoice_number(first["invoice_number"])
+            trip_year, trip_seq = parse_invoice_number(generated[0]["invoice_number"])
+            last_year, last_seq = parse_invoice_number(last["invoice_number"])
+
+            assert first_year == trip_year == last_year == datetime.now(timezone.utc).year
+            assert trip_seq == first_seq + 1, \
+                f"Trip invoice {generated[0]['invoice_number']} does not follow {first['invoice_number']}"
+            assert last_seq == trip_seq + 1, \
+                f"Manual invoice {last['invoice_number']} does not follow {generated[0]['invoice_number']}"
+            print(f"✓ Consecutive numbers: {first['invoice_number']}, "
+                  f"{generated[0]['invoice_number']}, {last['invoice_number']}")
+        finally:
+            self.delete_client_invoices(session, test_client["id"])
+
+    def test_regenerating_trip_invoices_reserves_no_numbers(self, session, test_client, test_trip):
+        """Re-running generation for an invoiced trip does not skip numbers"""
+        gen_resp = session.post(f"{BASE_URL}/api/trips/{test_trip['id']}/generate-invoices")
+        assert gen_resp.status_code == 200
+        generated = gen_resp.json()["invoices"]
+        assert len(generated) == 1
+
+        try:
+            again = session.post(f"{BASE_URL}/api/trips/{test_trip['id']}/generate-invoices")
+            assert again.status_code == 200
+            assert again.json()["invoices"] == [], "Invoiced clients should not be invoiced again"
+
+            manual = self.create_manual_invoice(session, test_client["id"])
+
+            _, trip_seq = parse_invoice_number(generated[0]["invoice_number"])
+            _, manual_seq = parse_invoice_number(manual["invoice_number"])
+            assert manual_seq == trip_seq + 1
+            print(f"✓ No gap after regeneration: {generated[0]['invoice_number']} -> {manual['invoice_number']}")
+        finally:
+            self.delete_client_invoices(session, test_client["id"])
+
+
+class TestReminderBuckets:
+    """GET /api/reminders groups compliance items by urgency"""
+
+    @pytest.fixture(scope="class")
+    def test_vehicle(self, session):
+        """Create a test vehicle with one compliance item per bucket"""
+        vehicle_data = {
+            "name": "TEST_Reminder Bucket Truck",
+            "registration_number": f"TEST-RB-{uuid.uuid4().hex[:6].upper()}"
+        }
+        resp = session.post(f"{BASE_URL}/api/vehicles", json=vehicle_data)
+        assert resp.status_code == 200, f"Failed to create vehicle: {resp.text}"
+        vehicle = resp.json()
+
+        # Reminder window wide enough that every item is due for a reminder
+        today = datetime.now(timezone.utc).date()
+        expiries = {
+            "overdue": today - timedelta(days=1),
+            "due_this_week": today + timedelta(days=3),
+            "due_this_month": today + timedelta(days=20),
+            "upcoming": today + timedelta(days=50)
+        }
+        compliance_ids = {}
+        for bucket, expiry in expiries.items():
+            payload = {
+                "item_type": "custom",
+                "item_label": f"TEST_{bucket}",
+                "expiry_date": expiry.isoformat(),
+                "reminder_days_before": 60
+            }
+            item_resp = session.post(f"{BASE_URL}/api/vehicles/{vehicle['id']}/compliance", json=payload)
+            assert item_resp.status_code == 200, f"Failed to add compliance: {item_resp.text}"
+            compliance_ids[bucket] = item_resp.json()["id"]
+
+        yield vehicle, compliance_ids
+        # Cleanup
+        try:
+            session.delete(f"{BASE_URL}/api/vehicles/{vehicle['id']}")
+        except:
+            pass
+
+    def test_items_land_in_expected_buckets(self, session, test_vehicle):
+        """Each compliance item is reported in exactly its urgency bucket"""
+        vehicle, compliance_ids = test_vehicle
+        response = session.get(f"{BASE_URL}/api/reminders")
+        assert response.status_code == 200
+
+        reminders = response.json()["reminders"]
+        assert set(reminders) == {"overdue", "due_this_week", "due_this_month", "upcoming"}
+
+        for bucket, compliance_id in compliance_ids.items():
+            found_in = [
+                name for name, items in reminders.items()
+                if any(item["compliance_id"] == compliance_id for item in items)
+            ]
+            assert found_in == [bucket], f"TEST_{bucket} reported in {found_in}"
+
+        entry = next(
+            item for item in reminders["overdue"]
+            if item["compliance_id"] == compliance_ids["overdue"]
+        )
+        assert entry["type"] == "vehicle"
+        assert entry["entity_id"] == vehicle["id"]
+        assert entry["registration"] == vehicle["registration_number"]
+        assert entry["item_label"] == "TEST_overdue"
+        print("✓ Compliance items grouped into overdue, due_this_week, due_this_month and upcoming")
+
+    def test_buckets_sorted_and_summary_matches(self, session, test_vehicle):
+        """Buckets are sorted by expiry and the summary counts match them"""
+        data = session.get(f"{BASE_URL}/api/reminders").json()
+        reminders, summary = data["reminders"], data["summary"]
+
+        for bucket, items in reminders.items():
+            expiries = [item["expiry_date"] for item in items]
+            assert expiries == sorted(expiries), f"{bucket} not sorted by expiry"
+            assert summary[bucket] == len(items)
+        assert summary["total"] == sum(len(items) for items in reminders.values())
+        print(f"✓ Reminder summary: {summary}")
+
+    def test_deleted_item_leaves_reminders(self, session, test_vehicle):
+        """Deleting a compliance item drops it from the (cached) reminders"""
+        vehicle, compliance_ids = test_vehicle
+        session.get(f"{BASE_URL}/api/reminders")
+
+        del_resp = session.delete(
+            f"{BASE_URL}/api/vehicles/{vehicle['id']}/compliance/{compliance_ids['due_this_week']}"
+        )
+        assert del_resp.status_code == 200
+
+        reminders = session.get(f"{BASE_URL}/api/reminders").json()["reminders"]
+        assert not any(
+            item["compliance_id"] == compliance_ids["due_this_week"]
+            for items in reminders.values() for item in items
+        )
+        print("✓ Deleted compliance item no longer reported")
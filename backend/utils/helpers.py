@@ -5,10 +5,23 @@ Contains shared helper functions for audit logging, notifications, and date calc
 from typing import Optional
 from datetime import datetime, timezone, timedelta
 
+from cachetools import TTLCache
+
 from database import db
 from models.enums import AuditAction, NotificationType
 from models.schemas import AuditLog, Notification
 
+# Tenant default rate settings rarely change; cache them for a few minutes
+_tenant_defaults_cache = TTLCache(maxsize=1000, ttl=300)
+
+# Unread notification counts are polled constantly; writers drop the entry,
+# and the short TTL bounds staleness from any writer that doesn't
+_unread_count_cache = TTLCache(maxsize=10000, ttl=60)
+
+# Dashboard stats span clients, shipments and trips; writes to any of them
+# drop the tenant's entry, and the TTL bounds staleness across processes
+_dashboard_stats_cache = TTLCache(maxsize=1000, ttl=30)
+
 
 def calculate_due_date(payment_terms_days: int) -> str:
     """
@@ -24,6 +37,77 @@ def calculate_due_date(payment_terms_days: int) -> str:
     return due.strftime("%Y-%m-%d")
 
 
+async def get_tenant_defaults(tenant_id: str) -> Optional[dict]:
+    """
+    Get a tenant's default rate settings, cached in-process.
+    
+    Args:
+        tenant_id: Tenant ID
+    
+    Returns:
+        Dict with default_rate_value/default_rate_type (either may be absent),
+        or None if the tenant does not exist
+    """
+    tenant = _tenant_defaults_cache.get(tenant_id)
+    if tenant is None:
+        tenant = await db.tenants.find_one(
+            {"id": tenant_id},
+            {"_id": 0, "default_rate_value": 1, "default_rate_type": 1}
+        )
+        if tenant is not None:
+            _tenant_defaults_cache[tenant_id] = tenant
+    return tenant
+
+
+def invalidate_tenant_defaults(tenant_id: str):
+    """Drop a tenant's cached default rate settings (call after updating the tenant)."""
+    _tenant_defaults_cache.pop(tenant_id, None)
+
+
+async def get_invoice_display_fields(
+    tenant_id: str,
+    client_id: Optional[str],
+    trip_id: Optional[str],
+    client: Optional[dict] = None
+) -> dict:
+    """
+    Build the client/trip display fields denormalised onto invoice documents.
+    
+    Finance views read these straight off the invoice instead of looking up
+    clients and trips. They are kept in sync when a client or trip is renamed.
+    
+    Args:
+        tenant_id: Tenant ID
+        client_id: Invoice client ID
+        trip_id: Invoice trip ID (optional)
+        client: Client document if the caller already has it
+    
+    Returns:
+        Dict of client_name, client_email, client_phone, client_whatsapp, trip_number
+    """
+    if client is None and client_id:
+        client = await db.clients.find_one(
+            {"id": client_id, "tenant_id": tenant_id},
+            {"_id": 0, "name": 1, "email": 1, "phone": 1, "whatsapp": 1}
+        )
+    client = client or {}
+    
+    trip = None
+    if trip_id:
+        trip = await db.trips.find_one(
+            {"id": trip_id, "tenant_id": tenant_id},
+            {"_id": 0, "trip_number": 1}
+        )
+    
+    return {
+        "client_name": client.get("name"),
+        "client_email": client.get("email"),
+        "client_phone": client.get("phone"),
+        "client_whatsapp": client.get("whatsapp"),
+        "trip_number": trip.get("trip_number") if trip else None
+    }
+
+
 async def create_audit_log(
     tenant_id: str,
     user_id: str,
@@ -105,4 +189,53 @@ async def create_notification(
         link_url=link_url
     )
     await db.notifications.insert_one(notification.model_dump())
+    invalidate_unread_count(tenant_id, user_id)
     return notification
+
+
+async def get_unread_notification_count(tenant_id: str, user_id: str) -> int:
+    """
+    Get a user's unread notification count, cached in-process.
+    
+    Args:
+        tenant_id: Tenant ID
+        user_id: User ID
+    
+    Returns:
+        Number of notifications without read_at
+    """
+    key = (tenant_id, user_id)
+    count = _unread_count_cache.get(key)
+    if count is None:
+        count = await db.notifications.count_documents({
+            "tenant_id": tenant_id,
+            "user_id": user_id,
+            "read_at": None
+        })
+        _unread_count_cache[key] = count
+    return count
+
+
+def seed_unread_count(tenant_id: str, user_id: str, count: int):
+    """Cache a user's unread notification count computed elsewhere (e.g. alongside the list)."""
+    _unread_count_cache[(tenant_id, user_id)] = count
+
+
+def invalidate_unread_count(tenant_id: str, user_id: str):
+    """Drop a user's cached unread notification count (call after notifications change)."""
+    _unread_count_cache.pop((tenant_id, user_id), None)
+
+
+def get_cached_dashboard_stats(tenant_id: str) -> Optional[dict]:
+    """Get a tenant's cached dashboard stats (None when not cached)."""
+    return _dashboard_stats_cache.get(tenant_id)
+
+
+def cache_dashboard_stats(tenant_id: str, stats: dict):
+    """Cache a tenant's freshly computed dashboard stats."""
+    _dashboard_stats_cache[tenant_id] = stats
+
+
+def invalidate_dashboard_cache(tenant_id: str):
+    """Drop a tenant's cached dashboard stats (call after client, shipment or trip writes)."""
+    _dashboard_stats_cache.pop(tenant_id, None)